@@ -1,17 +1,37 @@
-import base64
+# 启动计时器最先导入，以脚本开始执行的时间作为启动起点
+from startup_timing import STARTUP_TIMER, lazy_import
+
 import hashlib
+import os
+import tempfile
+import uuid
 
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import plotly.graph_objects as go
 import streamlit as st
 
-from db_utils import (get_all_predictions, get_prediction_details,
-                      get_predictions_by_user, save_prediction)
+from batch_scoring import (DEFAULT_CHUNK_SIZE, PATIENT_ID_COLUMN, count_rows,
+                           detect_format, read_columns, score_cohort,
+                           validate_columns)
+from db_utils import (count_predictions, get_filter_options,
+                      enqueue_prediction, enqueue_predictions_batch,
+                      get_prediction_details, get_shadow_disagreements,
+                      get_shadow_summary, get_writer,
+                      query_predictions, register_model_version)
 from model_utils import (ALL_FEATURES, BINARY_FEATURES, CONTINUOUS_FEATURES,
-                         DISCRETE_FEATURES, load_models, make_prediction)
-from translations import LANGUAGES, get_text
+                         DEFAULT_NOISE_MODEL, DISCRETE_FEATURES, MODEL_REGISTRY,
+                         NOISE_TYPES, PREDICTION_CACHE, explain_predictions,
+                         features_to_array, load_models, make_prediction,
+                         model_fingerprint, prediction_uncertainty,
+                         sensitivity_range, sensitivity_sweep,
+                         supports_explanation)
+from shadow_scoring import get_shadow_scorer, start_shadow_mode
+from static_assets import get_stylesheet
+from translations import LANGUAGES, get_text, get_translator
+
+# 重量级模块在首次使用时才导入（图表只在预测结果中出现）
+go = lazy_import("plotly.graph_objects")
+pd = lazy_import("pandas")
+
+STARTUP_TIMER.mark("imports")
 
 # 设置页面配置
 st.set_page_config(
@@ -31,228 +51,16 @@ if 'username' not in st.session_state:
 if 'is_admin' not in st.session_state:
     st.session_state['is_admin'] = False
 
-# 自定义CSS样式，美化界面
-def local_css():
-    st.markdown("""
-    <style>
-        /* 应用基础样式 */
-        .main {
-            background-color: #f5f7fa;
-        }
-        .stApp {
-            max-width: 1200px;
-            margin: 0 auto;
-        }
-        
-        /* 语言选择器样式修复 */
-        div[data-testid="stSelectbox"] {
-            overflow: visible !important;
-        }
-        
-        div[data-testid="stSelectbox"] > div {
-            overflow: visible !important;
-        }
-        
-        div[data-testid="stSelectbox"] > div > div {
-            overflow: visible !important;
-            min-height: 40px !important;
-            display: flex !important;
-            align-items: center !important;
-        }
-        
-        div[data-testid="stSelectbox"] label {
-            display: none !important;
-        }
-        
-        /* 下拉菜单层级修复 */
-        div[data-baseweb="popover"] {
-            z-index: 1000 !important;
-        }
-        
-        div[data-baseweb="menu"] {
-            z-index: 1001 !important;
-        }
-        
-        /* 修正所有输入框的样式 */
-        .stTextInput, .stNumberInput {
-            width: 100% !important; 
-            overflow: visible !important;
-            margin-bottom: 20px !important;
-            position: relative !important;
-            z-index: 1 !important;
-        }
-        
-        /* 确保输入框内的元素完全可见 */
-        .stTextInput > div, .stNumberInput > div {
-            width: 100% !important;
-            overflow: visible !important;
-            height: auto !important;
-            min-height: 40px !important;
-        }
-        
-        /* 输入框样式 */
-        .stTextInput input, .stNumberInput input {
-            width: 100% !important;
-            min-width: 0 !important;
-            font-size: 16px !important;
-            padding: 10px !important;
-            border: 1px solid #ccc !important;
-            border-radius: 4px !important;
-            height: auto !important;
-            min-height: 40px !important;
-            box-sizing: border-box !important;
-        }
-        
-        /* 特征标签样式 */
-        .feature-label {
-            display: block !important;
-            width: 100% !important;
-            font-size: 14px !important;
-            font-weight: 500 !important;
-            color: #1f5386 !important;
-            padding: 0 0 8px 0 !important;
-            line-height: 1.4 !important;
-            min-height: 30px !important;
-            margin-bottom: 5px !important;
-            word-break: break-word !important;
-            overflow-wrap: break-word !important;
-            white-space: normal !important;
-        }
-        
-        /* 特征输入容器样式 */
-        .input-container {
-            margin-bottom: 15px !important;
-            padding: 0 !important;
-            position: relative !important;
-            z-index: 1 !important;
-            overflow: visible !important;
-        }
-        
-        /* 特征容器样式 */
-        .feature-container {
-            background-color: #f8f9fa !important;
-            padding: 20px !important;
-            border-radius: 8px !important;
-            margin-bottom: 20px !important;
-            width: 100% !important;
-            box-sizing: border-box !important;
-            overflow: visible !important;
-        }
-        
-        /* 特征标题容器 */
-        .feature-title-container {
-            background-color: #e6f3ff !important;
-            padding: 10px 15px !important;
-            border-radius: 5px !important;
-            margin-bottom: 15px !important;
-            border-left: 5px solid #1f5386 !important;
-        }
-        
-        /* 特征类别标题 */
-        .feature-title {
-            color: #1f5386 !important;
-            font-size: 16px !important;
-            font-weight: 600 !important;
-            margin: 0 !important;
-            text-align: left !important;
-        }
-        
-        /* 确保表单内容完全显示 */
-        .stForm > div {
-            overflow: visible !important;
-        }
-        
-        /* 确保表单内的所有元素正确显示 */
-        form {
-            overflow: visible !important;
-        }
-        
-        /* 改进列布局 */
-        .row-widget.stHorizontalBlock {
-            gap: 10px !important;
-            margin-bottom: 15px !important;
-            overflow: visible !important;
-            flex-wrap: wrap !important;
-        }
-        
-        .row-widget.stHorizontalBlock > div {
-            flex: 1 1 30% !important;
-            min-width: 0 !important;
-            position: relative !important;
-            z-index: 1 !important;
-            overflow: visible !important;
-        }
-        
-        /* 移除表单的默认边框 */
-        .stForm > div:first-child {
-            border: none !important;
-            box-shadow: none !important;
-            background-color: transparent !important;
-            padding: 0 !important;
-        }
-        
-        /* 改进表单标题样式 */
-        .patient-form-title {
-            background-color: white !important;
-            padding: 20px !important;
-            border-radius: 8px !important;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1) !important;
-            margin-bottom: 20px !important;
-        }
-        
-        /* 调整二元变量选项显示 */
-        .stRadio > div {
-            width: 100% !important;
-        }
-        
-        .stRadio > div > div {
-            display: flex !important;
-            flex-direction: row !important;
-            gap: 20px !important;
-        }
-        
-        /* 确保单选按钮文本完全显示 */
-        .stRadio label span {
-            white-space: normal !important;
-            overflow: visible !important;
-            display: inline-block !important;
-            line-height: 1.2 !important;
-        }
-        
-        /* 移动设备适配 */
-        @media (max-width: 768px) {
-            .row-widget.stHorizontalBlock > div {
-                flex: 1 1 100% !important;
-                max-width: 100% !important;
-            }
-        }
-    </style>
-    """, unsafe_allow_html=True)
-
-local_css()
+# 注入样式表：样式表和背景图片每个进程只生成一次，之后每次重新运行只发送缓存的<style>标签
+def inject_styles():
+    """注入合并后的样式表（包括背景图片）"""
+    st.markdown(get_stylesheet(static_serving=st.get_option("server.enableStaticServing")), unsafe_allow_html=True)
 
-# 修改背景图片功能
-def add_bg_from_local(image_path):
-    """使用本地图片作为背景"""
-    with open(image_path, "rb") as f:
-        encoded = base64.b64encode(f.read()).decode()
-    st.markdown(
-        f"""
-        <style>
-        .stApp {{
-            background-image: url(data:image/png;base64,{encoded});
-            background-attachment: fixed;
-            background-size: cover;
-            background-position: center;
-            background-repeat: no-repeat;
-        }}
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
+inject_styles()
 
-# 使用本地背景图片
-add_bg_from_local("assets/background.jpg")
+# 配置了候选模型时开启影子评分（每个进程只启动一次），候选模型在后台与当前模型对照评分
+start_shadow_mode()
+STARTUP_TIMER.mark("page setup")
 
 # 简化特征名称的函数
 def simplify_feature_name(feature_name):
@@ -297,26 +105,6 @@ def create_unified_language_selector():
     
     # 创建语言选择器
     with st.sidebar:
-        # 添加内联样式，确保当前选择器的正确显示
-        st.markdown("""
-        <style>
-        /* 特定于侧边栏语言选择器的样式 */
-        div.language-section div[data-testid="stSelectbox"] {
-            margin-bottom: 20px !important;
-        }
-        div.language-section div[data-testid="stSelectbox"] > div {
-            overflow: visible !important;
-        }
-        div.language-section div[data-testid="stSelectbox"] > div > div {
-            min-height: 40px !important;
-            padding: 5px 10px !important;
-            overflow: visible !important;
-            border: 1px solid #ccc !important;
-            border-radius: 5px !important;
-        }
-        </style>
-        """, unsafe_allow_html=True)
-        
         # 使用div包装以添加特定样式
         st.markdown('<div class="language-section">', unsafe_allow_html=True)
         st.markdown("<h4 style='color: #1f5386; margin-bottom: 10px;'>Language / 语言</h4>", unsafe_allow_html=True)
@@ -393,9 +181,16 @@ def check_password():
     else:
         return True
 
-# 获取翻译文本的辅助函数
-def get_translated_text(key):
-    return get_text(key, st.session_state['language'])
+# 计算当前模型集的内容指纹并登记到模型版本表（每个进程每个版本只写一次）
+def register_models(models, model_type):
+    """返回模型集的指纹，预测记录通过该指纹引用生成它的模型版本"""
+    fingerprint = model_fingerprint(models[:4], models[4])
+    version = MODEL_REGISTRY.describe(fingerprint) or {}
+    register_model_version(fingerprint, model_type, version.get('source'), version.get('artifacts'))
+    return fingerprint
+
+# 获取翻译文本的辅助函数，绑定当前会话语言的预编译翻译表
+get_translated_text = get_translator(st.session_state['language'])
 
 # 主程序入口
 if check_password():
@@ -443,7 +238,40 @@ if check_password():
             - Dummy Model: Simple predictive model for testing
             - Real Model: Pre-trained machine learning model
             """)
-        
+
+            # 模型注册表统计
+            registry_stats = MODEL_REGISTRY.stats()
+            load_times = ", ".join(f"{path}: {seconds * 1000:.1f} ms" for path, seconds in registry_stats['load_times'].items())
+            st.caption(
+                f"Model registry: {registry_stats['hits']} hits / {registry_stats['misses']} misses / "
+                f"{registry_stats['reloads']} reloads" + (f" ({load_times})" if load_times else "")
+            )
+            for version in MODEL_REGISTRY.versions():
+                st.caption(
+                    f"{get_translated_text('model_fingerprint')} {version['fingerprint'][:12]} ({version['source']})"
+                    + (" — active" if version['active'] else "")
+                )
+            
+            # 预测缓存统计
+            cache_stats = PREDICTION_CACHE.stats()
+            st.caption(
+                f"Prediction cache: {cache_stats['entries']}/{cache_stats['max_entries']} entries, "
+                f"hit rate {cache_stats['hit_rate']:.1%} ({cache_stats['hits']} hits / {cache_stats['misses']} misses), "
+                f"{cache_stats['evictions']} evicted, {cache_stats['expirations']} expired"
+            )
+            
+            # 异步写入队列统计
+            writer_stats = get_writer().stats()
+            st.caption(
+                f"Prediction writer: queue depth {writer_stats['queue_depth']}, {writer_stats['written']} written "
+                f"in {writer_stats['batches']} batches, last flush {writer_stats['last_flush_ms']:.1f} ms "
+                f"(avg {writer_stats['avg_flush_ms']:.1f} ms), {writer_stats['errors']} errors, "
+                f"{writer_stats['spilled']} spilled"
+            )
+            
+            # 启动耗时报告（冷启动时各阶段和延迟导入的耗时）
+            st.text(STARTUP_TIMER.format_report())
+
         st.header(get_translated_text("feature_explanation"))
         
         tabs = st.tabs([
@@ -498,23 +326,14 @@ if check_password():
             st.rerun()
     
     # 创建主页面标签 - 修复标签显示问题
-    tab1, tab2 = st.tabs([
+    tab_labels = [
         get_translated_text("prediction_tab"),
         get_translated_text("history_tab") if st.session_state["is_admin"] else get_translated_text("empty_tab")
-    ])
-    
-    # 修改标签和患者ID之间的间距
-    st.markdown("""
-    <style>
-    /* 移除标签和患者ID之间的白色条 */
-    .stTabs {
-        margin-bottom: 0 !important;
-    }
-    .stTabs + div {
-        margin-top: 0 !important;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    ]
+    if st.session_state["is_admin"]:
+        tab_labels.append(get_translated_text("batch_tab"))
+    main_tabs = st.tabs(tab_labels)
+    tab1, tab2 = main_tabs[0], main_tabs[1]
     
     with tab1:
         # 患者ID输入
@@ -561,31 +380,9 @@ if check_password():
                         default_value = 100.0
                         step = 1.0
                     
-                    # 唯一的容器ID确保样式隔离
+                    # 唯一的容器ID，对应样式表中的 container-* 规则
                     container_id = f"container-cont-{i}"
                     
-                    # 使用自定义样式确保标签和输入框完全显示
-                    st.markdown(f"""
-                    <style>
-                    #{container_id} {{
-                        margin-bottom: 20px !important;
-                        position: relative !important;
-                        z-index: 1 !important;
-                        overflow: visible !important;
-                    }}
-                    #{container_id} .feature-label {{
-                        font-size: 14px !important;
-                        font-weight: 500 !important;
-                        color: #1f5386 !important;
-                        margin-bottom: 8px !important;
-                        line-height: 1.4 !important;
-                        display: block !important;
-                        white-space: normal !important;
-                        word-break: break-word !important;
-                    }}
-                    </style>
-                    """, unsafe_allow_html=True)
-                    
                     # 使用带唯一ID的容器
                     st.markdown(f'<div id="{container_id}" class="input-container">', unsafe_allow_html=True)
                     st.markdown(f'<label class="feature-label">{feature}</label>', unsafe_allow_html=True)
@@ -615,31 +412,9 @@ if check_password():
             for i, feature in enumerate(DISCRETE_FEATURES):
                 col_idx = i % 3
                 with cols[col_idx]:
-                    # 唯一的容器ID确保样式隔离
+                    # 唯一的容器ID，对应样式表中的 container-* 规则
                     container_id = f"container-disc-{i}"
                     
-                    # 使用自定义样式确保标签和输入框完全显示
-                    st.markdown(f"""
-                    <style>
-                    #{container_id} {{
-                        margin-bottom: 20px !important;
-                        position: relative !important;
-                        z-index: 1 !important;
-                        overflow: visible !important;
-                    }}
-                    #{container_id} .feature-label {{
-                        font-size: 14px !important;
-                        font-weight: 500 !important;
-                        color: #1f5386 !important;
-                        margin-bottom: 8px !important;
-                        line-height: 1.4 !important;
-                        display: block !important;
-                        white-space: normal !important;
-                        word-break: break-word !important;
-                    }}
-                    </style>
-                    """, unsafe_allow_html=True)
-                    
                     # 使用带唯一ID的容器
                     st.markdown(f'<div id="{container_id}" class="input-container">', unsafe_allow_html=True)
                     st.markdown(f'<label class="feature-label">{feature}</label>', unsafe_allow_html=True)
@@ -685,39 +460,9 @@ if check_password():
                     </div>
                     """, unsafe_allow_html=True)
                     
-                    # 创建唯一的CSS类名，确保样式只应用于当前单选按钮
+                    # 唯一的CSS类名，对应样式表中的 binary-options-* 规则
                     unique_class = f"binary-options-{i}"
                     
-                    # 添加自定义CSS优化单选按钮显示
-                    st.markdown(f"""
-                    <style>
-                    /* 优化当前单选按钮组的样式 */
-                    .{unique_class} div[data-testid="stRadio"] > div > div {{
-                        display: flex !important;
-                        justify-content: space-between !important;
-                        gap: 15px !important;
-                        margin-top: 5px !important;
-                    }}
-                    .{unique_class} div[data-testid="stRadio"] > div > div > label {{
-                        flex: 1 !important;
-                        padding: 8px 5px !important;
-                        border: 1px solid #ddd !important;
-                        border-radius: 5px !important;
-                        text-align: center !important;
-                        font-size: 14px !important;
-                        cursor: pointer !important;
-                        transition: all 0.2s !important;
-                    }}
-                    .{unique_class} div[data-testid="stRadio"] > div > div > label:hover {{
-                        background-color: #f0f8ff !important;
-                        border-color: #4c9be8 !important;
-                    }}
-                    .{unique_class} div[data-testid="stRadio"] > div > div > label > div:first-child {{
-                        margin-right: 5px !important;
-                    }}
-                    </style>
-                    """, unsafe_allow_html=True)
-                    
                     # 使用唯一类名包装单选按钮
                     st.markdown(f'<div class="{unique_class}">', unsafe_allow_html=True)
                     data[feature] = st.radio(
@@ -732,21 +477,6 @@ if check_password():
             
             # 提交按钮
             submit_button = st.form_submit_button(get_translated_text("predict_button"))
-            st.markdown("""
-            <style>
-            div.stButton > button:first-child {
-                width: 100%;
-                height: 3em;
-                font-size: 16px;
-                font-weight: bold;
-                background-color: #4c9be8;
-                color: white;
-            }
-            div.stButton > button:hover {
-                background-color: #3d8bd5;
-            }
-            </style>
-            """, unsafe_allow_html=True)
         
         # 如果用户点击了提交按钮，则进行预测
         if submit_button:
@@ -755,23 +485,38 @@ if check_password():
                 # 加载模型
                 models = load_models(use_dummy=st.session_state['use_dummy_model'])
                 gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta, scaler = models
+                model_type = "Dummy Model" if st.session_state['use_dummy_model'] else "Real Model"
+                fingerprint = register_models(models, model_type)
                 
-                # 进行预测
-                prediction, probability = make_prediction(data, (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta), scaler)
+                # 进行预测，prediction_uid将预测记录与影子评分结果关联起来
+                prediction_uid = uuid.uuid4().hex
+                prediction, probability = make_prediction(
+                    data, (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta), scaler, prediction_uid=prediction_uid
+                )
                 
                 # 使用新的session state变量获取用户名
                 current_username = st.session_state.get("current_username", "unknown")
                 
-                # 保存预测记录到数据库
-                save_prediction(
+                # 将预测记录放入异步写入队列，由后台线程批量写入数据库
+                enqueue_prediction(
                     patient_id=patient_id,
                     username=current_username,  # 使用新的session state变量
                     features=data,
                     prediction_result=prediction,
                     probability=probability,
-                    model_type="Dummy Model" if st.session_state['use_dummy_model'] else "Real Model"
+                    model_type=model_type,
+                    model_fingerprint=fingerprint,
+                    prediction_uid=prediction_uid
                 )
                 
+                # 保存本次预测，假设分析在之后的每次重新运行中以此为基准
+                st.session_state['last_prediction'] = {
+                    'patient_id': patient_id,
+                    'data': dict(data),
+                    'probability': probability,
+                    'use_dummy': st.session_state['use_dummy_model']
+                }
+                
                 # 显示预测结果
                 st.markdown(f"""
                 <div style="background-color: white; padding: 20px; border-radius: 8px; box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1); margin-top: 30px;">
@@ -848,73 +593,69 @@ if check_password():
                 </div>
                 """, unsafe_allow_html=True)
                 
-                # 创建虚拟的特征重要性
-                np.random.seed(42)  # 设置随机种子以获得一致的结果
-                feature_importance = {}
-                for i, feature in enumerate(ALL_FEATURES):
-                    # 为每个特征分配一个随机的重要性值
-                    importance_value = np.random.uniform(0, 1)
-                    # 使用简化的特征名
-                    simplified_name = simplify_feature_name(feature)
-                    feature_importance[simplified_name] = importance_value
-                
-                # 将特征重要性转换为DataFrame并排序
-                importance_df = pd.DataFrame({
-                    get_translated_text("feature"): list(feature_importance.keys()),
-                    get_translated_text("importance_score"): list(feature_importance.values())
-                })
-                importance_df = importance_df.sort_values(get_translated_text("importance_score"), ascending=False).reset_index(drop=True)
-                
-                # 只显示前10个最重要的特征
-                top_features = importance_df.head(10)
-                
-                # 使用Plotly创建条形图
-                fig = go.Figure()
-                fig.add_trace(go.Bar(
-                    x=top_features[get_translated_text("importance_score")],
-                    y=top_features[get_translated_text("feature")],
-                    orientation='h',
-                    marker=dict(
-                        color=top_features[get_translated_text("importance_score")],
-                        colorscale='Viridis',
-                        showscale=True,
-                        colorbar=dict(title=get_translated_text("importance_score"))
-                    )
-                ))
-                
-                # 设置图表布局 - 标题左对齐
-                fig.update_layout(
-                    title=dict(
-                        text=get_translated_text("top_features"),
-                        font=dict(size=22, color="#2c3e50"),
-                        x=0.0,  # 设置为0表示左对齐
-                        xanchor="left"  # 确保锚点在左侧
-                    ),
-                    xaxis_title=dict(text=get_translated_text("relative_importance"), font=dict(size=14, color="#2c3e50")),
-                    yaxis_title=dict(text=get_translated_text("feature"), font=dict(size=14, color="#2c3e50")),
-                    height=500,
-                    margin=dict(l=50, r=30, t=80, b=30),  # 增加左右边距
-                    paper_bgcolor="white",
-                    plot_bgcolor="white",
-                    font=dict(size=12, color="#2c3e50"),
-                    xaxis=dict(
-                        gridcolor='#EEEEEE',
-                        showgrid=True,
-                        zeroline=False,
-                        showline=True,
-                        linecolor='#CCCCCC'
-                    ),
-                    yaxis=dict(
-                        gridcolor='#EEEEEE',
-                        showgrid=False,
-                        zeroline=False,
-                        showline=True,
-                        linecolor='#CCCCCC'
+                if supports_explanation(models):
+                    # 计算每个特征对当前患者FBTP概率的贡献（相对于训练数据的平均患者）
+                    contributions, _ = explain_predictions(features_to_array(data), models[:4], scaler)
+                    
+                    # 将特征贡献转换为DataFrame并按绝对值排序，使用简化的特征名
+                    importance_df = pd.DataFrame({
+                        get_translated_text("feature"): [simplify_feature_name(feature) for feature in ALL_FEATURES],
+                        get_translated_text("importance_score"): contributions[0]
+                    })
+                    order = importance_df[get_translated_text("importance_score")].abs().sort_values(ascending=False).index
+                    importance_df = importance_df.loc[order].reset_index(drop=True)
+                    
+                    # 只显示前10个贡献最大的特征
+                    top_features = importance_df.head(10)
+                    
+                    # 使用Plotly创建条形图，正贡献（倾向FBTP）为绿色，负贡献为红色
+                    fig = go.Figure()
+                    fig.add_trace(go.Bar(
+                        x=top_features[get_translated_text("importance_score")],
+                        y=top_features[get_translated_text("feature")],
+                        orientation='h',
+                        marker=dict(
+                            color=["#27ae60" if value > 0 else "#e74c3c" for value in top_features[get_translated_text("importance_score")]]
+                        )
+                    ))
+                    
+                    # 设置图表布局 - 标题左对齐
+                    fig.update_layout(
+                        title=dict(
+                            text=get_translated_text("top_features"),
+                            font=dict(size=22, color="#2c3e50"),
+                            x=0.0,  # 设置为0表示左对齐
+                            xanchor="left"  # 确保锚点在左侧
+                        ),
+                        xaxis_title=dict(text=get_translated_text("relative_importance"), font=dict(size=14, color="#2c3e50")),
+                        yaxis_title=dict(text=get_translated_text("feature"), font=dict(size=14, color="#2c3e50")),
+                        height=500,
+                        margin=dict(l=50, r=30, t=80, b=30),  # 增加左右边距
+                        paper_bgcolor="white",
+                        plot_bgcolor="white",
+                        font=dict(size=12, color="#2c3e50"),
+                        xaxis=dict(
+                            gridcolor='#EEEEEE',
+                            showgrid=True,
+                            zeroline=True,
+                            zerolinecolor='#999999',
+                            showline=True,
+                            linecolor='#CCCCCC'
+                        ),
+                        yaxis=dict(
+                            gridcolor='#EEEEEE',
+                            showgrid=False,
+                            zeroline=False,
+                            showline=True,
+                            linecolor='#CCCCCC',
+                            autorange="reversed"  # 贡献最大的特征显示在最上方
+                        )
                     )
-                )
-                
-                # 显示图表
-                st.plotly_chart(fig, use_container_width=True)
+                    
+                    # 显示图表
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info(get_translated_text("feature_contribution_unavailable"))
                 
                 # 添加说明
                 st.markdown(f"""
@@ -927,19 +668,201 @@ if check_password():
                     <p style="margin-top: 10px;">{get_translated_text("prediction_disclaimer")}</p>
                 </div>
                 """, unsafe_allow_html=True)
+        
+        # 假设分析：以最近一次预测的患者为基准扫描一个或两个特征，整个网格一次批量预测
+        last_prediction = st.session_state.get('last_prediction')
+        if last_prediction is not None:
+            st.markdown(f"""
+            <div style="background-color: white; padding: 20px; border-radius: 8px; box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1); margin-top: 30px;">
+                <h3 style="color: #2c3e50; border-bottom: 2px solid #4c9be8; padding-bottom: 10px; text-align: left;">{get_translated_text("whatif_title")}</h3>
+                <p style="color: #7f8c8d; font-style: italic; margin-top: 10px;">{get_translated_text("whatif_note").format(patient_id=last_prediction['patient_id'] or '-')}</p>
+            </div>
+            """, unsafe_allow_html=True)
+            
+            sweepable_features = CONTINUOUS_FEATURES + DISCRETE_FEATURES
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                first_feature = st.selectbox(
+                    get_translated_text("whatif_feature"), sweepable_features,
+                    index=sweepable_features.index('Alkaline Phosphatase (ALP) levels'),
+                    format_func=simplify_feature_name, key="whatif_feature_1"
+                )
+            with col2:
+                second_feature = st.selectbox(
+                    get_translated_text("whatif_second_feature"),
+                    [""] + [feature for feature in sweepable_features if feature != first_feature],
+                    format_func=lambda feature: simplify_feature_name(feature) if feature else get_translated_text("whatif_none"),
+                    key="whatif_feature_2"
+                )
+            with col3:
+                # 二维网格的点数为每个坐标轴的点数
+                if second_feature:
+                    n_points = st.slider(get_translated_text("whatif_points"), 10, 150, 60, step=10, key="whatif_points_2d")
+                else:
+                    n_points = st.slider(get_translated_text("whatif_points"), 20, 2000, 200, step=20, key="whatif_points_1d")
+            
+            models = load_models(use_dummy=last_prediction['use_dummy'])
+            patient_data = last_prediction['data']
+            grids = {first_feature: sensitivity_range(first_feature, patient_data[first_feature], models[4], n_points)}
+            if second_feature:
+                grids[second_feature] = sensitivity_range(second_feature, patient_data[second_feature], models[4], n_points)
+            sweep = sensitivity_sweep(patient_data, models[:4], models[4], grids)
+            
+            fig = go.Figure()
+            if second_feature:
+                # 热图的行为第二个特征，列为第一个特征；0.5等高线为FBTP/NFBTP的分界
+                fig.add_trace(go.Heatmap(
+                    x=grids[first_feature], y=grids[second_feature], z=sweep.T,
+                    zmin=0, zmax=1, colorscale="RdYlGn",
+                    colorbar=dict(title=get_translated_text("fbtp_probability"))
+                ))
+                fig.add_trace(go.Contour(
+                    x=grids[first_feature], y=grids[second_feature], z=sweep.T,
+                    contours=dict(start=0.5, end=0.5, coloring="lines"),
+                    line=dict(color="black", width=2), showscale=False, hoverinfo="skip"
+                ))
+                fig.add_trace(go.Scatter(
+                    x=[patient_data[first_feature]], y=[patient_data[second_feature]], mode="markers",
+                    marker=dict(color="black", size=12, symbol="x"), name=get_translated_text("whatif_current")
+                ))
+                yaxis_title = simplify_feature_name(second_feature)
+            else:
+                fig.add_trace(go.Scatter(
+                    x=grids[first_feature], y=sweep, mode="lines",
+                    line=dict(color="#4c9be8", width=3), name=get_translated_text("fbtp_probability")
+                ))
+                fig.add_trace(go.Scatter(
+                    x=[patient_data[first_feature]], y=[last_prediction['probability']], mode="markers",
+                    marker=dict(color="#2c3e50", size=12), name=get_translated_text("whatif_current")
+                ))
+                fig.add_hline(y=0.5, line=dict(color="#999999", dash="dash"))
+                fig.update_yaxes(range=[0, 1])
+                yaxis_title = get_translated_text("fbtp_probability")
+            
+            fig.update_layout(
+                xaxis_title=simplify_feature_name(first_feature),
+                yaxis_title=yaxis_title,
+                height=450,
+                margin=dict(l=50, r=30, t=30, b=50),
+                paper_bgcolor="white",
+                plot_bgcolor="white",
+                font=dict(size=12, color="#2c3e50"),
+                showlegend=not second_feature
+            )
+            st.plotly_chart(fig, use_container_width=True)
+            
+            # 不确定性分析：按测量噪声模型抽样扰动患者特征，一次批量预测得到概率区间
+            with st.expander(get_translated_text("uncertainty_title"), expanded=False):
+                st.caption(get_translated_text("uncertainty_note"))
+                noise_df = st.data_editor(
+                    pd.DataFrame({
+                        'feature': list(DEFAULT_NOISE_MODEL),
+                        'type': [kind for kind, _ in DEFAULT_NOISE_MODEL.values()],
+                        'sd': [sd for _, sd in DEFAULT_NOISE_MODEL.values()]
+                    }),
+                    column_config={
+                        'feature': st.column_config.SelectboxColumn(get_translated_text("feature"), options=sweepable_features, required=True),
+                        'type': st.column_config.SelectboxColumn(get_translated_text("uncertainty_noise_type"), options=list(NOISE_TYPES), required=True),
+                        'sd': st.column_config.NumberColumn(get_translated_text("uncertainty_noise_sd"), min_value=0.0, step=0.01, required=True)
+                    },
+                    num_rows="dynamic",
+                    hide_index=True,
+                    key="uncertainty_noise_model"
+                )
+                n_draws = st.slider(get_translated_text("uncertainty_draws"), 500, 20000, 2000, step=500, key="uncertainty_draws")
+                noise_model = {
+                    row.feature: (row.type, float(row.sd))
+                    for row in noise_df.dropna().itertuples(index=False)
+                }
+                uncertainty = prediction_uncertainty(patient_data, models[:4], models[4], noise_model, n_draws)
+                
+                col1, col2, col3 = st.columns(3)
+                col1.metric(get_translated_text("fbtp_probability"), f"{uncertainty['probability']:.3f}")
+                col2.metric(
+                    get_translated_text("uncertainty_interval").format(level=uncertainty['interval']),
+                    f"{uncertainty['lower']:.3f} – {uncertainty['upper']:.3f}"
+                )
+                col3.metric(get_translated_text("uncertainty_flip_rate"), f"{uncertainty['flip_rate']:.1%}")
+                
+                fig = go.Figure(go.Histogram(x=uncertainty['probabilities'], nbinsx=50, marker=dict(color="#4c9be8")))
+                fig.add_vline(x=0.5, line=dict(color="#999999", dash="dash"))
+                fig.add_vline(x=uncertainty['probability'], line=dict(color="#2c3e50", width=3))
+                fig.update_layout(
+                    xaxis_title=get_translated_text("fbtp_probability"),
+                    yaxis_title=get_translated_text("uncertainty_draws"),
+                    height=300,
+                    margin=dict(l=50, r=30, t=30, b=50),
+                    paper_bgcolor="white",
+                    plot_bgcolor="white",
+                    font=dict(size=12, color="#2c3e50")
+                )
+                st.plotly_chart(fig, use_container_width=True)
     
     # 如果是管理员，显示历史记录标签页
     if st.session_state["is_admin"]:
         with tab2:
             st.header(get_translated_text("prediction_history"))
             
-            # 获取所有预测记录
-            df = get_all_predictions()
+            # 筛选条件
+            filter_options = get_filter_options()
+            format_all = lambda x: x if x else get_translated_text("history_all")
+            with st.expander(get_translated_text("history_filters"), expanded=False):
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    date_range = st.date_input(get_translated_text("history_date_range"), value=[], key="history_date_range")
+                    filter_username = st.selectbox(get_translated_text("username"), [""] + filter_options['usernames'], format_func=format_all, key="history_username")
+                with col2:
+                    filter_result = st.selectbox(get_translated_text("prediction_result"), ["", "FBTP", "NFBTP"], format_func=format_all, key="history_result")
+                    filter_model_type = st.selectbox(get_translated_text("model_type"), [""] + filter_options['model_types'], format_func=format_all, key="history_model_type")
+                with col3:
+                    probability_band = st.slider(get_translated_text("history_probability_band"), 0.0, 1.0, (0.0, 1.0), step=0.05, key="history_probability")
+                    page_size = st.selectbox(get_translated_text("history_page_size"), [25, 50, 100, 200], index=1, key="history_page_size")
+            
+            history_filters = {
+                'date_from': date_range[0] if len(date_range) > 0 else None,
+                'date_to': date_range[1] if len(date_range) > 1 else None,
+                'username': filter_username or None,
+                'prediction_result': filter_result or None,
+                'model_type': filter_model_type or None,
+                'min_probability': probability_band[0] if probability_band[0] > 0 else None,
+                'max_probability': probability_band[1] if probability_band[1] < 1 else None
+            }
+            
+            # 筛选条件变化时回到第一页，history_cursors保存每一页的起始位置
+            filters_key = repr((sorted(history_filters.items()), page_size))
+            if st.session_state.get('history_filters_key') != filters_key:
+                st.session_state['history_filters_key'] = filters_key
+                st.session_state['history_cursors'] = [None]
+            
+            # 只查询当前页
+            cursors = st.session_state['history_cursors']
+            df, next_cursor = query_predictions(page_size=page_size, cursor=cursors[-1], **history_filters)
             
             if not df.empty:
                 # 显示预测记录表格
                 st.dataframe(df)
                 
+                # 翻页控件
+                col1, col2, col3 = st.columns([1, 2, 1])
+                with col1:
+                    st.button(
+                        get_translated_text("history_previous_page"),
+                        disabled=len(cursors) <= 1,
+                        on_click=cursors.pop
+                    )
+                with col2:
+                    st.markdown(
+                        f"<p style='text-align: center;'>{get_translated_text('history_page_info').format(page=len(cursors), total=count_predictions(**history_filters))}</p>",
+                        unsafe_allow_html=True
+                    )
+                with col3:
+                    st.button(
+                        get_translated_text("history_next_page"),
+                        disabled=next_cursor is None,
+                        on_click=cursors.append,
+                        args=(next_cursor,)
+                    )
+                
                 # 添加查看详情功能
                 selected_id = st.selectbox(
                     get_translated_text("select_prediction"),
@@ -967,6 +890,7 @@ if check_password():
                                 <p><b>{get_translated_text("prediction_result")}</b> {details['prediction_result']}</p>
                                 <p><b>{get_translated_text("prediction_probability")}</b> {details['probability']:.2f}</p>
                                 <p><b>{get_translated_text("model_type")}</b> {details['model_type']}</p>
+                                <p><b>{get_translated_text("model_fingerprint")}</b> {(details['model_fingerprint'] or '-')[:12]}</p>
                             </div>
                             """, unsafe_allow_html=True)
                         
@@ -988,6 +912,117 @@ if check_password():
                             st.markdown("</div>", unsafe_allow_html=True)
             else:
                 st.info(get_translated_text("no_prediction_history"))
+            
+            # 影子评分汇总：候选模型与当前模型对相同线上输入的结果对照
+            shadow_summary = get_shadow_summary(history_filters['date_from'], history_filters['date_to'])
+            shadow_scorer = get_shadow_scorer()
+            if shadow_scorer is not None or not shadow_summary.empty:
+                with st.expander(get_translated_text("shadow_summary_title"), expanded=False):
+                    if shadow_scorer is not None:
+                        shadow_stats = shadow_scorer.stats()
+                        st.caption(get_translated_text("shadow_scorer_status").format(
+                            candidates=shadow_stats['candidates'], queue_depth=shadow_stats['queue_depth'],
+                            scored=shadow_stats['scored'], dropped=shadow_stats['dropped'], errors=shadow_stats['errors']
+                        ))
+                    if shadow_summary.empty:
+                        st.info(get_translated_text("shadow_summary_empty"))
+                    else:
+                        shadow_summary['candidate_fingerprint'] = shadow_summary['candidate_fingerprint'].str[:12]
+                        shadow_summary['primary_fingerprint'] = shadow_summary['primary_fingerprint'].str[:12]
+                        st.dataframe(shadow_summary)
+                        
+                        # 结果不一致的评分，通过预测记录ID和患者ID追溯到具体病例
+                        disagreements = get_shadow_disagreements(history_filters['date_from'], history_filters['date_to'])
+                        if not disagreements.empty:
+                            st.subheader(get_translated_text("shadow_disagreements_title"))
+                            disagreements['candidate_fingerprint'] = disagreements['candidate_fingerprint'].str[:12]
+                            st.dataframe(disagreements)
+        
+        # 批量预测标签页
+        with main_tabs[2]:
+            st.header(get_translated_text("batch_scoring_title"))
+            
+            uploaded_file = st.file_uploader(
+                get_translated_text("batch_upload_label"),
+                type=["csv", "parquet"],
+                key="batch_upload"
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                id_column = st.text_input(get_translated_text("batch_id_column"), value=PATIENT_ID_COLUMN)
+            with col2:
+                chunk_size = st.number_input(
+                    get_translated_text("batch_chunk_size"),
+                    min_value=100,
+                    value=DEFAULT_CHUNK_SIZE,
+                    step=100
+                )
+            
+            if uploaded_file is not None and st.button(get_translated_text("batch_start_button")):
+                file_format = detect_format(uploaded_file.name)
+                missing_columns = validate_columns(read_columns(uploaded_file, file_format), id_column)
+                
+                if missing_columns:
+                    st.error(f"{get_translated_text('batch_missing_columns')} {', '.join(missing_columns)}")
+                else:
+                    total_rows = count_rows(uploaded_file, file_format)
+                    progress = st.progress(0.0)
+                    
+                    models = load_models(use_dummy=st.session_state['use_dummy_model'])
+                    model_type = "Dummy Model" if st.session_state['use_dummy_model'] else "Real Model"
+                    fingerprint = register_models(models, model_type)
+                    current_username = st.session_state.get("current_username", "unknown")
+                    
+                    # 新结果替换上一次的结果文件，临时目录中每个会话最多保留一个结果文件
+                    previous_path = st.session_state.pop('batch_result_path', None)
+                    if previous_path and os.path.exists(previous_path):
+                        os.remove(previous_path)
+                    
+                    # 结果逐块写入临时文件，内存占用不随文件大小增长
+                    done_rows = scored_rows = 0
+                    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="") as output:
+                        try:
+                            for chunk_index, (result, features) in enumerate(score_cohort(
+                                uploaded_file, file_format, models[:4], models[4], int(chunk_size), id_column
+                            )):
+                                result.to_csv(output, header=(chunk_index == 0), index=False)
+                                
+                                # 预测记录交给异步写入队列，由后台线程合并为批量事务
+                                valid = (result['error'] == '').to_numpy()
+                                enqueue_predictions_batch(
+                                    (row_id, current_username, dict(zip(ALL_FEATURES, row_features)), prediction, probability, model_type, fingerprint)
+                                    for row_id, row_features, prediction, probability in zip(
+                                        result[id_column][valid],
+                                        features[valid].itertuples(index=False, name=None),
+                                        result['prediction'][valid],
+                                        result['probability'][valid]
+                                    )
+                                )
+                                
+                                done_rows += len(result)
+                                scored_rows += int(valid.sum())
+                                progress.progress(
+                                    min(done_rows / max(total_rows, 1), 1.0),
+                                    text=get_translated_text("batch_scoring_progress").format(done=done_rows, total=total_rows)
+                                )
+                        except BaseException:
+                            # 评分失败或被页面重新运行打断时删除不完整的结果文件
+                            output.close()
+                            os.remove(output.name)
+                            raise
+                    
+                    st.session_state['batch_result_path'] = output.name
+                    st.success(get_translated_text("batch_scoring_done").format(scored=scored_rows, invalid=done_rows - scored_rows))
+            
+            # 提供结果下载
+            if st.session_state.get('batch_result_path') and os.path.exists(st.session_state['batch_result_path']):
+                with open(st.session_state['batch_result_path'], "rb") as f:
+                    st.download_button(
+                        get_translated_text("batch_download_button"),
+                        data=f,
+                        file_name="batch_predictions.csv",
+                        mime="text/csv"
+                    )
     
     # 修改页脚，使用翻译的文本
     st.markdown("---")
@@ -995,4 +1030,6 @@ if check_password():
     <div style="text-align: center; color: #7f8c8d; padding: 10px;">
         <p>{get_translated_text("footer")}</p>
     </div>
-    """, unsafe_allow_html=True) 
+    """, unsafe_allow_html=True)
+
+STARTUP_TIMER.mark("first render")
@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+
+from model_utils import ALL_FEATURES, make_predictions_cached
+from startup_timing import lazy_import
+
+# pandas只在首次处理上传文件时导入
+pd = lazy_import("pandas")
+
+# 默认的患者ID列名
+PATIENT_ID_COLUMN = "patient_id"
+
+# 每个数据块的默认行数
+DEFAULT_CHUNK_SIZE = 5000
+
+# 支持的文件格式
+SUPPORTED_FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet'
+}
+
+def detect_format(filename):
+    """根据文件扩展名判断文件格式（csv或parquet）"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported file format: {extension}")
+    return SUPPORTED_FORMATS[extension]
+
+def _parquet_file(source):
+    """打开Parquet文件，pyarrow为可选依赖"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise ImportError("Reading Parquet files requires the 'pyarrow' package.") from exc
+    return pq.ParquetFile(source)
+
+def read_columns(source, file_format):
+    """只读取文件的列名，不加载数据"""
+    if file_format == 'parquet':
+        columns = _parquet_file(source).schema_arrow.names
+    else:
+        columns = pd.read_csv(source, nrows=0).columns.tolist()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return columns
+
+def validate_columns(columns, id_column=PATIENT_ID_COLUMN):
+    """
+    检查文件是否包含患者ID列和全部14个特征列。
+
+    返回:
+        list: 缺失的列名，为空表示校验通过
+    """
+    required = [id_column] + ALL_FEATURES
+    return [column for column in required if column not in columns]
+
+def count_rows(source, file_format):
+    """
+    统计数据行数，用于显示进度。CSV按块扫描字节，不解析内容。
+    
+    只有引号之外的换行符才是记录分隔符（转义的双引号 "" 不改变引号内外的状态），
+    因此带引号的多行字段不会被重复计数。
+    """
+    if file_format == 'parquet':
+        rows = _parquet_file(source).metadata.num_rows
+    else:
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as f:
+                return count_rows(f, file_format)
+        records = 0
+        quoted = False
+        last_block = b''
+        for block in iter(lambda: source.read(1 << 20), b''):
+            data = np.frombuffer(block, dtype=np.uint8)
+            # 每个字节之前（含自身）出现的引号数的奇偶性，加上前一块结束时的状态
+            inside = (np.cumsum(data == ord('"')) + quoted) % 2 == 1
+            records += int(np.count_nonzero((data == ord('\n')) & ~inside))
+            quoted = bool(inside[-1])
+            last_block = block
+        # 最后一行没有换行符时补上一行，再减去表头
+        if last_block and not last_block.endswith(b'\n'):
+            records += 1
+        rows = max(records - 1, 0)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return rows
+
+def iter_cohort_chunks(source, file_format, chunksize=DEFAULT_CHUNK_SIZE, id_column=PATIENT_ID_COLUMN):
+    """
+    按块读取队列文件，每次只在内存中保留一个数据块。
+
+    患者ID列按字符串读取，'007'这样的ID不会被转换为数字7，'NA'也不会被当作缺失值。
+    """
+    if file_format == 'parquet':
+        import pyarrow as pa
+        for batch in _parquet_file(source).iter_batches(batch_size=chunksize):
+            chunk = batch.to_pandas()
+            if id_column in batch.schema.names:
+                # 数字类型的ID列在pyarrow中转换为字符串，空值保持为空
+                chunk[id_column] = batch.column(id_column).cast(pa.string()).to_pandas().to_numpy(dtype=object)
+            yield chunk
+    else:
+        # 特征列中的空白和'NA'等值会在score_chunk中被pd.to_numeric转换为NaN
+        with pd.read_csv(source, chunksize=chunksize, dtype={id_column: str}, keep_default_na=False) as reader:
+            yield from reader
+
+def score_chunk(chunk, models, scaler, id_column=PATIENT_ID_COLUMN, fast_meta=False):
+    """
+    对一个数据块进行预测。
+
+    特征值缺失、无法转换为数字或为无穷大的行以及患者ID为空的行不会被预测，并在error列中注明原因。
+    数据块较小时（见model_utils.PREDICTION_CACHE_BULK_ROWS）与单个预测共享进程级预测缓存。
+    fast_meta为True时元分类器使用预计算的查找表（见model_utils.MetaLookupSurface）。
+
+    返回:
+        pd.DataFrame: 包含患者ID、预测结果、FBTP概率和error列的结果表
+    """
+    features = chunk[ALL_FEATURES].apply(pd.to_numeric, errors='coerce')
+    valid = np.isfinite(features.to_numpy(dtype=float)).all(axis=1)
+
+    # 只把非空的ID转换为字符串，空值保持为None，不会变成'nan'
+    ids = chunk[id_column].astype(object)
+    has_id = ids.notna().to_numpy()
+    ids = ids.where(has_id, None)
+    ids[has_id] = ids[has_id].astype(str)
+    errors = np.where(valid, '', 'invalid feature values').astype(object)
+    errors[~has_id] = 'missing patient ID'
+    valid &= has_id
+
+    result = pd.DataFrame({
+        id_column: pd.Series(ids.to_numpy(), dtype=object),
+        'prediction': pd.Series([None] * len(chunk), dtype=object),
+        'probability': np.full(len(chunk), np.nan),
+        'error': errors
+    })
+
+    if valid.any():
+        predictions, probabilities = make_predictions_cached(features[valid], models, scaler, fast_meta=fast_meta)
+        result.loc[valid, 'prediction'] = predictions
+        result.loc[valid, 'probability'] = probabilities
+
+    return result, features
+
+def score_cohort(source, file_format, models, scaler, chunksize=DEFAULT_CHUNK_SIZE, id_column=PATIENT_ID_COLUMN,
+                 fast_meta=False):
+    """
+    逐块对队列文件进行预测。
+
+    参数:
+        source: 文件路径或类文件对象。
+        file_format (str): 'csv'或'parquet'。
+        models (tuple): (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta)
+        scaler (StandardScaler): 用于标准化连续特征的标准化器。
+        chunksize (int): 每个数据块的行数。
+        id_column (str): 患者ID列名。
+        fast_meta (bool): 是否使用元分类器查找表加速。
+
+    返回:
+        generator: 依次产生 (结果表, 数值化后的特征表)
+    """
+    for chunk in iter_cohort_chunks(source, file_format, chunksize, id_column):
+        yield score_chunk(chunk, models, scaler, id_column, fast_meta)
@@ -0,0 +1,346 @@
+"""
+预测和持久化热路径的基准测试，不需要启动Streamlit。
+
+覆盖模型加载（冷/热）、preprocess_data、单条make_prediction、不同规模的批量预测、
+save_prediction吞吐量、不同行数下的get_all_predictions以及get_text查找。输入由固定随机种子
+按CONTINUOUS_FEATURES/DISCRETE_FEATURES/BINARY_FEATURES生成，数据库测试使用临时目录中的
+独立数据库，不会修改prediction_history.db。
+
+结果以JSON输出，并可与保存的基线比较：最小耗时（受系统噪声影响最小）超过基线的 (1 + 阈值) 倍时
+视为性能退化，命令以退出码1结束。
+
+用法示例:
+    python -m benchmarks --save-baseline                 # 升级前：记录基线
+    python -m benchmarks -o after.json                   # 升级后：与基线比较
+    python -m benchmarks --quick --only predict,text     # 只运行部分分组
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import db_utils
+from model_utils import (ALL_FEATURES, BINARY_FEATURES, CONTINUOUS_FEATURES,
+                         DISCRETE_FEATURES, MODEL_REGISTRY, PREDICTION_CACHE,
+                         load_models, make_prediction, make_predictions_batch,
+                         model_fingerprint, preprocess_data)
+from translations import LANGUAGES, TRANSLATIONS, get_text
+
+# 默认的基线文件和退化阈值（最小耗时相对基线增加的比例）
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+DEFAULT_THRESHOLD = 0.25
+
+# 批量预测的行数和历史记录表的行数
+BATCH_SIZES = [1, 100, 10000, 100000]
+HISTORY_SIZES = [10000, 100000, 1000000]
+QUICK_BATCH_SIZES = [1, 100, 10000]
+QUICK_HISTORY_SIZES = [10000, 100000]
+
+# 生成合成输入的随机种子，保证每次运行的输入相同
+SEED = 20240501
+
+# 基准测试分组
+GROUPS = ['load', 'preprocess', 'predict', 'batch', 'save', 'history', 'text']
+
+def synthetic_features(n_rows, seed=SEED):
+    """
+    生成按ALL_FEATURES排列的合成特征矩阵。
+    
+    连续特征为对数正态分布的正数，离散特征为0-5的整数，二元特征为0/1。
+    
+    返回:
+        ndarray: shape=[n_rows, 14]
+    """
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.lognormal(0.0, 1.0, (n_rows, len(CONTINUOUS_FEATURES))),
+        rng.integers(0, 6, (n_rows, len(DISCRETE_FEATURES))),
+        rng.integers(0, 2, (n_rows, len(BINARY_FEATURES))),
+    ]).astype(np.float64)
+
+def synthetic_records(n_rows, seed=SEED):
+    """生成合成的特征字典列表，与应用中表单提交的输入格式相同"""
+    return [dict(zip(ALL_FEATURES, row)) for row in synthetic_features(n_rows, seed).tolist()]
+
+def measure(func, number=1, repeat=5, warmup=1, setup=None, items=None):
+    """
+    重复执行func并统计每次调用的耗时。
+    
+    参数:
+        func: 被测函数，无参数。
+        number (int): 每轮调用次数，每轮的耗时除以number得到单次耗时。
+        repeat (int): 轮数。
+        warmup (int): 正式计时前的预热调用次数。
+        setup: 每轮开始前调用的函数（不计时），如清空缓存。
+        items (int): 每次调用处理的记录数，用于计算每秒处理的记录数。
+    
+    返回:
+        dict: 单次调用耗时的中位数/最小值/平均值/标准差（秒）和吞吐量
+    """
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        func()
+    
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    
+    median = statistics.median(times)
+    result = {
+        'number': number,
+        'repeat': repeat,
+        'median_s': median,
+        'min_s': min(times),
+        'mean_s': statistics.fmean(times),
+        'stdev_s': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'ops_per_s': 1.0 / median if median > 0 else None,
+    }
+    if items is not None:
+        result['items'] = items
+        result['items_per_s'] = items / median if median > 0 else None
+    return result
+
+def bench_load(use_dummy):
+    """模型加载：冷加载（清空注册表后从磁盘反序列化并编译推理计划）和热加载（注册表命中）"""
+    load_models(use_dummy=use_dummy)  # 确保模型文件存在
+    yield 'load_models.cold', measure(
+        lambda: load_models(use_dummy=use_dummy), repeat=5, warmup=0, setup=MODEL_REGISTRY.clear
+    )
+    load_models(use_dummy=use_dummy)
+    yield 'load_models.warm', measure(lambda: load_models(use_dummy=use_dummy), number=10000)
+
+def bench_preprocess(use_dummy):
+    """单条记录的preprocess_data"""
+    scaler = load_models(use_dummy=use_dummy)[4]
+    record = synthetic_records(1)[0]
+    yield 'preprocess_data', measure(lambda: preprocess_data(record, scaler), number=2000)
+
+def bench_predict(use_dummy):
+    """单条make_prediction：每次输入不同（缓存未命中）和重复相同输入（缓存命中）"""
+    models = load_models(use_dummy=use_dummy)
+    records = synthetic_records(2000, seed=SEED + 1)
+    position = [0]
+    
+    def predict_next():
+        make_prediction(records[position[0] % len(records)], models[:4], models[4])
+        position[0] += 1
+    
+    yield 'make_prediction.uncached', measure(predict_next, number=200, setup=PREDICTION_CACHE.clear, items=1)
+    yield 'make_prediction.cached', measure(
+        lambda: make_prediction(records[0], models[:4], models[4]), number=2000, items=1
+    )
+
+def bench_batch(use_dummy, sizes):
+    """make_predictions_batch在不同行数下的耗时"""
+    models = load_models(use_dummy=use_dummy)
+    for size in sizes:
+        X = synthetic_features(size, seed=SEED + 2)
+        number = max(1, 10000 // size)
+        yield f'batch.{size}', measure(
+            lambda: make_predictions_batch(X, models[:4], models[4]), number=number, items=size
+        )
+
+def _history_records(n_rows, seed):
+    """生成写入历史记录表的合成预测记录"""
+    features = synthetic_records(n_rows, seed)
+    rng = np.random.default_rng(seed)
+    probabilities = rng.uniform(0.0, 1.0, n_rows)
+    return [
+        (f"P{seed}-{i}", f"user{i % 20}", record, 'FBTP' if p >= 0.5 else 'NFBTP', float(p), "Real Model")
+        for i, (record, p) in enumerate(zip(features, probabilities))
+    ]
+
+def bench_save(db_dir):
+    """save_prediction（每条记录一个事务）和save_predictions_batch的吞吐量"""
+    db_utils.DB_PATH = os.path.join(db_dir, 'save.db')
+    db_utils.ensure_db()
+    records = _history_records(1000, SEED + 3)
+    position = [0]
+    
+    def save_next():
+        db_utils.save_prediction(*records[position[0] % len(records)])
+        position[0] += 1
+    
+    yield 'save_prediction', measure(save_next, number=200, repeat=3, items=1)
+    yield 'save_predictions_batch.1000', measure(
+        lambda: db_utils.save_predictions_batch(records), repeat=3, items=len(records)
+    )
+
+def bench_history(db_dir, sizes):
+    """get_all_predictions在不同行数下的耗时（同一数据库按需追加记录）"""
+    db_utils.DB_PATH = os.path.join(db_dir, 'history.db')
+    db_utils.ensure_db()
+    rows = 0
+    for size in sorted(sizes):
+        while rows < size:
+            count = min(50000, size - rows)
+            db_utils.save_predictions_batch(_history_records(count, SEED + rows))
+            rows += count
+        repeat = 3 if size >= 1000000 else 5
+        yield f'get_all_predictions.{size}', measure(db_utils.get_all_predictions, repeat=repeat, items=size)
+
+def bench_text():
+    """get_text在所有语言和键上的查找"""
+    pairs = [(key, lang) for lang in LANGUAGES for key in TRANSLATIONS['en']]
+    
+    def lookup_all():
+        for key, lang in pairs:
+            get_text(key, lang)
+    
+    yield 'get_text', measure(lookup_all, number=20, items=len(pairs))
+
+def run_benchmarks(groups=GROUPS, use_dummy=False, quick=False, progress=None):
+    """
+    运行指定分组的基准测试。
+    
+    参数:
+        groups (list): 要运行的分组，见GROUPS。
+        use_dummy (bool): 是否使用虚拟模型。
+        quick (bool): 使用较小的批量和历史记录规模。
+        progress: 每完成一项时调用 progress(name, result)。
+    
+    返回:
+        dict: 基准测试名 -> 结果
+    """
+    batch_sizes = QUICK_BATCH_SIZES if quick else BATCH_SIZES
+    history_sizes = QUICK_HISTORY_SIZES if quick else HISTORY_SIZES
+    results = {}
+    db_path = db_utils.DB_PATH
+    db_dir = tempfile.mkdtemp(prefix='benchmarks-')
+    try:
+        suites = {
+            'load': lambda: bench_load(use_dummy),
+            'preprocess': lambda: bench_preprocess(use_dummy),
+            'predict': lambda: bench_predict(use_dummy),
+            'batch': lambda: bench_batch(use_dummy, batch_sizes),
+            'save': lambda: bench_save(db_dir),
+            'history': lambda: bench_history(db_dir, history_sizes),
+            'text': bench_text,
+        }
+        for group in groups:
+            for name, result in suites[group]():
+                result['group'] = group
+                results[name] = result
+                if progress is not None:
+                    progress(name, result)
+    finally:
+        # 切回原数据库并删除临时数据库
+        db_utils.DB_PATH = db_path
+        db_utils.close_pool()
+        shutil.rmtree(db_dir, ignore_errors=True)
+    return results
+
+def environment_info(use_dummy):
+    """运行环境和模型版本信息，随结果一起保存以便解释基线差异"""
+    import sklearn
+    models = load_models(use_dummy=use_dummy)
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'scikit-learn': sklearn.__version__,
+        'model': 'dummy' if use_dummy else 'real',
+        'model_fingerprint': model_fingerprint(models[:4], models[4]),
+    }
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    将结果与基线比较。
+    
+    返回:
+        list: 每个共同的基准测试一项 (名称, 基线最小耗时, 当前最小耗时, 比值, 是否退化)
+    """
+    rows = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None or not reference.get('min_s'):
+            continue
+        ratio = result['min_s'] / reference['min_s']
+        rows.append((name, reference['min_s'], result['min_s'], ratio, ratio > 1.0 + threshold))
+    return rows
+
+def _format_seconds(seconds):
+    """将耗时格式化为合适的单位"""
+    if seconds >= 1.0:
+        return f"{seconds:.3f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f} ms"
+    return f"{seconds * 1e6:.2f} us"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the prediction and persistence hot paths.")
+    parser.add_argument('--only', help=f"Comma-separated benchmark groups to run (default: all of {','.join(GROUPS)})")
+    parser.add_argument('--model', choices=['real', 'dummy'], default='real', help="Model set to benchmark (default: real)")
+    parser.add_argument('--quick', action='store_true', help="Use smaller batch and history sizes")
+    parser.add_argument('-o', '--output', help="Write the JSON results to this file")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help=f"Baseline JSON to compare against (default: {DEFAULT_BASELINE})")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline instead of comparing")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Allowed slowdown of the minimum time before a benchmark counts as a regression (default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args(argv)
+    
+    selected = set(GROUPS) if not args.only else {group.strip() for group in args.only.split(',') if group.strip()}
+    unknown = sorted(selected - set(GROUPS))
+    if unknown:
+        parser.error(f"unknown benchmark groups: {', '.join(unknown)}")
+    # 分组始终按固定顺序运行，结果才能与基线比较
+    groups = [group for group in GROUPS if group in selected]
+    use_dummy = args.model == 'dummy'
+    
+    def progress(name, result):
+        print(f"{name:<36} {_format_seconds(result['median_s']):>12}  (min {_format_seconds(result['min_s'])})", file=sys.stderr)
+    
+    report = {
+        'environment': environment_info(use_dummy),
+        'results': run_benchmarks(groups, use_dummy=use_dummy, quick=args.quick, progress=progress),
+    }
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}", file=sys.stderr)
+        return 0
+    
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one", file=sys.stderr)
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    
+    rows = compare(report['results'], baseline['results'], args.threshold)
+    regressions = [row for row in rows if row[4]]
+    print(f"\nComparison with {args.baseline} (recorded {baseline['environment'].get('timestamp')}):", file=sys.stderr)
+    for name, before, after, ratio, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<36} {_format_seconds(before):>12} -> {_format_seconds(after):>12}  x{ratio:.2f}{flag}", file=sys.stderr)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
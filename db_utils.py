@@ -1,64 +1,751 @@
+import atexit
 import datetime
+import itertools
 import json
+import logging
 import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 
-import pandas as pd
+import numpy as np
+
+from model_utils import ALL_FEATURES, CONTINUOUS_FEATURES
+from startup_timing import STARTUP_TIMER, lazy_import
+
+# pandas只在首次查询历史记录时导入
+pd = lazy_import("pandas")
+
+logger = logging.getLogger(__name__)
 
 # 数据库文件路径
 DB_PATH = "prediction_history.db"
 
-def init_db():
-    """初始化数据库，创建表（如果不存在）"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # 创建预测历史表
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS prediction_history (
+# 连接池参数
+POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 8192
+STATEMENT_CACHE_SIZE = 128
+
+# 异步写入参数
+WRITE_QUEUE_SIZE = 10000
+WRITE_BATCH_SIZE = 500
+WRITE_FLUSH_INTERVAL = 0.5  # 秒
+WRITE_RETRIES = 2
+
+# 数据库结构版本（保存在PRAGMA user_version中）
+# 1: 特征以JSON文本保存在features列中
+# 2: 特征按ALL_FEATURES拆分为带类型的列
+# 3: 新增model_versions表，预测记录通过model_fingerprint列引用生成它的模型版本
+# 4: 新增shadow_predictions表，记录候选模型对同一输入的影子评分结果
+# 5: prediction_history和shadow_predictions新增prediction_uid列，影子评分结果可关联到对应的预测记录
+SCHEMA_VERSION = 5
+
+# 特征与数据库列的对应关系，顺序与ALL_FEATURES一致
+FEATURE_COLUMNS = {
+    'Std. dev: g/mL_Choline_Bone+': 'std_choline_bone_pos',
+    'Min: g/mL_Choline_Liver': 'min_choline_liver',
+    'Std. dev: g/mL_Choline_Bone-': 'std_choline_bone_neg',
+    'Peak: g/mL_Choline_Kidney': 'peak_choline_kidney',
+    'Peak: g/mL_Choline_Bone-': 'peak_choline_bone_neg',
+    'Neutrophils (G/L)': 'neutrophils',
+    'Leukocytes (G/L)': 'leukocytes',
+    'Alkaline Phosphatase (ALP) levels': 'alp',
+    'Number of lymph node involvements (supradiaphragmatic)': 'lymph_nodes_supra',
+    'Number of lymph node involvements (subdiaphragmatic)': 'lymph_nodes_sub',
+    'Invasion score of Pelvis': 'pelvis_invasion_score',
+    'Liver involvement': 'liver_involvement',
+    'PSMA-/FDG+': 'psma_neg_fdg_pos',
+    'PSMA-/Choline+': 'psma_neg_choline_pos'
+}
+FEATURE_COLUMN_LIST = ', '.join(FEATURE_COLUMNS.values())
+
+def _create_history_table_sql(table):
+    """预测历史表的建表语句，连续特征为REAL，离散和二元特征为INTEGER"""
+    feature_columns = ',\n        '.join(
+        f"{column} {'REAL' if feature in CONTINUOUS_FEATURES else 'INTEGER'}"
+        for feature, column in FEATURE_COLUMNS.items()
+    )
+    return f'''
+    CREATE TABLE IF NOT EXISTS {table} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         patient_id TEXT NOT NULL,
         username TEXT NOT NULL,
         prediction_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        features TEXT NOT NULL,
         prediction_result TEXT NOT NULL,
         probability REAL NOT NULL,
-        model_type TEXT NOT NULL
+        model_type TEXT NOT NULL,
+        model_fingerprint TEXT REFERENCES model_versions (fingerprint),
+        prediction_uid TEXT,
+        {feature_columns}
     )
-    ''')
+    '''
+
+# 模型版本表：每个按内容指纹区分的模型集一行
+CREATE_MODEL_VERSIONS_SQL = '''
+    CREATE TABLE IF NOT EXISTS model_versions (
+        fingerprint TEXT PRIMARY KEY,
+        model_type TEXT NOT NULL,
+        source TEXT,
+        artifacts TEXT,
+        first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# 影子评分表：候选模型集对线上输入的评分结果，与主模型的结果逐条对照，不影响展示给用户的预测
+CREATE_SHADOW_PREDICTIONS_SQL = '''
+    CREATE TABLE IF NOT EXISTS shadow_predictions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scored_at TIMESTAMP NOT NULL,
+        prediction_uid TEXT,
+        primary_fingerprint TEXT REFERENCES model_versions (fingerprint),
+        candidate_fingerprint TEXT NOT NULL REFERENCES model_versions (fingerprint),
+        primary_result TEXT NOT NULL,
+        primary_probability REAL NOT NULL,
+        primary_latency_ms REAL,
+        candidate_result TEXT NOT NULL,
+        candidate_probability REAL NOT NULL,
+        candidate_latency_ms REAL
+    )
+'''
+
+# 常用SQL语句，保持文本不变以便SQLite复用已编译的语句
+INSERT_PREDICTION_SQL = f'''
+    INSERT INTO prediction_history
+    (patient_id, username, prediction_date, prediction_result, probability, model_type, model_fingerprint,
+     prediction_uid, {FEATURE_COLUMN_LIST})
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, {', '.join('?' * len(FEATURE_COLUMNS))})
+'''
+
+# 历史记录表的索引，(prediction_date, id) 同时用于排序和键集分页
+HISTORY_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_history_date ON prediction_history (prediction_date, id)',
+    'CREATE INDEX IF NOT EXISTS idx_history_username ON prediction_history (username, prediction_date)',
+    'CREATE INDEX IF NOT EXISTS idx_history_patient ON prediction_history (patient_id)',
+    'CREATE INDEX IF NOT EXISTS idx_history_model_type ON prediction_history (model_type, prediction_date)',
+    'CREATE INDEX IF NOT EXISTS idx_history_model_fingerprint ON prediction_history (model_fingerprint, prediction_date)',
+    'CREATE INDEX IF NOT EXISTS idx_history_prediction_uid ON prediction_history (prediction_uid)'
+]
+
+INSERT_SHADOW_PREDICTION_SQL = '''
+    INSERT INTO shadow_predictions
+    (scored_at, prediction_uid, primary_fingerprint, candidate_fingerprint, primary_result, primary_probability,
+     primary_latency_ms, candidate_result, candidate_probability, candidate_latency_ms)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+SHADOW_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_shadow_candidate ON shadow_predictions (candidate_fingerprint, scored_at)',
+    'CREATE INDEX IF NOT EXISTS idx_shadow_prediction_uid ON shadow_predictions (prediction_uid)'
+]
+
+# 历史记录列表中显示的列
+HISTORY_COLUMNS = 'id, patient_id, username, prediction_date, prediction_result, probability, model_type, model_fingerprint'
+
+# 每页默认显示的记录数
+DEFAULT_PAGE_SIZE = 50
+
+class ConnectionPool:
+    """
+    线程安全的SQLite连接池。
+    
+    连接在进程内复用，避免每次调用都重新建立连接；数据库使用WAL日志模式，
+    读操作不会被写操作阻塞，写锁冲突时等待busy_timeout而不是立即报错。
+    """
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+    
+    def _connect(self):
+        """创建一个新连接并设置PRAGMA参数"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            isolation_level="IMMEDIATE",  # 写事务开始时即获取写锁，避免锁升级时死锁
+            check_same_thread=False,  # 连接由连接池保证同一时间只被一个线程使用
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    def acquire(self):
+        """从连接池获取一个连接，池已满时等待其他线程归还，超时抛出sqlite3.OperationalError"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=BUSY_TIMEOUT_MS / 1000)
+        except queue.Empty:
+            # 与SQLite的忙等待超时一致，调用方只需处理sqlite3异常
+            raise sqlite3.OperationalError("database is busy: connection pool exhausted") from None
+    
+    def release(self, conn):
+        """归还连接，未结束的事务会被回滚"""
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+    
+    @contextmanager
+    def connection(self):
+        """借用一个连接，用完自动归还"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
     
-    conn.commit()
-    conn.close()
+    @contextmanager
+    def transaction(self):
+        """借用一个连接并在事务中执行，正常退出时提交，异常时回滚"""
+        with self.connection() as conn:
+            with conn:
+                yield conn
+    
+    def close(self):
+        """关闭所有空闲连接"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
 
-def save_prediction(patient_id, username, features, prediction_result, probability, model_type):
-    """保存预测记录到数据库"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+_pool = None
+_pool_lock = threading.Lock()
+
+# 已在本进程中初始化过的数据库路径
+_initialized_paths = set()
+_init_lock = threading.Lock()
+
+def _get_pool():
+    """获取当前数据库路径对应的连接池（DB_PATH改变时重新创建），不检查表结构"""
+    global _pool
+    pool = _pool
+    if pool is None or pool.db_path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.db_path != DB_PATH:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(DB_PATH)
+            pool = _pool
+    return pool
+
+def get_pool():
+    """获取当前数据库路径对应的连接池，首次使用某个数据库时先执行init_db"""
+    pool = _get_pool()
+    if pool.db_path not in _initialized_paths:
+        ensure_db()
+    return pool
+
+def close_pool():
+    """关闭连接池，进程退出时自动调用"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+atexit.register(close_pool)
+
+def _feature_values(features):
+    """将特征字典转换为按ALL_FEATURES排列的值元组，缺失的特征保存为NULL"""
+    return tuple(features.get(feat) for feat in ALL_FEATURES)
+
+def _migrate_json_features(conn):
+    """结构版本1 -> 2：重建预测历史表，将JSON格式的特征回填到带类型的列中"""
+    conn.execute(_create_history_table_sql('prediction_history_v2'))
     
+    insert_sql = f'''
+        INSERT INTO prediction_history_v2
+        (id, patient_id, username, prediction_date, prediction_result, probability, model_type, {FEATURE_COLUMN_LIST})
+        VALUES (?, ?, ?, ?, ?, ?, ?, {', '.join('?' * len(FEATURE_COLUMNS))})
+    '''
+    cursor = conn.execute('''
+        SELECT id, patient_id, username, prediction_date, prediction_result, probability, model_type, features
+        FROM prediction_history
+    ''')
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        conn.executemany(insert_sql, [row[:-1] + _feature_values(json.loads(row[-1])) for row in rows])
+    
+    conn.execute('DROP TABLE prediction_history')
+    conn.execute('ALTER TABLE prediction_history_v2 RENAME TO prediction_history')
+
+def _add_model_fingerprint_column(conn):
+    """结构版本2 -> 3：预测历史表增加model_fingerprint列，历史记录的值为NULL（版本未知）"""
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(prediction_history)')}
+    if 'model_fingerprint' not in columns:
+        conn.execute('ALTER TABLE prediction_history ADD COLUMN model_fingerprint TEXT REFERENCES model_versions (fingerprint)')
+
+def _add_prediction_uid_columns(conn):
+    """结构版本4 -> 5：预测历史表和影子评分表增加prediction_uid列，已有记录的值为NULL（无法关联）"""
+    for table in ('prediction_history', 'shadow_predictions'):
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if 'prediction_uid' not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN prediction_uid TEXT')
+
+def init_db():
+    """初始化数据库，创建表（如果不存在）并升级旧的表结构"""
+    with _get_pool().connection() as conn:
+        # 在写事务中检查版本，多个进程同时启动时只有一个会执行迁移
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            table_exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'prediction_history'"
+            ).fetchone() is not None
+            
+            conn.execute(CREATE_MODEL_VERSIONS_SQL)
+            conn.execute(CREATE_SHADOW_PREDICTIONS_SQL)
+            if not table_exists:
+                # 创建预测历史表
+                conn.execute(_create_history_table_sql('prediction_history'))
+            else:
+                if version < 2:
+                    _migrate_json_features(conn)
+                if version < 3:
+                    _add_model_fingerprint_column(conn)
+                if version < 5:
+                    _add_prediction_uid_columns(conn)
+            
+            # 为历史记录页面的排序和筛选创建索引
+            for index_sql in HISTORY_INDEXES + SHADOW_INDEXES:
+                conn.execute(index_sql)
+            
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+def ensure_db():
+    """每个进程对每个数据库路径只执行一次init_db（在首次访问数据库时自动调用）"""
+    db_path = DB_PATH
+    if db_path in _initialized_paths:
+        return
+    with _init_lock:
+        if db_path not in _initialized_paths:
+            with STARTUP_TIMER.phase("database init"):
+                init_db()
+            _initialized_paths.add(db_path)
+
+def _prediction_row(patient_id, username, features, prediction_result, probability, model_type,
+                    model_fingerprint=None, prediction_uid=None, prediction_date=None):
+    """将一条预测记录转换为INSERT_PREDICTION_SQL的参数元组"""
     # 确保username不为空，如果为空则使用默认值
     if username is None or username == "":
         username = "unknown_user"
+    if prediction_date is None:
+        prediction_date = datetime.datetime.now()
+    return (
+        (patient_id, username, prediction_date, prediction_result, float(probability), model_type, model_fingerprint,
+         prediction_uid)
+        + _feature_values(features)
+    )
+
+def save_prediction(patient_id, username, features, prediction_result, probability, model_type, model_fingerprint=None,
+                    prediction_uid=None):
+    """保存预测记录到数据库"""
+    # 插入预测记录，特征按列保存
+    with get_pool().transaction() as conn:
+        conn.execute(
+            INSERT_PREDICTION_SQL,
+            _prediction_row(patient_id, username, features, prediction_result, probability, model_type, model_fingerprint,
+                            prediction_uid)
+        )
+
+def save_predictions_batch(records):
+    """
+    在一个事务中批量保存预测记录
+    
+    参数:
+        records: 可迭代对象，每个元素为 (patient_id, username, features, prediction_result, probability, model_type)，
+                 可以在末尾附加model_fingerprint和prediction_uid
+    """
+    now = datetime.datetime.now()
+    rows = [_prediction_row(*record, prediction_date=now) for record in records]
+    if not rows:
+        return 0
+    
+    with get_pool().transaction() as conn:
+        conn.executemany(INSERT_PREDICTION_SQL, rows)
+    
+    return len(rows)
+
+class PredictionWriter:
+    """
+    预测记录的异步写入队列（write-behind）。
+    
+    预测记录先放入进程内的有界队列，由后台线程按数量或时间阈值合并为一个事务批量写入，
+    请求线程不需要等待磁盘同步。一次提交的多条记录作为一个队列项，用一次executemany写入。
+    队列已满时在调用线程中同步写入；重试后仍写入失败的记录追加到溢出文件（spill_path()），
+    下次启动写入线程时重新写入数据库，不会丢弃记录。
+    """
+    def __init__(self, max_queue=WRITE_QUEUE_SIZE, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stopping = False
+        
+        # 统计信息
+        self.queued_rows = 0
+        self.written = 0
+        self.batches = 0
+        self.sync_fallbacks = 0
+        self.errors = 0
+        self.spilled = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+    
+    def start(self):
+        """启动后台写入线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="prediction-writer", daemon=True)
+                self._thread.start()
     
-    # 将特征字典转换为JSON字符串
-    features_json = json.dumps(features)
-    
-    # 插入预测记录
-    cursor.execute(
-        '''
-        INSERT INTO prediction_history 
-        (patient_id, username, prediction_date, features, prediction_result, probability, model_type)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''',
-        (patient_id, username, datetime.datetime.now(), features_json, prediction_result, probability, model_type)
+    def submit(self, row, timeout=0.1):
+        """将一条已转换的记录放入队列，队列满时同步写入"""
+        self.submit_many([row], timeout)
+    
+    def submit_many(self, rows, timeout=0.1):
+        """将一组已转换的记录作为一个队列项放入队列，队列满时在调用线程中用一个事务同步写入"""
+        rows = list(rows)
+        if not rows:
+            return 0
+        self.start()
+        try:
+            self._queue.put(rows, timeout=timeout)
+        except queue.Full:
+            self.sync_fallbacks += 1
+            self._persist(rows, retries=0)
+        else:
+            with self._lock:
+                self.queued_rows += len(rows)
+        return len(rows)
+    
+    def _write(self, rows):
+        """在一个事务中写入一批记录，并记录耗时"""
+        start = time.perf_counter()
+        with get_pool().transaction() as conn:
+            conn.executemany(INSERT_PREDICTION_SQL, rows)
+        elapsed = time.perf_counter() - start
+        self.last_flush_seconds = elapsed
+        self.total_flush_seconds += elapsed
+        self.written += len(rows)
+        self.batches += 1
+    
+    def _persist(self, rows, retries=WRITE_RETRIES):
+        """写入一批记录，失败时短暂等待后重试，仍失败则写入溢出文件"""
+        for attempt in range(retries + 1):
+            try:
+                self._write(rows)
+                return
+            except Exception:
+                if attempt == retries:
+                    self.errors += 1
+                    logger.exception("Failed to write %d predictions, spilling them to %s", len(rows), spill_path())
+                else:
+                    time.sleep(self.flush_interval)
+        self._spill(rows)
+    
+    def _spill(self, rows):
+        """将写入失败的记录以JSON行追加到溢出文件"""
+        try:
+            with self._spill_lock, open(spill_path(), 'a', encoding='utf-8') as f:
+                for row in rows:
+                    # datetime按str()保存，与sqlite3默认的datetime适配器写入的文本一致
+                    f.write(json.dumps(row, default=str) + '\n')
+            self.spilled += len(rows)
+        except Exception:
+            logger.exception("Failed to spill %d predictions", len(rows))
+    
+    def replay_spilled(self):
+        """将溢出文件中的记录重新写入数据库，返回写入的记录数"""
+        path = spill_path()
+        replaying = path + '.replaying'
+        with self._spill_lock:
+            if os.path.exists(path):
+                if os.path.exists(replaying):
+                    # 上次重放被中断时，把新的溢出记录追加到未完成的重放文件中
+                    with open(path, encoding='utf-8') as src, open(replaying, 'a', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                    os.remove(path)
+                else:
+                    os.replace(path, replaying)
+            elif not os.path.exists(replaying):
+                return 0
+        with open(replaying, encoding='utf-8') as f:
+            rows = [tuple(json.loads(line)) for line in f if line.strip()]
+        count = 0
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            self._persist(batch)
+            count += len(batch)
+        os.remove(replaying)
+        if rows:
+            logger.info("Replayed %d spilled predictions from %s", len(rows), path)
+        return count
+    
+    def _run(self):
+        """后台线程：先重放溢出文件，再收集一批记录后写入，直到收到停止信号且队列清空"""
+        try:
+            self.replay_spilled()
+        except Exception:
+            logger.exception("Failed to replay spilled predictions")
+        
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._stopping:
+                    return
+                continue
+            
+            items = [first]
+            rows = list(first)
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                items.append(item)
+                rows.extend(item)
+            
+            try:
+                self._persist(rows)
+            except Exception:
+                # _persist已处理写入错误，这里只保证线程不会因意外异常退出
+                logger.exception("Unexpected error while writing %d predictions", len(rows))
+            finally:
+                with self._lock:
+                    self.queued_rows -= len(rows)
+                for _ in items:
+                    self._queue.task_done()
+    
+    def flush(self, timeout=None):
+        """等待队列中的记录全部写入，返回是否在超时前完成"""
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(lambda: self._queue.unfinished_tasks == 0, timeout)
+    
+    def stop(self, timeout=None):
+        """写入剩余记录并停止后台线程"""
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def stats(self):
+        """返回队列深度和写入耗时统计"""
+        return {
+            'queue_depth': self.queued_rows,
+            'written': self.written,
+            'batches': self.batches,
+            'sync_fallbacks': self.sync_fallbacks,
+            'errors': self.errors,
+            'spilled': self.spilled,
+            'last_flush_ms': self.last_flush_seconds * 1000,
+            'avg_flush_ms': self.total_flush_seconds / self.batches * 1000 if self.batches else 0.0
+        }
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def spill_path():
+    """当前数据库对应的溢出文件路径（写入失败的预测记录）"""
+    return f"{DB_PATH}-spill.jsonl"
+
+def get_writer():
+    """获取进程级的异步写入队列，首次调用时创建并在进程退出时写完剩余记录"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = PredictionWriter()
+                # atexit按注册的相反顺序执行，保证在关闭连接池之前写完
+                atexit.register(_writer.stop)
+    return _writer
+
+def enqueue_prediction(patient_id, username, features, prediction_result, probability, model_type, model_fingerprint=None,
+                       prediction_uid=None):
+    """将预测记录放入异步写入队列，立即返回"""
+    get_writer().submit(
+        _prediction_row(patient_id, username, features, prediction_result, probability, model_type, model_fingerprint,
+                        prediction_uid)
     )
+
+def enqueue_predictions_batch(records):
+    """
+    将多条预测记录放入异步写入队列
+    
+    参数:
+        records: 可迭代对象，每个元素为 (patient_id, username, features, prediction_result, probability, model_type)，
+                 可以在末尾附加model_fingerprint和prediction_uid
+    """
+    now = datetime.datetime.now()
+    # 整组记录作为一个队列项，由后台线程用一次executemany写入
+    return get_writer().submit_many(_prediction_row(*record, prediction_date=now) for record in records)
+
+# 本进程中已登记过的模型版本 (数据库路径, 指纹)
+_registered_versions = set()
+
+def register_model_version(fingerprint, model_type, source=None, artifacts=None):
+    """
+    登记一个模型版本（已存在时忽略），每个进程对每个版本只写入一次数据库
+    
+    参数:
+        fingerprint (str): 模型集的内容指纹
+        model_type (str): 模型类型（如 "Real Model"）
+        source (str): 模型文件所在的目录或模型包路径
+        artifacts (list): 模型文件的 (文件名, 字节数) 列表
+    """
+    key = (DB_PATH, fingerprint)
+    if key in _registered_versions:
+        return
+    with get_pool().transaction() as conn:
+        conn.execute(
+            'INSERT OR IGNORE INTO model_versions (fingerprint, model_type, source, artifacts) VALUES (?, ?, ?, ?)',
+            (fingerprint, model_type, source, json.dumps(artifacts) if artifacts is not None else None)
+        )
+    _registered_versions.add(key)
+
+def get_model_versions():
+    """获取所有已登记的模型版本及其预测记录数"""
+    query = '''
+    SELECT v.fingerprint, v.model_type, v.source, v.first_seen,
+           (SELECT COUNT(*) FROM prediction_history p WHERE p.model_fingerprint = v.fingerprint) AS predictions
+    FROM model_versions v
+    ORDER BY v.first_seen DESC
+    '''
+    with get_pool().connection() as conn:
+        return pd.read_sql_query(query, conn)
+
+def save_shadow_predictions(rows):
+    """
+    在一个事务中保存一批影子评分结果
+    
+    参数:
+        rows: 可迭代对象，每个元素为 (scored_at, prediction_uid, primary_fingerprint, candidate_fingerprint,
+              primary_result, primary_probability, primary_latency_ms, candidate_result, candidate_probability,
+              candidate_latency_ms)
+    """
+    rows = list(rows)
+    if rows:
+        with get_pool().transaction() as conn:
+            conn.executemany(INSERT_SHADOW_PREDICTION_SQL, rows)
+    return len(rows)
+
+def get_shadow_summary(date_from=None, date_to=None):
+    """
+    按 (候选模型, 主模型) 汇总影子评分结果
+    
+    参数:
+        date_from (date): 开始日期（包含）
+        date_to (date): 结束日期（包含）
+    
+    返回:
+        DataFrame: 每对模型一行，包括评分次数、结果一致率、概率差（候选 - 主模型）的均值/绝对值均值/
+                   最大绝对值，以及两者的平均耗时（毫秒）
+    """
+    clauses, params = [], []
+    if date_from:
+        clauses.append('s.scored_at >= ?')
+        params.append(str(date_from))
+    if date_to:
+        clauses.append('s.scored_at < ?')
+        params.append(str(date_to + datetime.timedelta(days=1)))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    query = f'''
+    SELECT s.candidate_fingerprint, v.source AS candidate_source, s.primary_fingerprint,
+           COUNT(*) AS predictions,
+           AVG(s.candidate_result = s.primary_result) AS agreement_rate,
+           AVG(s.candidate_probability - s.primary_probability) AS mean_delta,
+           AVG(ABS(s.candidate_probability - s.primary_probability)) AS mean_abs_delta,
+           MAX(ABS(s.candidate_probability - s.primary_probability)) AS max_abs_delta,
+           AVG(s.primary_latency_ms) AS primary_latency_ms,
+           AVG(s.candidate_latency_ms) AS candidate_latency_ms,
+           MIN(s.scored_at) AS first_scored,
+           MAX(s.scored_at) AS last_scored
+    FROM shadow_predictions s
+    LEFT JOIN model_versions v ON v.fingerprint = s.candidate_fingerprint
+    {where}
+    GROUP BY s.candidate_fingerprint, s.primary_fingerprint
+    ORDER BY last_scored DESC
+    '''
+    with get_pool().connection() as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+def get_shadow_disagreements(date_from=None, date_to=None, limit=100):
+    """
+    获取候选模型与主模型结果不一致的影子评分记录，按时间倒序
     
-    conn.commit()
-    conn.close()
+    参数:
+        date_from (date): 开始日期（包含）
+        date_to (date): 结束日期（包含）
+        limit (int): 最多返回的记录数
+    
+    返回:
+        DataFrame: 每条不一致的评分一行，通过prediction_uid关联到预测记录的ID和患者ID
+                   （预测记录尚未写入或早于结构版本5时为空）
+    """
+    clauses, params = ['s.candidate_result != s.primary_result'], []
+    if date_from:
+        clauses.append('s.scored_at >= ?')
+        params.append(str(date_from))
+    if date_to:
+        clauses.append('s.scored_at < ?')
+        params.append(str(date_to + datetime.timedelta(days=1)))
+    query = f'''
+    SELECT s.scored_at, h.id AS prediction_id, h.patient_id, s.candidate_fingerprint,
+           s.primary_result, s.primary_probability, s.candidate_result, s.candidate_probability
+    FROM shadow_predictions s
+    LEFT JOIN prediction_history h ON h.prediction_uid = s.prediction_uid
+    WHERE {' AND '.join(clauses)}
+    ORDER BY s.scored_at DESC
+    LIMIT ?
+    '''
+    with get_pool().connection() as conn:
+        return pd.read_sql_query(query, conn, params=params + [limit])
 
 def get_all_predictions():
     """获取所有预测记录"""
-    conn = sqlite3.connect(DB_PATH)
-    
     # 读取所有记录
     query = '''
     SELECT id, patient_id, username, prediction_date, prediction_result, probability, model_type
@@ -66,15 +753,11 @@ def get_all_predictions():
     ORDER BY prediction_date DESC
     '''
     
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    
-    return df
+    with get_pool().connection() as conn:
+        return pd.read_sql_query(query, conn)
 
 def get_predictions_by_user(username):
     """获取指定用户的预测记录"""
-    conn = sqlite3.connect(DB_PATH)
-    
     # 读取指定用户的记录
     query = '''
     SELECT id, patient_id, username, prediction_date, prediction_result, probability, model_type
@@ -83,38 +766,157 @@ def get_predictions_by_user(username):
     ORDER BY prediction_date DESC
     '''
     
-    df = pd.read_sql_query(query, conn, params=(username,))
-    conn.close()
+    with get_pool().connection() as conn:
+        return pd.read_sql_query(query, conn, params=(username,))
+
+def _build_filters(date_from=None, date_to=None, username=None, patient_id=None, prediction_result=None,
+                   model_type=None, min_probability=None, max_probability=None, model_fingerprint=None):
+    """
+    根据筛选条件生成WHERE子句和参数，值为None的条件会被忽略
+    
+    参数:
+        date_from (date): 起始日期（包含）
+        date_to (date): 结束日期（包含）
+        username (str): 用户名
+        patient_id (str): 患者ID
+        prediction_result (str): 预测结果（FBTP或NFBTP）
+        model_type (str): 模型类型
+        min_probability (float): 最小概率（包含）
+        max_probability (float): 最大概率（包含）
+        model_fingerprint (str): 模型版本指纹
+    """
+    clauses = []
+    params = []
+    if date_from is not None:
+        clauses.append('prediction_date >= ?')
+        params.append(str(date_from))
+    if date_to is not None:
+        # 日期以文本存储，结束日期取下一天零点之前
+        clauses.append('prediction_date < ?')
+        params.append(str(date_to + datetime.timedelta(days=1)))
+    if username:
+        clauses.append('username = ?')
+        params.append(username)
+    if patient_id:
+        clauses.append('patient_id = ?')
+        params.append(patient_id)
+    if prediction_result:
+        clauses.append('prediction_result = ?')
+        params.append(prediction_result)
+    if model_type:
+        clauses.append('model_type = ?')
+        params.append(model_type)
+    if model_fingerprint:
+        clauses.append('model_fingerprint = ?')
+        params.append(model_fingerprint)
+    if min_probability is not None:
+        clauses.append('probability >= ?')
+        params.append(float(min_probability))
+    if max_probability is not None:
+        clauses.append('probability <= ?')
+        params.append(float(max_probability))
+    return clauses, params
+
+def query_predictions(page_size=DEFAULT_PAGE_SIZE, cursor=None, **filters):
+    """
+    按时间倒序分页查询预测记录（键集分页，翻页代价与页码无关）
+    
+    参数:
+        page_size (int): 每页记录数
+        cursor (tuple): 上一页最后一条记录的 (prediction_date, id)，为None时返回第一页
+        **filters: 筛选条件，见 _build_filters
+    
+    返回:
+        tuple: (当前页的DataFrame, 下一页的cursor；没有下一页时为None)
+    """
+    clauses, params = _build_filters(**filters)
+    if cursor is not None:
+        clauses.append('(prediction_date < ? OR (prediction_date = ? AND id < ?))')
+        params.extend([cursor[0], cursor[0], cursor[1]])
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    query = f'''
+    SELECT {HISTORY_COLUMNS}
+    FROM prediction_history
+    {where}
+    ORDER BY prediction_date DESC, id DESC
+    LIMIT ?
+    '''
+    
+    # 多取一条用于判断是否还有下一页
+    with get_pool().connection() as conn:
+        df = pd.read_sql_query(query, conn, params=params + [page_size + 1])
     
-    return df
+    next_cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        last = df.iloc[-1]
+        next_cursor = (last['prediction_date'], int(last['id']))
+    
+    return df, next_cursor
+
+def count_predictions(**filters):
+    """统计满足筛选条件的预测记录数"""
+    clauses, params = _build_filters(**filters)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    with get_pool().connection() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM prediction_history {where}', params).fetchone()[0]
+
+def get_filter_options():
+    """获取筛选控件可选的用户名和模型类型（通过索引读取，不扫描全表）"""
+    with get_pool().connection() as conn:
+        usernames = [row[0] for row in conn.execute('SELECT DISTINCT username FROM prediction_history ORDER BY username')]
+        model_types = [row[0] for row in conn.execute('SELECT DISTINCT model_type FROM prediction_history ORDER BY model_type')]
+    return {'usernames': usernames, 'model_types': model_types}
+
+def load_feature_matrix(**filters):
+    """
+    直接将满足筛选条件的记录的特征读取为NumPy矩阵，用于漂移分析和重新评分
+    
+    参数:
+        **filters: 筛选条件，见 _build_filters
+    
+    返回:
+        tuple: (ids, X)，ids形状为 [n_samples]，X为按ALL_FEATURES排列的 [n_samples, 14] float64矩阵。
+               存在缺失特征的记录会被跳过。
+    """
+    clauses, params = _build_filters(**filters)
+    clauses.extend(f'{column} IS NOT NULL' for column in FEATURE_COLUMNS.values())
+    query = f'''
+    SELECT id, {FEATURE_COLUMN_LIST}
+    FROM prediction_history
+    WHERE {' AND '.join(clauses)}
+    ORDER BY id
+    '''
+    
+    with get_pool().connection() as conn:
+        values = np.fromiter(
+            itertools.chain.from_iterable(conn.execute(query, params)),
+            dtype=np.float64
+        )
+    
+    matrix = values.reshape(-1, len(FEATURE_COLUMNS) + 1)
+    return matrix[:, 0].astype(np.int64), np.ascontiguousarray(matrix[:, 1:])
 
 def get_prediction_details(prediction_id):
     """获取单条预测记录的完整详情，包括特征数据"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     # 读取指定ID的记录
-    cursor.execute(
-        '''
-        SELECT * FROM prediction_history WHERE id = ?
-        ''',
-        (prediction_id,)
-    )
-    
-    record = cursor.fetchone()
-    conn.close()
+    with get_pool().connection() as conn:
+        record = conn.execute(
+            f'''
+            SELECT {HISTORY_COLUMNS}, {FEATURE_COLUMN_LIST} FROM prediction_history WHERE id = ?
+            ''',
+            (prediction_id,)
+        ).fetchone()
     
     if not record:
         return None
     
     # 将记录转换为字典
-    columns = ['id', 'patient_id', 'username', 'prediction_date', 'features', 'prediction_result', 'probability', 'model_type']
+    columns = [column.strip() for column in HISTORY_COLUMNS.split(',')]
     record_dict = dict(zip(columns, record))
     
-    # 将features从JSON字符串解析回字典
-    record_dict['features'] = json.loads(record_dict['features'])
+    # 按ALL_FEATURES的顺序还原特征字典
+    record_dict['features'] = dict(zip(ALL_FEATURES, record[len(columns):]))
     
     return record_dict
-
-# 确保应用启动时初始化数据库
-init_db() 
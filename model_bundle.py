@@ -0,0 +1,489 @@
+"""
+单文件模型包格式。
+
+模型包把堆叠模型的所有拟合参数（标准化器、三个朴素贝叶斯模型、SVC元分类器的支持向量、
+对偶系数和Platt缩放参数）保存在一个uint8类型的.npy文件中：
+
+    [8字节魔数][8字节清单长度][JSON清单][按64字节对齐的各个数组]
+
+清单记录格式版本、各数组的dtype/形状/偏移量、标量参数和数据区的SHA-256校验和。
+文件通过np.load(mmap_mode='r')加载，各数组是内存映射的只读视图，多个工作进程共享
+同一份物理内存页；加载时不执行pickle，只读取数值数据。
+
+用法示例:
+    python -m model_bundle export models -o models/model_bundle.npy
+    python -m model_bundle inspect models/model_bundle.npy
+    python -m model_bundle verify models/model_bundle.npy --against models
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from model_utils import (ALL_FEATURES, BINARY_FEATURES, CONTINUOUS_FEATURES,
+                         DISCRETE_FEATURES, MODEL_ARTIFACTS, _positive_class_index,
+                         _probe_features, _sklearn_base_probabilities)
+
+# 模型包格式标识和版本
+BUNDLE_MAGIC = b"MCRPCMB\x00"
+BUNDLE_FORMAT = "mcrpc-model-bundle"
+BUNDLE_VERSION = 1
+BUNDLE_ALIGNMENT = 64
+
+# libsvm概率输出的计算参数（与scikit-learn内置的libsvm一致）
+LIBSVM_MIN_PROB = 1e-7
+LIBSVM_MAX_ITER = 100
+
+class BundleError(ValueError):
+    """模型包格式错误、版本不支持或校验和不匹配"""
+
+def _align(offset):
+    """向上对齐到BUNDLE_ALIGNMENT字节"""
+    return -(-offset // BUNDLE_ALIGNMENT) * BUNDLE_ALIGNMENT
+
+def _classes(model):
+    """模型的类别标签列表"""
+    return [str(label) for label in model.classes_]
+
+def _svc_kernel_params(svc):
+    """提取SVC核函数参数，只支持libsvm的内置核函数"""
+    if svc.kernel not in ('linear', 'poly', 'rbf', 'sigmoid'):
+        raise BundleError(f"Unsupported SVC kernel for bundling: {svc.kernel!r}")
+    return {
+        'kernel': svc.kernel,
+        'gamma': float(svc._gamma),
+        'coef0': float(svc.coef0),
+        'degree': int(svc.degree),
+    }
+
+def collect_arrays(models, scaler):
+    """
+    从已拟合的模型中提取模型包需要的数组和标量参数。
+    
+    返回:
+        tuple: (arrays, params)，arrays为 名称 -> np.ndarray，params为可JSON序列化的标量参数
+    """
+    gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta = models[:4]
+    for model in models[:4]:
+        if len(getattr(model, 'classes_', ())) != 2:
+            raise BundleError("Only fitted binary models can be bundled (dummy models are not supported)")
+    if len(getattr(svc_meta, 'probA_', ())) != 1:
+        raise BundleError("The meta-classifier must be an SVC fitted with probability=True")
+    
+    arrays = {
+        'scaler/mean': scaler.mean_ if scaler.mean_ is not None else np.zeros(len(CONTINUOUS_FEATURES)),
+        'scaler/scale': scaler.scale_ if scaler.scale_ is not None else np.ones(len(CONTINUOUS_FEATURES)),
+        'gaussian_nb/theta': gaussian_nb.theta_,
+        'gaussian_nb/var': gaussian_nb.var_,
+        'gaussian_nb/class_prior': gaussian_nb.class_prior_,
+        'gaussian_nb/class_count': gaussian_nb.class_count_,
+        'multinomial_nb/feature_log_prob': multinomial_nb.feature_log_prob_,
+        'multinomial_nb/class_log_prior': multinomial_nb.class_log_prior_,
+        'multinomial_nb/feature_count': multinomial_nb.feature_count_,
+        'multinomial_nb/class_count': multinomial_nb.class_count_,
+        'bernoulli_nb/feature_log_prob': bernoulli_nb.feature_log_prob_,
+        'bernoulli_nb/class_log_prior': bernoulli_nb.class_log_prior_,
+        'bernoulli_nb/feature_count': bernoulli_nb.feature_count_,
+        'bernoulli_nb/class_count': bernoulli_nb.class_count_,
+        'svc_meta/support_vectors': svc_meta.support_vectors_,
+        'svc_meta/dual_coef': svc_meta.dual_coef_,
+        'svc_meta/intercept': svc_meta.intercept_,
+        'svc_meta/prob_a': svc_meta.probA_,
+        'svc_meta/prob_b': svc_meta.probB_,
+    }
+    arrays = {name: np.ascontiguousarray(value, dtype=np.float64) for name, value in arrays.items()}
+    params = {
+        'features': {
+            'continuous': CONTINUOUS_FEATURES,
+            'discrete': DISCRETE_FEATURES,
+            'binary': BINARY_FEATURES,
+        },
+        'classes': {
+            'gaussian_nb': _classes(gaussian_nb),
+            'multinomial_nb': _classes(multinomial_nb),
+            'bernoulli_nb': _classes(bernoulli_nb),
+            'svc_meta': _classes(svc_meta),
+        },
+        'bernoulli_nb': {'binarize': None if bernoulli_nb.binarize is None else float(bernoulli_nb.binarize)},
+        'svc_meta': _svc_kernel_params(svc_meta),
+    }
+    return arrays, params
+
+def write_bundle(path, models, scaler, metadata=None):
+    """
+    将模型集写入单文件模型包。
+    
+    参数:
+        path (str): 输出文件路径（.npy）。
+        models (tuple): (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta)
+        scaler (StandardScaler): 连续特征的标准化器。
+        metadata (dict): 额外写入清单的信息（如来源、校验结果）。
+    
+    返回:
+        dict: 写入的清单
+    """
+    arrays, params = collect_arrays(models, scaler)
+    
+    # 数据区中各数组的位置（相对数据区起点，按64字节对齐）
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset, 'nbytes': array.nbytes}
+        offset += array.nbytes
+    data = np.zeros(_align(offset), dtype=np.uint8)
+    for name, array in arrays.items():
+        start = layout[name]['offset']
+        data[start:start + array.nbytes] = np.frombuffer(array.tobytes(), dtype=np.uint8)
+    
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'version': BUNDLE_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'params': params,
+        'arrays': layout,
+        'checksum': {'algorithm': 'sha256', 'value': hashlib.sha256(data).hexdigest()},
+        'metadata': metadata or {},
+    }
+    manifest_bytes = json.dumps(manifest, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    header_size = _align(len(BUNDLE_MAGIC) + 8 + len(manifest_bytes))
+    
+    payload = np.zeros(header_size + len(data), dtype=np.uint8)
+    payload[:len(BUNDLE_MAGIC)] = np.frombuffer(BUNDLE_MAGIC, dtype=np.uint8)
+    payload[len(BUNDLE_MAGIC):len(BUNDLE_MAGIC) + 8] = np.frombuffer(
+        len(manifest_bytes).to_bytes(8, 'little'), dtype=np.uint8
+    )
+    payload[len(BUNDLE_MAGIC) + 8:len(BUNDLE_MAGIC) + 8 + len(manifest_bytes)] = np.frombuffer(manifest_bytes, dtype=np.uint8)
+    payload[header_size:] = data
+    
+    # 先写临时文件再替换，正在读取旧模型包的进程不受影响
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, payload, allow_pickle=False)
+    os.replace(tmp_path, path)
+    return manifest
+
+def read_manifest(payload):
+    """解析模型包的清单，返回 (manifest, 数据区起点)"""
+    if payload.ndim != 1 or payload.dtype != np.uint8 or bytes(payload[:len(BUNDLE_MAGIC)]) != BUNDLE_MAGIC:
+        raise BundleError("Not a model bundle")
+    length = int.from_bytes(bytes(payload[len(BUNDLE_MAGIC):len(BUNDLE_MAGIC) + 8]), 'little')
+    start = len(BUNDLE_MAGIC) + 8
+    manifest = json.loads(bytes(payload[start:start + length]).decode('utf-8'))
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise BundleError("Not a model bundle")
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise BundleError(f"Unsupported model bundle version: {manifest.get('version')}")
+    return manifest, _align(start + length)
+
+def open_bundle(path, verify=True):
+    """
+    以内存映射方式打开模型包。
+    
+    参数:
+        path (str): 模型包路径。
+        verify (bool): 是否校验数据区的SHA-256校验和。
+    
+    返回:
+        tuple: (manifest, arrays)，arrays中的数组是只读的内存映射视图
+    """
+    payload = np.load(path, mmap_mode='r', allow_pickle=False)
+    manifest, data_start = read_manifest(payload)
+    data = payload[data_start:]
+    if verify:
+        digest = hashlib.sha256(memoryview(data)).hexdigest()
+        if digest != manifest['checksum']['value']:
+            raise BundleError(f"Model bundle checksum mismatch: {path}")
+    
+    arrays = {}
+    for name, spec in manifest['arrays'].items():
+        start = spec['offset']
+        arrays[name] = data[start:start + spec['nbytes']].view(np.dtype(spec['dtype'])).reshape(spec['shape'])
+    return manifest, arrays
+
+class BundledScaler:
+    """与StandardScaler.transform等价的标准化器"""
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+    
+    def transform(self, X):
+        return (np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_
+
+class _BundledNB:
+    """朴素贝叶斯模型的公共部分：由联合对数似然计算类别概率"""
+    def __init__(self, classes):
+        self.classes_ = np.asarray(classes)
+    
+    def predict_proba(self, X):
+        jll = self._joint_log_likelihood(np.asarray(X, dtype=np.float64))
+        jll = jll - jll.max(axis=1, keepdims=True)
+        proba = np.exp(jll)
+        return proba / proba.sum(axis=1, keepdims=True)
+    
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+class BundledGaussianNB(_BundledNB):
+    """与GaussianNB等价的预测模型"""
+    def __init__(self, classes, theta, var, class_prior, class_count):
+        super().__init__(classes)
+        self.theta_ = theta
+        self.var_ = var
+        self.class_prior_ = class_prior
+        self.class_count_ = class_count
+    
+    def _joint_log_likelihood(self, X):
+        log_norm = -0.5 * np.sum(np.log(2.0 * np.pi * self.var_), axis=1)
+        squares = ((X[:, None, :] - self.theta_[None, :, :]) ** 2 / self.var_[None, :, :]).sum(axis=2)
+        return np.log(self.class_prior_) + log_norm - 0.5 * squares
+
+class BundledMultinomialNB(_BundledNB):
+    """与MultinomialNB等价的预测模型"""
+    def __init__(self, classes, feature_log_prob, class_log_prior, feature_count, class_count):
+        super().__init__(classes)
+        self.feature_log_prob_ = feature_log_prob
+        self.class_log_prior_ = class_log_prior
+        self.feature_count_ = feature_count
+        self.class_count_ = class_count
+    
+    def _joint_log_likelihood(self, X):
+        return X @ self.feature_log_prob_.T + self.class_log_prior_
+
+class BundledBernoulliNB(_BundledNB):
+    """与BernoulliNB等价的预测模型"""
+    def __init__(self, classes, feature_log_prob, class_log_prior, feature_count, class_count, binarize):
+        super().__init__(classes)
+        self.feature_log_prob_ = feature_log_prob
+        self.class_log_prior_ = class_log_prior
+        self.feature_count_ = feature_count
+        self.class_count_ = class_count
+        self.binarize = binarize
+    
+    def _joint_log_likelihood(self, X):
+        if self.binarize is not None:
+            X = (X > self.binarize).astype(np.float64)
+        neg_prob = np.log1p(-np.exp(self.feature_log_prob_))
+        return X @ (self.feature_log_prob_ - neg_prob).T + self.class_log_prior_ + neg_prob.sum(axis=1)
+
+def _libsvm_binary_probability(r):
+    """
+    复现libsvm的multiclass_probability在两个类别时的迭代求解，返回第一个类别的概率。
+    
+    scikit-learn内置的libsvm对二分类也使用该迭代（收敛阈值0.005/k），直接使用Platt
+    概率会与predict_proba存在最多约0.0025的差异。
+    """
+    n = len(r)
+    q00, q11, q01 = (1.0 - r) ** 2, r ** 2, -(1.0 - r) * r
+    p0 = np.full(n, 0.5)
+    p1 = np.full(n, 0.5)
+    eps = 0.005 / 2
+    active = np.arange(n)
+    for _ in range(LIBSVM_MAX_ITER):
+        a00, a11, a01 = q00[active], q11[active], q01[active]
+        x0, x1 = p0[active], p1[active]
+        qp0 = a00 * x0 + a01 * x1
+        qp1 = a01 * x0 + a11 * x1
+        pqp = x0 * qp0 + x1 * qp1
+        running = np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp)) >= eps
+        if not running.any():
+            break
+        active = active[running]
+        a00, a11, a01 = a00[running], a11[running], a01[running]
+        x0, x1, qp0, qp1, pqp = x0[running], x1[running], qp0[running], qp1[running], pqp[running]
+        
+        # t = 0
+        diff = (-qp0 + pqp) / a00
+        x0 = x0 + diff
+        pqp = (pqp + diff * (diff * a00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+        qp0 = (qp0 + diff * a00) / (1 + diff)
+        qp1 = (qp1 + diff * a01) / (1 + diff)
+        x0 = x0 / (1 + diff)
+        x1 = x1 / (1 + diff)
+        
+        # t = 1
+        diff = (-qp1 + pqp) / a11
+        x1 = x1 + diff
+        x0 = x0 / (1 + diff)
+        x1 = x1 / (1 + diff)
+        
+        p0[active], p1[active] = x0, x1
+    return p0
+
+class BundledSVC:
+    """
+    与SVC(probability=True)等价的numpy实现，支持libsvm的内置核函数。
+    
+    decision_function与scikit-learn一致（正值对应classes_[1]），predict_proba按libsvm的
+    方式计算：Platt缩放、概率截断到[1e-7, 1-1e-7]，再经过两类的耦合迭代。
+    """
+    def __init__(self, classes, support_vectors, dual_coef, intercept, prob_a, prob_b,
+                 kernel='rbf', gamma=1.0, coef0=0.0, degree=3):
+        self.classes_ = np.asarray(classes)
+        self.support_vectors_ = support_vectors
+        self.dual_coef_ = dual_coef
+        self.intercept_ = intercept
+        self.probA_ = prob_a
+        self.probB_ = prob_b
+        self.kernel = kernel
+        self._gamma = gamma
+        self.coef0 = coef0
+        self.degree = degree
+        self._sv_norms = np.einsum('ij,ij->i', support_vectors, support_vectors)
+    
+    def _kernel(self, X):
+        dot = X @ self.support_vectors_.T
+        if self.kernel == 'linear':
+            return dot
+        if self.kernel == 'poly':
+            return (self._gamma * dot + self.coef0) ** self.degree
+        if self.kernel == 'sigmoid':
+            return np.tanh(self._gamma * dot + self.coef0)
+        squared = np.einsum('ij,ij->i', X, X)[:, None] + self._sv_norms[None, :] - 2.0 * dot
+        return np.exp(-self._gamma * np.maximum(squared, 0.0))
+    
+    def decision_function(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        return self._kernel(X) @ self.dual_coef_[0] + self.intercept_[0]
+    
+    def predict_proba(self, X):
+        # libsvm内部的决策值与scikit-learn的decision_function符号相反
+        f_apb = -self.decision_function(X) * self.probA_[0] + self.probB_[0]
+        pairwise = np.where(
+            f_apb >= 0,
+            np.exp(-np.maximum(f_apb, 0.0)) / (1.0 + np.exp(-np.maximum(f_apb, 0.0))),
+            1.0 / (1.0 + np.exp(np.minimum(f_apb, 0.0)))
+        )
+        pairwise = np.clip(pairwise, LIBSVM_MIN_PROB, 1.0 - LIBSVM_MIN_PROB)
+        first = _libsvm_binary_probability(pairwise)
+        return np.column_stack([first, 1.0 - first])
+    
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def models_from_arrays(params, arrays):
+    """由清单参数和数组构造模型集，返回 (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta, scaler)"""
+    classes = params['classes']
+    if params['features']['continuous'] + params['features']['discrete'] + params['features']['binary'] != ALL_FEATURES:
+        raise BundleError("Model bundle was built for a different feature layout")
+    
+    def group(prefix):
+        return {name.split('/', 1)[1]: array for name, array in arrays.items() if name.startswith(prefix + '/')}
+    
+    gaussian = group('gaussian_nb')
+    multinomial = group('multinomial_nb')
+    bernoulli = group('bernoulli_nb')
+    svc = group('svc_meta')
+    scaler = group('scaler')
+    
+    return (
+        BundledGaussianNB(classes['gaussian_nb'], gaussian['theta'], gaussian['var'],
+                          gaussian['class_prior'], gaussian['class_count']),
+        BundledMultinomialNB(classes['multinomial_nb'], multinomial['feature_log_prob'],
+                             multinomial['class_log_prior'], multinomial['feature_count'],
+                             multinomial['class_count']),
+        BundledBernoulliNB(classes['bernoulli_nb'], bernoulli['feature_log_prob'],
+                           bernoulli['class_log_prior'], bernoulli['feature_count'],
+                           bernoulli['class_count'], params['bernoulli_nb']['binarize']),
+        BundledSVC(classes['svc_meta'], svc['support_vectors'], svc['dual_coef'], svc['intercept'],
+                   svc['prob_a'], svc['prob_b'], **params['svc_meta']),
+        BundledScaler(scaler['mean'], scaler['scale']),
+    )
+
+def load_bundle(path, verify=True):
+    """
+    从模型包加载模型集（不执行pickle，数组为内存映射视图）。
+    
+    返回:
+        tuple: (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta, scaler)，
+               接口与scikit-learn模型一致，可直接用于make_predictions_batch
+    """
+    manifest, arrays = open_bundle(path, verify=verify)
+    return models_from_arrays(manifest['params'], arrays)
+
+def compare_models(reference, candidate, n_samples=2000, seed=0):
+    """
+    在探测样本上比较两个模型集的基础层和元分类器输出。
+    
+    返回:
+        dict: base_max_error（基础层FBTP概率）和meta_max_error（元分类器FBTP概率）的最大绝对误差
+    """
+    probe = _probe_features(reference[4], n_samples=n_samples, seed=seed)
+    base_ref = _sklearn_base_probabilities(probe, reference, reference[4])
+    base_new = _sklearn_base_probabilities(probe, candidate, candidate[4])
+    meta_ref = reference[3].predict_proba(base_ref)[:, _positive_class_index(reference[3])]
+    meta_new = candidate[3].predict_proba(base_ref)[:, _positive_class_index(candidate[3])]
+    return {
+        'base_max_error': float(np.max(np.abs(base_ref - base_new))),
+        'meta_max_error': float(np.max(np.abs(meta_ref - meta_new))),
+    }
+
+def load_artifact_directory(model_dir):
+    """从目录加载五个pickle/joblib模型文件（.joblib优先，其次.pkl）"""
+    import joblib
+    
+    artifacts = []
+    for name in MODEL_ARTIFACTS:
+        for extension in ('.joblib', '.pkl'):
+            path = os.path.join(model_dir, name + extension)
+            if os.path.exists(path):
+                artifacts.append(joblib.load(path))
+                break
+        else:
+            raise FileNotFoundError(f"Missing model artifact '{name}' in {model_dir}")
+    return tuple(artifacts)
+
+def export_bundle(model_dir, output):
+    """
+    将模型目录中的pickle/joblib模型导出为模型包。
+    
+    导出前在探测样本上比较模型包的输出与原模型，误差写入清单的metadata.verification。
+    
+    返回:
+        dict: 写入的清单
+    """
+    models = load_artifact_directory(model_dir)
+    arrays, params = collect_arrays(models[:4], models[4])
+    errors = compare_models(models, models_from_arrays(params, arrays))
+    metadata = {'source': os.path.abspath(model_dir), 'verification': errors}
+    return write_bundle(output, models[:4], models[4], metadata=metadata)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export, inspect and verify single-file model bundles.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    export_parser = subparsers.add_parser('export', help="Convert pickle/joblib artifacts into a bundle")
+    export_parser.add_argument('model_dir', help="Directory containing the five model artifacts")
+    export_parser.add_argument('-o', '--output', required=True, help="Output bundle path (.npy)")
+    
+    inspect_parser = subparsers.add_parser('inspect', help="Print the bundle manifest")
+    inspect_parser.add_argument('bundle')
+    
+    verify_parser = subparsers.add_parser('verify', help="Check the checksum and optionally compare with artifacts")
+    verify_parser.add_argument('bundle')
+    verify_parser.add_argument('--against', help="Directory with the original artifacts to compare predictions")
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'export':
+        manifest = export_bundle(args.model_dir, args.output)
+        errors = manifest['metadata']['verification']
+        print(f"Wrote {args.output} ({os.path.getsize(args.output)} bytes), "
+              f"base max error {errors['base_max_error']:.3g}, meta max error {errors['meta_max_error']:.3g}")
+    elif args.command == 'inspect':
+        manifest, _ = open_bundle(args.bundle, verify=False)
+        print(json.dumps(manifest, indent=2, ensure_ascii=False))
+    else:
+        models = load_bundle(args.bundle, verify=True)
+        print(f"{args.bundle}: checksum OK")
+        if args.against:
+            errors = compare_models(load_artifact_directory(args.against), models)
+            print(f"base max error {errors['base_max_error']:.3g}, meta max error {errors['meta_max_error']:.3g}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
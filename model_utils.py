@@ -1,16 +1,35 @@
+import hashlib
+import logging
 import os
 import pickle
+import threading
+import time
+from collections import OrderedDict
 
-import joblib
 import numpy as np
-from sklearn.naive_bayes import BernoulliNB, GaussianNB, MultinomialNB
-from sklearn.preprocessing import StandardScaler
-from sklearn.svm import SVC
+
+from startup_timing import STARTUP_TIMER, timed_import
+
+logger = logging.getLogger(__name__)
 
 # 模型文件路径
 MODEL_DIR = "models"
 DUMMY_MODEL_DIR = "dummy_models"
 
+# 模型集中各组件的名称及其文件名
+MODEL_ARTIFACTS = ['gaussian_nb', 'multinomial_nb', 'bernoulli_nb', 'svc_meta', 'scaler']
+DUMMY_MODEL_FILES = {
+    'gaussian_nb': 'gaussian_nb.pkl',
+    'multinomial_nb': 'multinomial_nb.pkl',
+    'bernoulli_nb': 'bernoulli_nb.pkl',
+    'svc_meta': 'svc_meta.pkl',
+    'scaler': 'scaler.joblib'
+}
+REAL_MODEL_FILES = {name: f'{name}.joblib' for name in MODEL_ARTIFACTS}
+
+# 单文件模型包（见model_bundle），存在时优先于上面的单独模型文件加载
+MODEL_BUNDLE_FILE = 'model_bundle.npy'
+
 # 连续特征、离散特征和二元特征的列表
 CONTINUOUS_FEATURES = [
     'Std. dev: g/mL_Choline_Bone+',
@@ -38,6 +57,11 @@ BINARY_FEATURES = [
 # 所有特征列表
 ALL_FEATURES = CONTINUOUS_FEATURES + DISCRETE_FEATURES + BINARY_FEATURES
 
+# 各类特征在ALL_FEATURES中的列范围
+CONTINUOUS_SLICE = slice(0, len(CONTINUOUS_FEATURES))
+DISCRETE_SLICE = slice(CONTINUOUS_SLICE.stop, CONTINUOUS_SLICE.stop + len(DISCRETE_FEATURES))
+BINARY_SLICE = slice(DISCRETE_SLICE.stop, DISCRETE_SLICE.stop + len(BINARY_FEATURES))
+
 # 将DummyModel类移到模块级别
 class DummyModel:
     """一个简单的模拟模型，总是预测FBTP类别，概率为0.8"""
@@ -74,119 +98,257 @@ class DummyModel:
 def create_real_models():
     """
     创建实际的机器学习模型作为替代模型，保持与最终模型相同的输入输出维度。
+    
+    实现位于model_factory中，按需导入以免启动时加载scikit-learn。
     """
-    if not os.path.exists(MODEL_DIR):
-        os.makedirs(MODEL_DIR)
-    
-    # 为连续特征创建GaussianNB模型
-    gaussian_nb = GaussianNB()
-    X_continuous = np.random.rand(100, len(CONTINUOUS_FEATURES))
-    y_continuous = np.random.choice(['NFBTP', 'FBTP'], size=100)
-    gaussian_nb.fit(X_continuous, y_continuous)
-    
-    # 为离散特征创建MultinomialNB模型
-    multinomial_nb = MultinomialNB()
-    X_discrete = np.random.randint(0, 5, size=(100, len(DISCRETE_FEATURES)))
-    y_discrete = np.random.choice(['NFBTP', 'FBTP'], size=100)
-    multinomial_nb.fit(X_discrete, y_discrete)
-    
-    # 为二元特征创建BernoulliNB模型
-    bernoulli_nb = BernoulliNB()
-    X_binary = np.random.randint(0, 2, size=(100, len(BINARY_FEATURES)))
-    y_binary = np.random.choice(['NFBTP', 'FBTP'], size=100)
-    bernoulli_nb.fit(X_binary, y_binary)
-    
-    # 为元分类器创建SVC模型
-    svc_meta = SVC(probability=True)
-    X_meta = np.random.rand(100, 3)  # 3个基础分类器的输出
-    y_meta = np.random.choice(['NFBTP', 'FBTP'], size=100)
-    svc_meta.fit(X_meta, y_meta)
-    
-    # 创建并保存标准化器
-    scaler = StandardScaler()
-    scaler.fit(X_continuous)
-    
-    # 保存模型
-    joblib.dump(gaussian_nb, os.path.join(MODEL_DIR, 'gaussian_nb.joblib'))
-    joblib.dump(multinomial_nb, os.path.join(MODEL_DIR, 'multinomial_nb.joblib'))
-    joblib.dump(bernoulli_nb, os.path.join(MODEL_DIR, 'bernoulli_nb.joblib'))
-    joblib.dump(svc_meta, os.path.join(MODEL_DIR, 'svc_meta.joblib'))
-    joblib.dump(scaler, os.path.join(MODEL_DIR, 'scaler.joblib'))
+    from model_factory import create_real_models as create
+    create()
 
 def create_dummy_models():
     """
     创建并保存虚拟模型，用于开发阶段。
     """
-    if not os.path.exists(DUMMY_MODEL_DIR):
-        os.makedirs(DUMMY_MODEL_DIR)
+    from model_factory import create_dummy_models as create
+    create()
+
+def _artifact_paths(use_dummy):
+    """返回指定模型集的目录及各模型文件的完整路径（目录中有模型包时只返回模型包）。"""
+    model_dir = DUMMY_MODEL_DIR if use_dummy else MODEL_DIR
+    bundle_path = os.path.join(model_dir, MODEL_BUNDLE_FILE)
+    if os.path.exists(bundle_path):
+        return model_dir, [bundle_path]
+    files = DUMMY_MODEL_FILES if use_dummy else REAL_MODEL_FILES
+    return model_dir, [os.path.join(model_dir, files[name]) for name in MODEL_ARTIFACTS]
+
+def _artifact_signature(paths):
+    """根据文件的修改时间和大小生成签名，文件被替换后签名随之改变。"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        signature.append((os.path.basename(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def _directory_artifact_paths(model_dir):
+    """返回任意模型目录中的模型文件路径：优先使用模型包，其次为每个组件的.joblib或.pkl文件。"""
+    bundle_path = os.path.join(model_dir, MODEL_BUNDLE_FILE)
+    if os.path.exists(bundle_path):
+        return [bundle_path]
+    paths = []
+    for name in MODEL_ARTIFACTS:
+        for extension in ('.joblib', '.pkl'):
+            path = os.path.join(model_dir, name + extension)
+            if os.path.exists(path):
+                paths.append(path)
+                break
+        else:
+            raise FileNotFoundError(f"Missing model artifact '{name}' in {model_dir}")
+    return paths
+
+def _content_fingerprint(paths):
+    """按文件内容计算模型集的SHA-256指纹，与文件所在目录和修改时间无关。"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode('utf-8'))
+        digest.update(os.path.getsize(path).to_bytes(8, 'little'))
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def _load_paths(paths):
+    """从模型文件（或单个模型包）反序列化模型和标准化器。"""
+    if len(paths) == 1 and paths[0].endswith('.npy'):
+        # 模型包以内存映射方式加载，不需要pickle和scikit-learn
+        from model_bundle import load_bundle
+        return load_bundle(paths[0])
     
-    # 创建并保存虚拟的GaussianNB模型
-    dummy_gnb = DummyModel(random_state=42)
-    with open(os.path.join(DUMMY_MODEL_DIR, 'gaussian_nb.pkl'), 'wb') as f:
-        pickle.dump(dummy_gnb, f)
+    artifacts = []
+    for path in paths:
+        if path.endswith('.pkl'):
+            with open(path, 'rb') as f:
+                artifacts.append(pickle.load(f))
+        else:
+            # joblib（及其反序列化时需要的scikit-learn）只在首次加载模型时导入
+            artifacts.append(timed_import("joblib").load(path))
+    return tuple(artifacts)
+
+# 内存中最多同时保留的模型版本数（正在使用的版本不计入淘汰）
+MAX_MODEL_VERSIONS = 4
+
+class ModelRegistry:
+    """
+    进程级模型注册表。
     
-    # 创建并保存虚拟的MultinomialNB模型
-    dummy_mnb = DummyModel(random_state=43)
-    with open(os.path.join(DUMMY_MODEL_DIR, 'multinomial_nb.pkl'), 'wb') as f:
-        pickle.dump(dummy_mnb, f)
+    每个模型集（虚拟模型和实际模型）在进程内只加载一次，并在所有Streamlit会话之间共享。
+    条目以模型目录和各文件的修改时间/大小为键，模型文件被替换后会自动重新加载。
     
-    # 创建并保存虚拟的BernoulliNB模型
-    dummy_bnb = DummyModel(random_state=44)
-    with open(os.path.join(DUMMY_MODEL_DIR, 'bernoulli_nb.pkl'), 'wb') as f:
-        pickle.dump(dummy_bnb, f)
+    每个加载的模型集在加载时按文件内容计算一次指纹（SHA-256）。注册表按指纹同时保留多个
+    版本，可用于A/B比较和按版本重新评分；内容未变的文件被重新写入时直接复用已加载的版本。
+    """
+    def __init__(self, max_versions=MAX_MODEL_VERSIONS):
+        self._lock = threading.Lock()
+        self._entries = {}  # 模型目录 -> (文件签名, 指纹, 模型元组)
+        self._versions = OrderedDict()  # 指纹 -> 版本信息（模型元组、来源、文件列表、加载时间）
+        self.max_versions = max_versions
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.load_times = {}  # 模型目录 -> 最近一次加载耗时（秒）
     
-    # 创建并保存虚拟的SVC模型
-    dummy_svc = DummyModel(random_state=45)
-    with open(os.path.join(DUMMY_MODEL_DIR, 'svc_meta.pkl'), 'wb') as f:
-        pickle.dump(dummy_svc, f)
+    def get(self, use_dummy=True):
+        """
+        获取模型集，必要时从磁盘加载。
+        
+        参数:
+            use_dummy (bool): 是否使用虚拟模型。
+        
+        返回:
+            tuple: (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta, scaler)
+        """
+        model_dir, paths = _artifact_paths(use_dummy)
+        signature = _artifact_signature(paths)
+        entry = self._entries.get(model_dir)
+        if entry is not None and signature is not None and entry[0] == signature:
+            self.hits += 1
+            return entry[2]
+        
+        with self._lock:
+            # 其他线程可能已经完成了加载
+            model_dir, paths = _artifact_paths(use_dummy)
+            signature = _artifact_signature(paths)
+            entry = self._entries.get(model_dir)
+            if entry is not None and signature is not None and entry[0] == signature:
+                self.hits += 1
+                return entry[2]
+            
+            # 检查模型文件是否存在，如果不存在则创建
+            if signature is None:
+                if use_dummy:
+                    create_dummy_models()
+                else:
+                    create_real_models()
+                model_dir, paths = _artifact_paths(use_dummy)
+                signature = _artifact_signature(paths)
+            
+            start = time.perf_counter()
+            with STARTUP_TIMER.phase(f"load models ({model_dir})"):
+                fingerprint, models = self._load_version(model_dir, paths)
+            self.load_times[model_dir] = time.perf_counter() - start
+            
+            self.misses += 1
+            if entry is not None:
+                self.reloads += 1
+                if entry[1] != fingerprint:
+                    # 模型内容发生变化，旧版本的缓存预测结果不再需要
+                    PREDICTION_CACHE.invalidate(entry[1])
+            self._entries[model_dir] = (signature, fingerprint, models)
+            self._evict_versions()
+            return models
+    
+    def _load_version(self, source, paths):
+        """按内容指纹加载模型集，已在内存中的版本直接复用（调用方需持有锁）"""
+        fingerprint = _content_fingerprint(paths)
+        version = self._versions.get(fingerprint)
+        if version is None:
+            version = {
+                'models': _load_paths(paths),
+                'source': source,
+                'artifacts': [(os.path.basename(path), os.path.getsize(path)) for path in paths],
+                'loaded_at': time.time(),
+            }
+            self._versions[fingerprint] = version
+        self._versions.move_to_end(fingerprint)
+        return fingerprint, version['models']
     
-    # 创建并保存虚拟的标准化器
-    dummy_scaler = StandardScaler()
-    # 假设每个连续特征的均值为0，标准差为1
-    dummy_scaler.mean_ = np.zeros(len(CONTINUOUS_FEATURES))
-    dummy_scaler.scale_ = np.ones(len(CONTINUOUS_FEATURES))
-    joblib.dump(dummy_scaler, os.path.join(DUMMY_MODEL_DIR, 'scaler.joblib'))
+    def _evict_versions(self):
+        """淘汰最久未使用的版本，正在作为当前模型使用的版本不会被淘汰（调用方需持有锁）"""
+        active = {entry[1] for entry in self._entries.values()}
+        for fingerprint in list(self._versions):
+            if len(self._versions) <= self.max_versions:
+                break
+            if fingerprint not in active:
+                del self._versions[fingerprint]
+    
+    def load_version(self, path):
+        """
+        加载任意模型目录或模型包文件中的模型集，并与当前模型一起保留在内存中。
+        
+        返回:
+            tuple: (fingerprint, models)
+        """
+        paths = [path] if os.path.isfile(path) else _directory_artifact_paths(path)
+        with self._lock:
+            fingerprint, models = self._load_version(path, paths)
+            self._evict_versions()
+        return fingerprint, models
+    
+    def get_version(self, fingerprint):
+        """按指纹获取内存中的模型集，不存在时返回None"""
+        version = self._versions.get(fingerprint)
+        return None if version is None else version['models']
+    
+    def find_fingerprint(self, models, scaler):
+        """查找模型对象对应的指纹，模型集不是由注册表加载的时返回None"""
+        for fingerprint, version in list(self._versions.items()):
+            loaded = version['models']
+            if loaded[4] is scaler and all(a is b for a, b in zip(loaded[:4], models[:4])):
+                return fingerprint
+        return None
+    
+    def describe(self, fingerprint):
+        """返回版本的来源、文件列表和加载时间，不存在时返回None"""
+        version = self._versions.get(fingerprint)
+        if version is None:
+            return None
+        return {key: value for key, value in version.items() if key != 'models'}
+    
+    def versions(self):
+        """列出内存中的所有版本"""
+        active = {entry[1] for entry in self._entries.values()}
+        return [
+            {'fingerprint': fingerprint, 'active': fingerprint in active, **self.describe(fingerprint)}
+            for fingerprint in list(self._versions)
+        ]
+    
+    def clear(self):
+        """清空注册表，下次访问时重新从磁盘加载。"""
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+    
+    def stats(self):
+        """返回注册表的命中/未命中计数和加载耗时。"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'loaded': sorted(self._entries),
+            'versions': len(self._versions),
+            'load_times': dict(self.load_times),
+        }
+
+# 全局模型注册表，所有会话共享
+MODEL_REGISTRY = ModelRegistry()
 
 def load_models(use_dummy=True):
     """
     加载模型和标准化器。
     
+    模型通过进程级注册表缓存，只有首次访问或模型文件发生变化时才会从磁盘反序列化。
+    基础层的推理计划在模型加载后立即编译，之后的预测直接复用。
+    
     参数:
         use_dummy (bool): 是否使用虚拟模型。默认为True。
     
     返回:
         tuple: (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta, scaler)
     """
-    if use_dummy:
-        # 检查是否存在虚拟模型，如果不存在则创建
-        if not os.path.exists(os.path.join(DUMMY_MODEL_DIR, 'gaussian_nb.pkl')):
-            create_dummy_models()
-        
-        # 加载虚拟模型
-        model_dir = DUMMY_MODEL_DIR
-        with open(os.path.join(model_dir, 'gaussian_nb.pkl'), 'rb') as f:
-            gaussian_nb = pickle.load(f)
-        with open(os.path.join(model_dir, 'multinomial_nb.pkl'), 'rb') as f:
-            multinomial_nb = pickle.load(f)
-        with open(os.path.join(model_dir, 'bernoulli_nb.pkl'), 'rb') as f:
-            bernoulli_nb = pickle.load(f)
-        with open(os.path.join(model_dir, 'svc_meta.pkl'), 'rb') as f:
-            svc_meta = pickle.load(f)
-        scaler = joblib.load(os.path.join(model_dir, 'scaler.joblib'))
-    else:
-        # 检查是否存在实际模型，如果不存在则创建
-        if not os.path.exists(os.path.join(MODEL_DIR, 'gaussian_nb.joblib')):
-            create_real_models()
-        
-        # 加载实际模型
-        model_dir = MODEL_DIR
-        gaussian_nb = joblib.load(os.path.join(model_dir, 'gaussian_nb.joblib'))
-        multinomial_nb = joblib.load(os.path.join(model_dir, 'multinomial_nb.joblib'))
-        bernoulli_nb = joblib.load(os.path.join(model_dir, 'bernoulli_nb.joblib'))
-        svc_meta = joblib.load(os.path.join(model_dir, 'svc_meta.joblib'))
-        scaler = joblib.load(os.path.join(model_dir, 'scaler.joblib'))
-    
-    return gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta, scaler
+    models = MODEL_REGISTRY.get(use_dummy)
+    get_inference_plan(models[:4], models[4])
+    return models
 
 def preprocess_data(data, scaler):
     """
@@ -212,7 +374,575 @@ def preprocess_data(data, scaler):
     
     return normalized_continuous, discrete_values, binary_values
 
-def make_prediction(data, models, scaler):
+def features_to_array(data):
+    """
+    将特征字典或特征表转换为按ALL_FEATURES排列的二维浮点数组。
+    
+    参数:
+        data: 单个患者的特征字典、包含ALL_FEATURES列的pandas DataFrame，
+              或形状为 [n_samples, 14] 的数组。
+    
+    返回:
+        np.ndarray: 形状为 [n_samples, 14] 的连续内存float64数组
+    """
+    if isinstance(data, dict):
+        data = [[data[feat] for feat in ALL_FEATURES]]
+    elif hasattr(data, 'columns'):
+        # pandas DataFrame，按特征名取列，允许存在额外的列（如患者ID）
+        missing = [feat for feat in ALL_FEATURES if feat not in data.columns]
+        if missing:
+            raise ValueError(f"Missing feature columns: {missing}")
+        data = data[ALL_FEATURES].to_numpy(dtype=np.float64)
+    
+    X = np.asarray(data, dtype=np.float64)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    if X.ndim != 2 or X.shape[1] != len(ALL_FEATURES):
+        raise ValueError(f"Expected an array of shape [n_samples, {len(ALL_FEATURES)}], got {X.shape}")
+    return np.ascontiguousarray(X)
+
+def _positive_class_index(model):
+    """返回FBTP类别在predict_proba输出中的列索引。"""
+    classes = getattr(model, 'classes_', None)
+    if classes is not None:
+        matches = np.flatnonzero(np.asarray(classes) == 'FBTP')
+        if matches.size:
+            return int(matches[0])
+    # 虚拟模型没有classes_属性，约定第二列为FBTP的概率
+    return 1
+
+def _labels_from_probability(svc_meta, meta_proba):
+    """根据元分类器的概率输出推导类别标签，避免再次调用predict。"""
+    classes = getattr(svc_meta, 'classes_', None)
+    if classes is not None:
+        return np.asarray(classes)[np.argmax(meta_proba, axis=1)]
+    fbtp_prob = meta_proba[:, _positive_class_index(svc_meta)]
+    return np.where(fbtp_prob >= 0.5, 'FBTP', 'NFBTP')
+
+def _sigmoid(x):
+    """数值稳定的sigmoid函数"""
+    return np.exp(-np.logaddexp(0.0, -x))
+
+def _class_indices(model):
+    """返回 (FBTP列索引, NFBTP列索引)"""
+    positive = _positive_class_index(model)
+    return positive, 1 - positive
+
+def supports_explanation(models):
+    """判断模型集是否为可解释的朴素贝叶斯+SVC堆叠模型（虚拟模型不支持）"""
+    gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta = models[:4]
+    return (
+        all(hasattr(gaussian_nb, attr) for attr in ('theta_', 'var_', 'class_prior_'))
+        and all(hasattr(model, 'feature_log_prob_') for model in (multinomial_nb, bernoulli_nb))
+        and all(len(getattr(model, 'classes_', ())) == 2 for model in models[:4])
+    )
+
+class NaiveBayesPlan:
+    """
+    朴素贝叶斯基础层的推理计划。
+    
+    在构造时一次性提取三个基础模型的拟合参数（theta_、var_、feature_log_prob_、类别先验）
+    和标准化器的mean_/scale_，将三个模型的FBTP对数几率整理为一个块对角系数矩阵。推理时对
+    连续内存的设计矩阵 [z^2, z, 离散特征, 二值化后的二元特征] 做一次矩阵乘法，得到全部三个
+    基础模型的输出，绕过scikit-learn每次调用的输入校验。
+    """
+    def __init__(self, models, scaler):
+        if not supports_explanation(models):
+            raise ValueError("An inference plan requires fitted GaussianNB/MultinomialNB/BernoulliNB and SVC models")
+        gaussian_nb, multinomial_nb, bernoulli_nb, _ = models[:4]
+        
+        # 标准化器参数：z = (x - mean) * inv_scale
+        n_continuous = len(CONTINUOUS_FEATURES)
+        mean = getattr(scaler, 'mean_', None)
+        scale = getattr(scaler, 'scale_', None)
+        self._mean = np.zeros(n_continuous) if mean is None else np.asarray(mean, dtype=np.float64)
+        self._inv_scale = np.ones(n_continuous) if scale is None else 1.0 / np.asarray(scale, dtype=np.float64)
+        
+        # 高斯朴素贝叶斯：对数似然比为标准化特征的二次函数 a*z^2 + b*z + c
+        pos, neg = _class_indices(gaussian_nb)
+        theta, var = gaussian_nb.theta_, gaussian_nb.var_
+        self.gaussian_a = -0.5 * (1.0 / var[pos] - 1.0 / var[neg])
+        self.gaussian_b = theta[pos] / var[pos] - theta[neg] / var[neg]
+        self.gaussian_c = (
+            -0.5 * np.log(var[pos] / var[neg])
+            - 0.5 * (theta[pos] ** 2 / var[pos] - theta[neg] ** 2 / var[neg])
+        )
+        gaussian_prior = np.log(gaussian_nb.class_prior_[pos]) - np.log(gaussian_nb.class_prior_[neg])
+        
+        # 多项式朴素贝叶斯：对数似然比为特征的线性函数
+        pos, neg = _class_indices(multinomial_nb)
+        self.multinomial_w = multinomial_nb.feature_log_prob_[pos] - multinomial_nb.feature_log_prob_[neg]
+        multinomial_prior = multinomial_nb.class_log_prior_[pos] - multinomial_nb.class_log_prior_[neg]
+        
+        # 伯努利朴素贝叶斯：特征二值化后为线性函数 w*b + c
+        pos, neg = _class_indices(bernoulli_nb)
+        log_p = bernoulli_nb.feature_log_prob_
+        log_not_p = np.log1p(-np.exp(log_p))
+        self.bernoulli_w = (log_p[pos] - log_not_p[pos]) - (log_p[neg] - log_not_p[neg])
+        self.bernoulli_c = log_not_p[pos] - log_not_p[neg]
+        self.binarize = bernoulli_nb.binarize
+        bernoulli_prior = bernoulli_nb.class_log_prior_[pos] - bernoulli_nb.class_log_prior_[neg]
+        
+        self.priors = np.array([gaussian_prior, multinomial_prior, bernoulli_prior])
+        
+        # 块对角系数矩阵，行对应设计矩阵的列 [z^2(8), z(8), 离散(3), 二元(3)]，列对应三个基础模型
+        n_discrete, n_binary = len(DISCRETE_FEATURES), len(BINARY_FEATURES)
+        self._weights = np.zeros((2 * n_continuous + n_discrete + n_binary, 3))
+        self._weights[:n_continuous, 0] = self.gaussian_a
+        self._weights[n_continuous:2 * n_continuous, 0] = self.gaussian_b
+        self._weights[2 * n_continuous:2 * n_continuous + n_discrete, 1] = self.multinomial_w
+        self._weights[2 * n_continuous + n_discrete:, 2] = self.bernoulli_w
+        self._bias = self.priors + np.array([self.gaussian_c.sum(), 0.0, self.bernoulli_c.sum()])
+    
+    def standardize(self, X):
+        """标准化连续特征块，shape=[n_samples, 8]"""
+        return (X[:, CONTINUOUS_SLICE] - self._mean) * self._inv_scale
+    
+    def binarize_features(self, X):
+        """按BernoulliNB的阈值二值化二元特征块，shape=[n_samples, 3]"""
+        binary = X[:, BINARY_SLICE]
+        if self.binarize is not None:
+            binary = (binary > self.binarize).astype(np.float64)
+        return binary
+    
+    def design_matrix(self, X):
+        """构造设计矩阵 [z^2, z, 离散特征, 二元特征]，shape=[n_samples, 22]"""
+        n_continuous = len(CONTINUOUS_FEATURES)
+        design = np.empty((len(X), self._weights.shape[0]))
+        z = self.standardize(X)
+        np.multiply(z, z, out=design[:, :n_continuous])
+        design[:, n_continuous:2 * n_continuous] = z
+        design[:, 2 * n_continuous:2 * n_continuous + len(DISCRETE_FEATURES)] = X[:, DISCRETE_SLICE]
+        design[:, 2 * n_continuous + len(DISCRETE_FEATURES):] = self.binarize_features(X)
+        return design
+    
+    def log_odds(self, X):
+        """三个基础模型的FBTP对数几率，shape=[n_samples, 3]"""
+        return self.design_matrix(X) @ self._weights + self._bias
+    
+    def base_probabilities(self, X):
+        """三个基础模型的FBTP概率，即元分类器的输入，shape=[n_samples, 3]"""
+        return _sigmoid(self.log_odds(X))
+    
+    def feature_terms(self, X):
+        """每个特征对其基础模型FBTP对数几率的贡献项（不含先验），shape=[n_samples, 14]"""
+        z = self.standardize(X)
+        return np.concatenate([
+            self.gaussian_a * z ** 2 + self.gaussian_b * z + self.gaussian_c,
+            X[:, DISCRETE_SLICE] * self.multinomial_w,
+            self.binarize_features(X) * self.bernoulli_w + self.bernoulli_c,
+        ], axis=1)
+
+# 推理计划与scikit-learn结果之间允许的最大概率误差
+PLAN_TOLERANCE = 1e-9
+
+def _probe_features(scaler, n_samples=64, seed=0):
+    """生成覆盖各特征取值范围的探测样本，用于校验推理计划"""
+    rng = np.random.default_rng(seed)
+    mean = getattr(scaler, 'mean_', None)
+    scale = getattr(scaler, 'scale_', None)
+    mean = np.zeros(len(CONTINUOUS_FEATURES)) if mean is None else mean
+    scale = np.ones(len(CONTINUOUS_FEATURES)) if scale is None else scale
+    return np.column_stack([
+        mean + scale * rng.uniform(-3.0, 3.0, (n_samples, len(CONTINUOUS_FEATURES))),
+        rng.integers(0, 6, (n_samples, len(DISCRETE_FEATURES))),
+        rng.integers(0, 2, (n_samples, len(BINARY_FEATURES))),
+    ])
+
+def _sklearn_base_probabilities(X, models, scaler):
+    """通过scikit-learn的predict_proba计算三个基础模型的FBTP概率"""
+    gaussian_nb, multinomial_nb, bernoulli_nb = models[:3]
+    return np.column_stack([
+        gaussian_nb.predict_proba(scaler.transform(X[:, CONTINUOUS_SLICE]))[:, _positive_class_index(gaussian_nb)],
+        multinomial_nb.predict_proba(X[:, DISCRETE_SLICE])[:, _positive_class_index(multinomial_nb)],
+        bernoulli_nb.predict_proba(X[:, BINARY_SLICE])[:, _positive_class_index(bernoulli_nb)],
+    ])
+
+def compile_inference_plan(models, scaler):
+    """
+    编译基础层推理计划，并在探测样本上与scikit-learn的输出进行校验。
+    
+    返回:
+        NaiveBayesPlan: 校验通过的推理计划；模型不受支持（如虚拟模型）或校验失败时返回None
+    """
+    if not supports_explanation(models):
+        return None
+    plan = NaiveBayesPlan(models, scaler)
+    probe = _probe_features(scaler)
+    error = np.max(np.abs(plan.base_probabilities(probe) - _sklearn_base_probabilities(probe, models, scaler)))
+    if not error <= PLAN_TOLERANCE:
+        logger.warning("Inference plan disagrees with scikit-learn (max error %.3g); using predict_proba", error)
+        return None
+    return plan
+
+class _ModelSetCache:
+    """以模型对象身份为键的小型缓存，用于按模型集缓存预计算结果"""
+    def __init__(self, factory, max_entries=8):
+        self._factory = factory
+        self._max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def get(self, models, scaler):
+        key = tuple(id(model) for model in models[:4]) + (id(scaler),)
+        entry = self._entries.get(key)
+        # 缓存中保留模型的强引用，对象身份一致才命中，避免id被复用
+        if entry is not None and entry[1] is scaler and all(a is b for a, b in zip(entry[0], models[:4])):
+            return entry[2]
+        value = self._factory(models, scaler)
+        with self._lock:
+            if len(self._entries) >= self._max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (tuple(models[:4]), scaler, value)
+        return value
+
+# 推理计划缓存：每个模型集只编译和校验一次
+_plans = _ModelSetCache(compile_inference_plan)
+
+def get_inference_plan(models, scaler):
+    """获取模型集对应的推理计划，不支持时返回None"""
+    return _plans.get(models, scaler)
+
+# 元分类器查找表的默认网格分辨率（每个维度的格点数）和允许的最大概率误差。
+# libsvm的二分类概率输出本身由迭代求解得到（收敛阈值0.0025），存在同量级的微小跳变，
+# 因此容差不宜低于该量级。
+META_SURFACE_RESOLUTION = 33
+META_SURFACE_TOLERANCE = 5e-3
+# 插值概率落在 0.5 ± META_SURFACE_BAND 内的行始终使用精确的SVC，保证类别标签一致
+META_SURFACE_BAND = 0.02
+
+class MetaLookupSurface:
+    """
+    元分类器的预计算查找表。
+    
+    svc_meta只有3个取值在[0,1]内的输入，因此可以在单位立方体的规则网格上预先计算一次
+    Platt缩放后的FBTP概率，预测时用三线性插值代替对所有支持向量的核函数求和。构造时在
+    网格单元中心和随机点上与精确的SVC比较，测得的最大误差保存在max_error中。插值结果
+    落在决策边界附近（0.5 ± band）的行仍由精确的SVC计算，只要max_error小于band，类别
+    标签就与精确模型一致。
+    """
+    def __init__(self, svc_meta, resolution=META_SURFACE_RESOLUTION, band=META_SURFACE_BAND,
+                 n_validation=20000, seed=0):
+        if resolution < 2:
+            raise ValueError("resolution must be at least 2")
+        self.svc_meta = svc_meta
+        self.resolution = resolution
+        self.band = band
+        self._positive = _positive_class_index(svc_meta)
+        
+        start = time.perf_counter()
+        axis = np.linspace(0.0, 1.0, resolution)
+        grid = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+        self._table = np.ascontiguousarray(svc_meta.predict_proba(grid)[:, self._positive])
+        
+        # 三线性插值的误差在网格单元中心附近最大，再加上随机点作为补充
+        centers = (axis[:-1] + axis[1:]) / 2.0
+        validation = np.concatenate([
+            np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1).reshape(-1, 3),
+            np.random.default_rng(seed).uniform(0.0, 1.0, (n_validation, 3)),
+        ])
+        interpolated = self.interpolate(validation)
+        served = np.abs(interpolated - 0.5) > band
+        exact = svc_meta.predict_proba(validation[served])[:, self._positive]
+        self.max_error = float(np.max(np.abs(interpolated[served] - exact), initial=0.0))
+        self.build_time = time.perf_counter() - start
+    
+    def interpolate(self, meta_input):
+        """对查找表进行三线性插值，返回FBTP概率, shape=[n_samples]"""
+        r = self.resolution
+        scaled = np.clip(meta_input, 0.0, 1.0) * (r - 1)
+        index = np.minimum(scaled.astype(np.intp), r - 2)
+        frac = scaled - index
+        base = (index[:, 0] * r + index[:, 1]) * r + index[:, 2]
+        
+        result = np.zeros(len(meta_input))
+        for corner in range(8):
+            bits = ((corner >> 2) & 1, (corner >> 1) & 1, corner & 1)
+            weight = np.ones(len(meta_input))
+            for dim, bit in enumerate(bits):
+                weight *= frac[:, dim] if bit else 1.0 - frac[:, dim]
+            offset = bits[0] * r * r + bits[1] * r + bits[2]
+            result += weight * self._table[base + offset]
+        return result
+    
+    def predict_proba(self, meta_input):
+        """
+        返回与svc_meta.predict_proba相同格式的概率矩阵。
+        
+        插值结果在决策边界附近（0.5 ± band）的行使用精确的SVC重新计算。
+        """
+        positive = self.interpolate(meta_input)
+        uncertain = np.abs(positive - 0.5) <= self.band
+        if uncertain.any():
+            positive[uncertain] = self.svc_meta.predict_proba(meta_input[uncertain])[:, self._positive]
+        proba = np.empty((len(meta_input), 2))
+        proba[:, self._positive] = positive
+        proba[:, 1 - self._positive] = 1.0 - positive
+        return proba
+
+def build_meta_surface(svc_meta, resolution=META_SURFACE_RESOLUTION, tolerance=META_SURFACE_TOLERANCE):
+    """
+    构建元分类器查找表并报告测得的误差界。
+    
+    返回:
+        MetaLookupSurface: 误差不超过tolerance的查找表；模型不是二分类模型（如虚拟模型）
+                           或误差超过tolerance时返回None，调用方应使用精确的SVC
+    """
+    if len(getattr(svc_meta, 'classes_', ())) != 2:
+        return None
+    surface = MetaLookupSurface(svc_meta, resolution)
+    if surface.max_error > min(tolerance, surface.band):
+        logger.warning(
+            "Meta-classifier lookup surface (resolution %d) max error %.3g exceeds %.3g; using the exact SVC",
+            resolution, surface.max_error, tolerance
+        )
+        return None
+    logger.info(
+        "Built meta-classifier lookup surface (resolution %d) in %.2fs, max error %.3g",
+        resolution, surface.build_time, surface.max_error
+    )
+    return surface
+
+def _build_meta_surface_for(models, scaler):
+    """_ModelSetCache的工厂函数：查找表只依赖svc_meta"""
+    return build_meta_surface(models[3])
+
+# 元分类器查找表缓存：每个模型集只构建一次
+_meta_surfaces = _ModelSetCache(_build_meta_surface_for)
+
+def get_meta_surface(models, scaler):
+    """获取模型集对应的元分类器查找表，不可用时返回None"""
+    return _meta_surfaces.get(models, scaler)
+
+def make_predictions_batch(frame, models, scaler, fast_meta=False):
+    """
+    对一批患者进行向量化预测。
+    
+    基础层优先使用预编译的推理计划（一次矩阵乘法得到三个朴素贝叶斯模型的输出）；
+    模型不支持时（如虚拟模型），连续、离散和二元特征块只切分一次，标准化器和每个基础模型
+    对所有行只调用一次。
+    
+    参数:
+        frame: 包含ALL_FEATURES列的pandas DataFrame，或形状为 [n_samples, 14] 的数组。
+        models (tuple): (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta)
+        scaler (StandardScaler): 用于标准化连续特征的标准化器。
+        fast_meta (bool): 是否使用预计算的元分类器查找表（适用于大批量重新评分），
+                          查找表不可用时自动使用精确的SVC。
+    
+    返回:
+        tuple: (predictions, probabilities)，分别为类别标签数组和FBTP概率数组, shape=[n_samples]
+    """
+    gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta = models
+    X = features_to_array(frame)
+    if len(X) == 0:
+        return np.array([], dtype=object), np.array([], dtype=np.float64)
+    
+    # 各个基础分类器输出的FBTP概率作为元分类器的输入
+    plan = get_inference_plan(models, scaler)
+    if plan is not None:
+        meta_input = plan.base_probabilities(X)
+    else:
+        meta_input = _sklearn_base_probabilities(X, models, scaler)
+    
+    # 元分类器只计算一次概率，类别标签由概率推导
+    surface = get_meta_surface(models, scaler) if fast_meta else None
+    if surface is not None:
+        meta_proba = surface.predict_proba(meta_input)
+    else:
+        meta_proba = svc_meta.predict_proba(meta_input)
+    predictions = _labels_from_probability(svc_meta, meta_proba)
+    probabilities = meta_proba[:, _positive_class_index(svc_meta)]
+    
+    return predictions, probabilities
+
+# 敏感性分析：连续特征的默认扫描范围为训练数据均值 ± SENSITIVITY_SPAN 倍标准差
+SENSITIVITY_POINTS = 200
+SENSITIVITY_SPAN = 3.0
+
+# 离散特征的默认扫描上限（与输入表单的取值范围一致），未列出的特征为DISCRETE_SWEEP_MAX
+DISCRETE_SWEEP_MAX = 10
+DISCRETE_FEATURE_MAX = {'Invasion score of Pelvis': 3}
+
+def sensitivity_range(feature, value, scaler, n_points=SENSITIVITY_POINTS):
+    """
+    返回特征的默认扫描网格（升序，包含患者的当前值）。
+    
+    连续特征在训练数据均值 ± 3倍标准差（下限为0）之间取n_points个等距点；
+    离散特征取0到上限之间的所有整数，n_points不起作用。
+    """
+    if feature in DISCRETE_FEATURES:
+        upper = max(DISCRETE_FEATURE_MAX.get(feature, DISCRETE_SWEEP_MAX), int(np.ceil(value)))
+        return np.arange(upper + 1, dtype=np.float64)
+    if feature not in CONTINUOUS_FEATURES:
+        raise ValueError(f"Only continuous and discrete features can be swept: {feature}")
+    
+    index = CONTINUOUS_FEATURES.index(feature)
+    mean = getattr(scaler, 'mean_', None)
+    scale = getattr(scaler, 'scale_', None)
+    center = float(mean[index]) if mean is not None else float(value)
+    spread = float(scale[index]) if scale is not None else max(abs(float(value)), 1.0)
+    low = max(0.0, min(center - SENSITIVITY_SPAN * spread, float(value)))
+    high = max(center + SENSITIVITY_SPAN * spread, float(value))
+    return np.linspace(low, high, max(int(n_points), 2))
+
+def sensitivity_sweep(data, models, scaler, grids, fast_meta=False):
+    """
+    以一个患者为基准扫描一个或两个特征，整个网格在一次向量化预测中完成。
+    
+    参数:
+        data (dict): 患者的特征字典。
+        models (tuple): (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta)
+        scaler (StandardScaler): 用于标准化连续特征的标准化器。
+        grids (dict): 特征名 -> 取值数组，一个或两个连续/离散特征（按插入顺序作为坐标轴）。
+        fast_meta (bool): 是否使用元分类器查找表加速。
+    
+    返回:
+        ndarray: FBTP概率，一个特征时shape=[n1]，两个特征时shape=[n1, n2]
+    """
+    features = list(grids)
+    if not 1 <= len(features) <= 2:
+        raise ValueError("A sensitivity sweep takes one or two features")
+    for feature in features:
+        if feature not in CONTINUOUS_FEATURES and feature not in DISCRETE_FEATURES:
+            raise ValueError(f"Only continuous and discrete features can be swept: {feature}")
+    
+    # 每个网格点是患者特征的一份副本，被扫描的列替换为网格坐标
+    axes = np.meshgrid(*[np.asarray(grids[feature], dtype=np.float64) for feature in features], indexing='ij')
+    X = np.repeat(features_to_array(data), axes[0].size, axis=0)
+    for feature, values in zip(features, axes):
+        X[:, ALL_FEATURES.index(feature)] = values.ravel()
+    
+    _, probabilities = make_predictions_batch(X, models, scaler, fast_meta=fast_meta)
+    return probabilities.reshape(axes[0].shape)
+
+# 不确定性分析：默认的测量噪声模型，特征名 -> (噪声类型, 标准差)
+# 'relative' 的标准差为测量值的比例，'absolute' 的标准差与特征单位相同
+DEFAULT_NOISE_MODEL = {
+    'Std. dev: g/mL_Choline_Bone+': ('relative', 0.10),
+    'Min: g/mL_Choline_Liver': ('relative', 0.10),
+    'Std. dev: g/mL_Choline_Bone-': ('relative', 0.10),
+    'Peak: g/mL_Choline_Kidney': ('relative', 0.10),
+    'Peak: g/mL_Choline_Bone-': ('relative', 0.10),
+    'Neutrophils (G/L)': ('relative', 0.05),
+    'Leukocytes (G/L)': ('relative', 0.05),
+    'Alkaline Phosphatase (ALP) levels': ('relative', 0.08),
+}
+NOISE_TYPES = ('relative', 'absolute')
+UNCERTAINTY_DRAWS = 2000
+UNCERTAINTY_INTERVAL = 0.95
+
+class NoiseDrawBuffer:
+    """
+    可复用的标准正态随机数缓冲区。
+    
+    随机数按需要的最大 (抽样数, 特征数) 只生成一次，之后每个患者复用同一组抽样：不必为每次分析
+    重新生成随机数，同一输入的结果可复现，不同患者之间的比较也不受抽样差异影响。
+    """
+    def __init__(self, seed=0):
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._draws = np.empty((0, 0))
+    
+    def get(self, n_draws, n_features):
+        """返回形状为 [n_draws, n_features] 的标准正态抽样（缓冲区的只读视图）"""
+        draws = self._draws
+        if draws.shape[0] < n_draws or draws.shape[1] < n_features:
+            with self._lock:
+                draws = self._draws
+                if draws.shape[0] < n_draws or draws.shape[1] < n_features:
+                    shape = (max(n_draws, draws.shape[0]), max(n_features, draws.shape[1]))
+                    draws = np.random.default_rng(self.seed).standard_normal(shape)
+                    draws.flags.writeable = False
+                    self._draws = draws
+        return draws[:n_draws, :n_features]
+
+# 进程级共享的抽样缓冲区
+NOISE_DRAWS = NoiseDrawBuffer()
+
+def prediction_uncertainty(data, models, scaler, noise_model=None, n_draws=UNCERTAINTY_DRAWS,
+                           interval=UNCERTAINTY_INTERVAL, fast_meta=False, draws=None):
+    """
+    蒙特卡洛估计测量噪声对预测的影响。
+    
+    按噪声模型对患者特征加入高斯噪声（结果截断为非负，离散特征取整），生成n_draws份扰动后的特征，
+    与原始特征一起在一次向量化预测中完成。
+    
+    参数:
+        data (dict): 患者的特征字典。
+        models (tuple): (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta)
+        scaler (StandardScaler): 用于标准化连续特征的标准化器。
+        noise_model (dict): 特征名 -> (噪声类型, 标准差)，噪声类型为 'relative' 或 'absolute'，
+                            默认为DEFAULT_NOISE_MODEL。二元特征不能加入噪声。
+        n_draws (int): 抽样次数。
+        interval (float): 概率区间的置信水平。
+        fast_meta (bool): 是否使用元分类器查找表加速。
+        draws (NoiseDrawBuffer): 随机数缓冲区，默认为NOISE_DRAWS。
+    
+    返回:
+        dict: prediction/probability（原始特征的预测）、mean/std/lower/upper（抽样概率的统计量和区间）、
+              flip_rate（预测类别与原始预测不同的抽样比例）、interval、n_draws和probabilities（每次抽样的概率）
+    """
+    noise_model = DEFAULT_NOISE_MODEL if noise_model is None else noise_model
+    n_draws = max(int(n_draws), 1)
+    columns, sds = [], []
+    base = features_to_array(data)
+    for feature, (kind, sd) in noise_model.items():
+        if feature not in CONTINUOUS_FEATURES and feature not in DISCRETE_FEATURES:
+            raise ValueError(f"Noise can only be added to continuous and discrete features: {feature}")
+        if kind not in NOISE_TYPES:
+            raise ValueError(f"Unknown noise type for {feature}: {kind!r} (expected one of {NOISE_TYPES})")
+        if sd < 0:
+            raise ValueError(f"Noise standard deviation must be non-negative: {feature}")
+        column = ALL_FEATURES.index(feature)
+        columns.append(column)
+        sds.append(sd * abs(base[0, column]) if kind == 'relative' else sd)
+    
+    # 第一行为原始特征，其余为扰动后的副本
+    X = np.repeat(base, n_draws + 1, axis=0)
+    if columns:
+        noise = (draws or NOISE_DRAWS).get(n_draws, len(columns)) * np.asarray(sds)
+        perturbed = np.maximum(X[1:, columns] + noise, 0.0)
+        discrete = [i for i, column in enumerate(columns) if ALL_FEATURES[column] in DISCRETE_FEATURES]
+        perturbed[:, discrete] = np.round(perturbed[:, discrete])
+        X[1:, columns] = perturbed
+    
+    predictions, probabilities = make_predictions_batch(X, models, scaler, fast_meta=fast_meta)
+    samples = probabilities[1:]
+    tail = (1.0 - interval) / 2
+    lower, upper = np.quantile(samples, [tail, 1.0 - tail])
+    return {
+        'prediction': predictions[0],
+        'probability': float(probabilities[0]),
+        'mean': float(samples.mean()),
+        'std': float(samples.std()),
+        'lower': float(lower),
+        'upper': float(upper),
+        'interval': interval,
+        'flip_rate': float(np.mean(predictions[1:] != predictions[0])),
+        'n_draws': n_draws,
+        'probabilities': samples,
+    }
+
+# 预测监听器，make_prediction得到主结果后依次调用（如影子评分），监听器只能做入队之类的常数时间操作
+_prediction_listeners = []
+
+def add_prediction_listener(listener):
+    """
+    注册预测监听器。
+    
+    监听器以 listener(X, models, scaler, prediction, probability, seconds, prediction_uid) 的形式调用，
+    X为形状 [1, 14] 的特征数组，seconds为主模型预测（含缓存查找）的耗时，prediction_uid为调用方传给
+    make_prediction的预测记录标识（可能为None）。监听器抛出的异常只记录日志，不影响主结果。
+    """
+    if listener not in _prediction_listeners:
+        _prediction_listeners.append(listener)
+
+def remove_prediction_listener(listener):
+    """移除预测监听器"""
+    if listener in _prediction_listeners:
+        _prediction_listeners.remove(listener)
+
+def make_prediction(data, models, scaler, prediction_uid=None):
     """
     使用模型进行预测。
     
@@ -220,25 +950,307 @@ def make_prediction(data, models, scaler):
         data (dict): 包含所有特征的字典。
         models (tuple): (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta)
         scaler (StandardScaler): 用于标准化连续特征的标准化器。
+        prediction_uid (str): 预测记录的标识，原样传给预测监听器，用于关联影子评分结果。
     
     返回:
         tuple: (prediction, probability)
     """
-    gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta = models
+    X = features_to_array(data)
+    start = time.perf_counter()
+    # 相同的特征和模型集直接返回缓存的结果
+    predictions, probabilities = make_predictions_cached(X, models, scaler)
+    prediction, probability = predictions[0], float(probabilities[0])
+    if _prediction_listeners:
+        elapsed = time.perf_counter() - start
+        for listener in list(_prediction_listeners):
+            try:
+                listener(X, models, scaler, prediction, probability, elapsed, prediction_uid)
+            except Exception:
+                logger.exception("Prediction listener %r failed", listener)
+    return prediction, probability
+
+def _object_fingerprint(models, scaler):
+    """_ModelSetCache的工厂函数：对不是由注册表加载的模型集，按序列化后的内容计算指纹"""
+    return hashlib.sha256(pickle.dumps((tuple(models[:4]), scaler))).hexdigest()
+
+_object_fingerprints = _ModelSetCache(_object_fingerprint)
+
+def model_fingerprint(models, scaler):
+    """
+    返回模型集的内容指纹（SHA-256十六进制字符串）。
+    
+    注册表加载的模型集使用加载时按文件内容计算的指纹；其他模型集按序列化后的内容计算一次并缓存。
+    """
+    fingerprint = MODEL_REGISTRY.find_fingerprint(models, scaler)
+    if fingerprint is None:
+        fingerprint = _object_fingerprints.get(models, scaler)
+    return fingerprint
+
+# 预测缓存的默认容量和有效期（秒）
+PREDICTION_CACHE_SIZE = 10000
+PREDICTION_CACHE_TTL = 3600
+
+# 超过该行数的批次（队列文件、命令行评分）直接调用make_predictions_batch，不读写进程级缓存：
+# 批量数据的重复率通常很低，逐行计算缓存键比直接预测更慢，还会挤掉交互式预测的缓存条目
+PREDICTION_CACHE_BULK_ROWS = 1024
+
+class PredictionCache:
+    """
+    进程级预测结果缓存（LRU + TTL），所有会话共享。
     
-    # 预处理数据
-    normalized_continuous, discrete_values, binary_values = preprocess_data(data, scaler)
+    键为 (模型集内容指纹, fast_meta, 规范化后的14个特征值的字节表示)。特征值统一转换为
+    float64（-0.0转换为0.0），因此整数和浮点数形式的相同输入命中同一条目。
+    """
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # 键 -> (过期时间, 预测类别, FBTP概率)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
     
-    # 使用各个基础分类器进行预测
-    prob_gaussian = gaussian_nb.predict_proba([normalized_continuous])[0][1]  # FBTP的概率
-    prob_multinomial = multinomial_nb.predict_proba([discrete_values])[0][1]  # FBTP的概率
-    prob_bernoulli = bernoulli_nb.predict_proba([binary_values])[0][1]  # FBTP的概率
+    @staticmethod
+    def row_keys(X):
+        """将特征矩阵的每一行转换为规范化的字节键"""
+        canonical = np.ascontiguousarray(X, dtype=np.float64) + 0.0
+        return [row.tobytes() for row in canonical]
     
-    # 将基础分类器的预测概率作为元分类器的输入
-    meta_input = np.array([[prob_gaussian, prob_multinomial, prob_bernoulli]])
+    def get_many(self, prefix, row_keys):
+        """
+        批量查询缓存。
+        
+        返回:
+            list: 与row_keys对应的 (prediction, probability)，未命中或已过期为None
+        """
+        now = time.monotonic()
+        results = []
+        with self._lock:
+            for row_key in row_keys:
+                key = prefix + (row_key,)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] < now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    results.append(entry[1:])
+        return results
+    
+    def put_many(self, prefix, row_keys, predictions, probabilities):
+        """批量写入缓存，超出容量时淘汰最久未使用的条目"""
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for row_key, prediction, probability in zip(row_keys, predictions, probabilities):
+                key = prefix + (row_key,)
+                self._entries[key] = (expires_at, prediction, float(probability))
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, fingerprint):
+        """删除指定模型集的所有缓存条目"""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == fingerprint]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+    
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """返回缓存的条目数、命中/未命中次数和命中率"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+# 全局预测缓存，所有会话共享
+PREDICTION_CACHE = PredictionCache()
+
+def make_predictions_cached(frame, models, scaler, fast_meta=False, cache=None):
+    """
+    带缓存的批量预测。
     
-    # 使用元分类器进行最终预测
-    final_pred = svc_meta.predict(meta_input)[0]
-    final_prob = svc_meta.predict_proba(meta_input)[0][1]  # FBTP的概率
+    批次内重复的行只计算一次，已缓存的行直接返回，只有未命中的行调用make_predictions_batch。
+    超过PREDICTION_CACHE_BULK_ROWS行的批次不去重也不使用缓存，直接调用make_predictions_batch。
+    参数与make_predictions_batch相同，cache默认为全局的PREDICTION_CACHE。
     
-    return final_pred, final_prob 
+    返回:
+        tuple: (predictions, probabilities)，分别为类别标签数组和FBTP概率数组, shape=[n_samples]
+    """
+    cache = PREDICTION_CACHE if cache is None else cache
+    X = features_to_array(frame)
+    if len(X) == 0:
+        return np.array([], dtype=object), np.array([], dtype=np.float64)
+    
+    if len(X) > PREDICTION_CACHE_BULK_ROWS:
+        return make_predictions_batch(X, models, scaler, fast_meta=fast_meta)
+    
+    # 批次内去重：inverse将每一行映射到其唯一行
+    row_keys = cache.row_keys(X)
+    unique_index = {}
+    first_rows = []
+    inverse = np.empty(len(X), dtype=np.intp)
+    for i, row_key in enumerate(row_keys):
+        index = unique_index.get(row_key)
+        if index is None:
+            index = unique_index[row_key] = len(first_rows)
+            first_rows.append(i)
+        inverse[i] = index
+    unique_keys = list(unique_index)
+    first_rows = np.asarray(first_rows, dtype=np.intp)
+    
+    prefix = (model_fingerprint(models, scaler), bool(fast_meta))
+    cached = cache.get_many(prefix, unique_keys)
+    missing = [i for i, result in enumerate(cached) if result is None]
+    
+    unique_predictions = np.empty(len(unique_keys), dtype=object)
+    unique_probabilities = np.empty(len(unique_keys))
+    for i, result in enumerate(cached):
+        if result is not None:
+            unique_predictions[i], unique_probabilities[i] = result
+    
+    if missing:
+        predictions, probabilities = make_predictions_batch(X[first_rows[missing]], models, scaler, fast_meta=fast_meta)
+        unique_predictions[missing] = predictions
+        unique_probabilities[missing] = probabilities
+        cache.put_many(prefix, [unique_keys[i] for i in missing], predictions, probabilities)
+    
+    return unique_predictions[inverse].astype(str), unique_probabilities[inverse]
+
+class StackedExplainer:
+    """
+    堆叠模型的特征贡献解释器。
+    
+    朴素贝叶斯模型的对数几率可以精确分解为各特征的对数似然比之和，因此每个特征对基础模型
+    的贡献是精确的。元分类器只有3个输入，对其计算精确的Shapley值（8种组合），再按对数几率
+    的比例分配给对应特征块中的各个特征。背景（参考点）为训练数据分布下各特征项的期望值，
+    在构造时计算一次。所有特征贡献之和等于预测概率减去base_value。
+    """
+    def __init__(self, models, scaler):
+        if not supports_explanation(models):
+            raise ValueError("Feature contributions require fitted GaussianNB/MultinomialNB/BernoulliNB and SVC models")
+        self.models = tuple(models[:4])
+        self.scaler = scaler
+        self.plan = get_inference_plan(models, scaler) or NaiveBayesPlan(models, scaler)
+        gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta = self.models
+        plan = self.plan
+        
+        # 背景统计：训练数据分布（按类别先验混合）下每个特征项的期望值
+        theta, var = gaussian_nb.theta_, gaussian_nb.var_
+        weights = gaussian_nb.class_prior_[:, None]
+        z_mean = (weights * theta).sum(axis=0)
+        z_second_moment = (weights * (var + theta ** 2)).sum(axis=0)
+        gaussian_ref = plan.gaussian_a * z_second_moment + plan.gaussian_b * z_mean + plan.gaussian_c
+        
+        discrete_mean = multinomial_nb.feature_count_.sum(axis=0) / multinomial_nb.class_count_.sum()
+        multinomial_ref = plan.multinomial_w * discrete_mean
+        
+        binary_mean = bernoulli_nb.feature_count_.sum(axis=0) / bernoulli_nb.class_count_.sum()
+        bernoulli_ref = plan.bernoulli_w * binary_mean + plan.bernoulli_c
+        
+        self.reference_terms = np.concatenate([gaussian_ref, multinomial_ref, bernoulli_ref])
+        self.reference_log_odds = plan.priors + self._block_sums(self.reference_terms[None, :])[0]
+        self.reference_probabilities = _sigmoid(self.reference_log_odds)
+        
+        # 元分类器的3个输入组成的8种组合（1表示使用真实值，0表示使用参考值）
+        self._coalitions = np.array([[(mask >> k) & 1 for k in range(3)] for mask in range(8)], dtype=bool)
+        self._meta_positive = _positive_class_index(svc_meta)
+        self.base_value = float(svc_meta.predict_proba(self.reference_probabilities[None, :])[0, self._meta_positive])
+    
+    @staticmethod
+    def _block_sums(terms):
+        """按连续/离散/二元特征块对特征项求和，返回 [n_samples, 3]"""
+        return np.column_stack([
+            terms[:, CONTINUOUS_SLICE].sum(axis=1),
+            terms[:, DISCRETE_SLICE].sum(axis=1),
+            terms[:, BINARY_SLICE].sum(axis=1),
+        ])
+    
+    def feature_terms(self, X):
+        """计算每个特征对其基础模型FBTP对数几率的贡献项，shape=[n_samples, 14]"""
+        return self.plan.feature_terms(X)
+    
+    def explain(self, frame):
+        """
+        计算一批患者的特征贡献。
+        
+        参数:
+            frame: 包含ALL_FEATURES列的pandas DataFrame，或形状为 [n_samples, 14] 的数组。
+        
+        返回:
+            tuple: (contributions, probabilities)
+                contributions: 每个特征对FBTP概率的贡献, shape=[n_samples, 14]
+                probabilities: 模型预测的FBTP概率, shape=[n_samples]
+        """
+        X = features_to_array(frame)
+        n = len(X)
+        
+        # 每个特征相对于背景的对数几率变化，基础模型的对数几率是这些变化的精确加和
+        deltas = self.feature_terms(X) - self.reference_terms
+        block_deltas = self._block_sums(deltas)
+        base_probabilities = _sigmoid(self.reference_log_odds + block_deltas)
+        
+        # 一次性对 8*n 种组合调用元分类器
+        meta_input = np.where(self._coalitions[:, None, :], base_probabilities[None, :, :], self.reference_probabilities)
+        values = self.models[3].predict_proba(meta_input.reshape(-1, 3))[:, self._meta_positive].reshape(8, n)
+        
+        # 3个输入的精确Shapley值：不含k的子集S，权重为 |S|!(2-|S|)!/3!
+        shapley = np.zeros((n, 3))
+        for k in range(3):
+            for mask in range(8):
+                if mask & (1 << k):
+                    continue
+                size = bin(mask).count('1')
+                weight = (1.0 / 3.0) if size in (0, 2) else (1.0 / 6.0)
+                shapley[:, k] += weight * (values[mask | (1 << k)] - values[mask])
+        
+        # 按特征的对数几率变化在块内分配Shapley值
+        contributions = np.zeros_like(deltas)
+        for k, block in enumerate((CONTINUOUS_SLICE, DISCRETE_SLICE, BINARY_SLICE)):
+            total = block_deltas[:, k:k + 1]
+            safe_total = np.where(np.abs(total) > 1e-12, total, 1.0)
+            contributions[:, block] = np.where(np.abs(total) > 1e-12, shapley[:, k:k + 1] * deltas[:, block] / safe_total, 0.0)
+        
+        return contributions, values[7]
+
+# 解释器缓存：背景统计对每个模型集只计算一次
+_explainers = _ModelSetCache(StackedExplainer)
+
+def get_explainer(models, scaler):
+    """获取（或创建并缓存）模型集对应的StackedExplainer"""
+    return _explainers.get(models, scaler)
+
+def explain_predictions(frame, models, scaler):
+    """
+    计算每个患者各特征对FBTP预测概率的贡献。
+    
+    参数:
+        frame: 包含ALL_FEATURES列的pandas DataFrame，或形状为 [n_samples, 14] 的数组。
+        models (tuple): (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta)
+        scaler (StandardScaler): 用于标准化连续特征的标准化器。
+    
+    返回:
+        tuple: (contributions, base_value)，contributions的shape为 [n_samples, 14]，
+               每行之和加上base_value等于该患者的FBTP预测概率
+    """
+    explainer = get_explainer(models, scaler)
+    contributions, _ = explainer.explain(frame)
+    return contributions, explainer.base_value
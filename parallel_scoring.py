@@ -0,0 +1,148 @@
+"""
+多进程并行评分：将特征矩阵分块后在进程池中预测，适用于数百万行的模拟队列。
+
+输入特征矩阵和输出结果都放在multiprocessing.shared_memory中，任务只传递行范围；
+模型在每个工作进程初始化时只传输一次，结果按输入顺序写回。
+
+用法示例:
+    from parallel_scoring import score_matrix_parallel
+    predictions, probabilities = score_matrix_parallel(X, use_dummy=False, workers=8)
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory, util
+
+import numpy as np
+
+from model_utils import ALL_FEATURES, features_to_array, load_models, make_predictions_batch
+
+# 每个任务的默认行数
+DEFAULT_CHUNK_SIZE = 50000
+
+# 工作进程状态：模型和共享内存数组，每个进程只初始化一次
+_worker_state = None
+
+def _attach(name, shape, dtype):
+    """
+    连接到已存在的共享内存块，返回 (SharedMemory, ndarray)
+    
+    共享内存块由父进程创建和unlink，工作进程连接时不在resource_tracker中登记。
+    Python 3.13之前连接时总会登记，工作进程退出时可能误报泄漏并重复unlink；
+    登记后再取消会删除父进程在共享的resource_tracker中的登记，因此在连接期间跳过登记。
+    """
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def _release_worker():
+    """工作进程退出时释放共享内存数组并关闭句柄"""
+    global _worker_state
+    state, _worker_state = _worker_state, None
+    if state is None:
+        return
+    blocks = [shm for shm, _ in state.pop('handles')]
+    # 先释放指向共享内存的数组，否则close()会因缓冲区仍被引用而失败
+    state.clear()
+    for shm in blocks:
+        shm.close()
+
+def _init_worker(models, scaler, names, n_rows, fast_meta):
+    """工作进程初始化：接收一次模型并连接共享内存中的输入和输出数组"""
+    global _worker_state
+    handles = [
+        _attach(names[0], (n_rows, len(ALL_FEATURES)), np.float64),
+        _attach(names[1], (n_rows,), np.float64),
+        _attach(names[2], (n_rows,), np.int8),
+    ]
+    _worker_state = {
+        'models': models,
+        'scaler': scaler,
+        'fast_meta': fast_meta,
+        'handles': handles,
+    }
+    # 工作进程退出时由multiprocessing执行（子进程不会执行atexit注册的函数）
+    util.Finalize(None, _release_worker, exitpriority=10)
+
+def _score_range(start, stop):
+    """在工作进程中预测 [start, stop) 行，结果直接写入共享内存"""
+    state = _worker_state
+    (_, X), (_, probabilities), (_, is_fbtp) = state['handles']
+    predictions, probabilities[start:stop] = make_predictions_batch(
+        X[start:stop], state['models'], state['scaler'], fast_meta=state['fast_meta']
+    )
+    is_fbtp[start:stop] = predictions == 'FBTP'
+    return stop - start
+
+def _create_shared(array, blocks):
+    """创建与array大小相同的共享内存块并复制数据，共享内存块追加到blocks中以便释放"""
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(shm)
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return view
+
+def score_matrix_parallel(frame, models=None, scaler=None, use_dummy=False, workers=None,
+                          chunk_size=DEFAULT_CHUNK_SIZE, fast_meta=False):
+    """
+    在多个进程中对特征矩阵进行预测，结果顺序与输入一致。
+    
+    参数:
+        frame: 包含ALL_FEATURES列的pandas DataFrame，或形状为 [n_samples, 14] 的数组。
+        models (tuple): (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta)，为None时按use_dummy加载。
+        scaler (StandardScaler): 用于标准化连续特征的标准化器，为None时按use_dummy加载。
+        use_dummy (bool): 未提供模型时是否加载虚拟模型。
+        workers (int): 工作进程数，默认为CPU核数。
+        chunk_size (int): 每个任务的行数。
+        fast_meta (bool): 是否使用元分类器查找表加速。
+    
+    返回:
+        tuple: (predictions, probabilities)，分别为类别标签数组和FBTP概率数组, shape=[n_samples]
+    """
+    if models is None or scaler is None:
+        loaded = load_models(use_dummy=use_dummy)
+        models, scaler = loaded[:4], loaded[4]
+    models = tuple(models[:4])
+    X = features_to_array(frame)
+    n_rows = len(X)
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(int(chunk_size), 1)
+    
+    # 数据量小或只有一个进程时直接在当前进程中预测
+    if workers <= 1 or n_rows <= chunk_size:
+        return make_predictions_batch(X, models, scaler, fast_meta=fast_meta)
+    
+    blocks = []
+    views = []
+    try:
+        views.append(_create_shared(X, blocks))
+        views.append(_create_shared(np.full(n_rows, np.nan), blocks))
+        views.append(_create_shared(np.zeros(n_rows, dtype=np.int8), blocks))
+        names = [shm.name for shm in blocks]
+        
+        ranges = [(start, min(start + chunk_size, n_rows)) for start in range(0, n_rows, chunk_size)]
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(ranges)),
+            initializer=_init_worker,
+            initargs=(models, scaler, names, n_rows, fast_meta)
+        ) as executor:
+            futures = [executor.submit(_score_range, start, stop) for start, stop in ranges]
+            for future in futures:
+                future.result()
+        
+        probabilities = views[1].copy()
+        predictions = np.where(views[2].astype(bool), 'FBTP', 'NFBTP')
+        return predictions, probabilities
+    finally:
+        # 释放指向共享内存的数组后才能关闭共享内存块
+        views.clear()
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,185 @@
+"""
+命令行批量预测工具，只依赖model_utils，不需要启动Streamlit界面。
+
+用法示例:
+    python -m score_cli cohort.csv -o predictions.csv
+    cat cohort.jsonl | python -m score_cli - --format jsonl --workers 4
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from model_utils import ALL_FEATURES, load_models, make_predictions_cached
+
+# 输出字段（患者ID列名由参数决定）
+OUTPUT_FIELDS = ['prediction', 'probability', 'error']
+
+# 工作进程中加载的模型，每个进程只加载一次
+_worker_models = None
+
+def read_rows(stream, file_format):
+    """从文本流中逐行读取记录，返回字典生成器"""
+    if file_format == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(stream)
+
+def iter_chunks(rows, chunk_size):
+    """将记录流切分为固定大小的块"""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def score_rows(rows, models, scaler, id_column='patient_id', start_index=0, fast_meta=False):
+    """
+    对一组记录进行预测。
+
+    参数:
+        rows (list): 每个元素为包含ALL_FEATURES键的字典。
+        models (tuple): (gaussian_nb, multinomial_nb, bernoulli_nb, svc_meta)
+        scaler (StandardScaler): 用于标准化连续特征的标准化器。
+        id_column (str): 患者ID字段名，缺失时使用行号。
+        start_index (int): 该块第一行在输入中的行号。
+        fast_meta (bool): 是否使用元分类器查找表加速。
+
+    返回:
+        list: 每行的预测结果字典
+    """
+    X = np.full((len(rows), len(ALL_FEATURES)), np.nan)
+    errors = [''] * len(rows)
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[i] = 'row is not a JSON object'
+            continue
+        try:
+            X[i] = [float(row[feat]) for feat in ALL_FEATURES]
+        except KeyError as exc:
+            errors[i] = f"missing feature: {exc.args[0]}"
+        except (TypeError, ValueError):
+            errors[i] = 'invalid feature values'
+    valid = np.isfinite(X).all(axis=1)
+    for i in np.flatnonzero(~valid):
+        errors[i] = errors[i] or 'invalid feature values'
+
+    predictions = np.full(len(rows), '', dtype=object)
+    probabilities = np.full(len(rows), np.nan)
+    if valid.any():
+        predictions[valid], probabilities[valid] = make_predictions_cached(X[valid], models, scaler, fast_meta=fast_meta)
+
+    return [
+        {
+            id_column: row.get(id_column, start_index + i) if isinstance(row, dict) else start_index + i,
+            'prediction': predictions[i],
+            'probability': None if np.isnan(probabilities[i]) else float(probabilities[i]),
+            'error': errors[i]
+        }
+        for i, row in enumerate(rows)
+    ]
+
+def _init_worker(use_dummy):
+    """工作进程初始化：加载一次模型"""
+    global _worker_models
+    _worker_models = load_models(use_dummy=use_dummy)
+
+def _score_in_worker(rows, id_column, start_index, fast_meta):
+    """在工作进程中对一个数据块进行预测"""
+    return score_rows(rows, _worker_models[:4], _worker_models[4], id_column, start_index, fast_meta)
+
+def score_stream(rows, use_dummy=False, chunk_size=1000, workers=1, id_column='patient_id', fast_meta=False):
+    """
+    按块对记录流进行预测，按输入顺序逐块返回结果。
+
+    workers大于1时使用进程池，同时在途的数据块数量有上限，内存占用不随输入大小增长。
+    """
+    chunks = iter_chunks(rows, chunk_size)
+    if workers <= 1:
+        models = load_models(use_dummy=use_dummy)
+        start_index = 0
+        for chunk in chunks:
+            yield score_rows(chunk, models[:4], models[4], id_column, start_index, fast_meta)
+            start_index += len(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(use_dummy,)) as executor:
+        pending = deque()
+        start_index = 0
+        for chunk in chunks:
+            pending.append(executor.submit(_score_in_worker, chunk, id_column, start_index, fast_meta))
+            start_index += len(chunk)
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _guess_format(path, default='csv'):
+    """根据文件扩展名判断格式"""
+    if path and path != '-':
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.jsonl', '.ndjson'):
+            return 'jsonl'
+        if extension == '.csv':
+            return 'csv'
+    return default
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score patients with the stacked NB+SVC model without the Streamlit UI.")
+    parser.add_argument('input', nargs='?', default='-', help="Input CSV/JSONL file, or '-' for stdin (default)")
+    parser.add_argument('-o', '--output', default='-', help="Output file, or '-' for stdout (default)")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help="Input format (guessed from the file extension by default)")
+    parser.add_argument('--output-format', choices=['csv', 'jsonl'], help="Output format (defaults to the input format)")
+    parser.add_argument('--model', choices=['real', 'dummy'], default='real', help="Model set to use (default: real)")
+    parser.add_argument('--id-column', default='patient_id', help="Patient ID field (default: patient_id)")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="Rows per scoring chunk (default: 1000)")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes (default: 1)")
+    parser.add_argument('--fast-meta', action='store_true',
+                        help="Serve the SVC meta-classifier from a precomputed lookup surface (falls back to the exact SVC if its error bound is too large)")
+    args = parser.parse_args(argv)
+
+    input_format = args.format or _guess_format(args.input)
+    output_format = args.output_format or _guess_format(args.output, input_format)
+
+    input_stream = sys.stdin if args.input == '-' else open(args.input, newline='', encoding='utf-8')
+    output_stream = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    try:
+        writer = None
+        if output_format == 'csv':
+            writer = csv.DictWriter(output_stream, fieldnames=[args.id_column] + OUTPUT_FIELDS)
+            writer.writeheader()
+
+        results = score_stream(
+            read_rows(input_stream, input_format),
+            use_dummy=(args.model == 'dummy'),
+            chunk_size=max(args.chunk_size, 1),
+            workers=args.workers,
+            id_column=args.id_column,
+            fast_meta=args.fast_meta
+        )
+        for chunk_results in results:
+            if writer is not None:
+                writer.writerows(chunk_results)
+            else:
+                output_stream.writelines(json.dumps(result) + '\n' for result in chunk_results)
+            output_stream.flush()
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output_stream is not sys.stdout:
+            output_stream.close()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,422 @@
+"""
+本地HTTP/JSON评分服务，只依赖model_utils，不需要启动Streamlit。
+
+并发到达的单条请求由MicroBatcher合并为一个批次，一次向量化地通过朴素贝叶斯基础层和svc_meta。
+批次线程在处理上一批时到达的请求自然合并为下一批；有其他请求正在解析时最多再等待max_wait，
+单独到达的请求不增加等待时间。每个响应带有排队、推理和总耗时的头部（X-Queue-Time-Ms、
+X-Inference-Time-Ms、X-Total-Time-Ms、Server-Timing）以及合并后的批次行数（X-Batch-Size）。
+
+接口:
+    POST /predict   单条: {"<特征名>": 值, ...}
+                    批量: {"instances": [{...}, ...]} 或 [{...}, ...]
+    GET  /health    模型指纹和服务状态
+    GET  /stats     批处理统计和延迟分位数
+
+用法示例:
+    python -m scoring_service --port 8765
+    curl -s localhost:8765/predict -d @patient.json
+"""
+import argparse
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from model_utils import ALL_FEATURES, load_models, make_predictions_cached, model_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 服务默认参数
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 2.0
+
+# 监听套接字的连接队列长度（socketserver默认只有5，突发的并发连接会被重置）
+DEFAULT_BACKLOG = 128
+
+# 请求体大小上限（字节）
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# 统计延迟分位数时保留的最近请求数
+LATENCY_WINDOW = 2048
+
+# 批量请求中可选的患者ID字段，原样返回
+ID_FIELD = 'patient_id'
+
+class PayloadError(ValueError):
+    """请求内容无法解析为特征"""
+
+def parse_instance(instance):
+    """
+    将一条特征记录转换为按ALL_FEATURES排列的浮点数组。
+    
+    异常:
+        PayloadError: 记录不是对象、缺少特征或特征值不是有限数值。
+    """
+    if not isinstance(instance, dict):
+        raise PayloadError("instance must be a JSON object keyed by feature name")
+    row = np.empty(len(ALL_FEATURES))
+    for i, feat in enumerate(ALL_FEATURES):
+        try:
+            row[i] = float(instance[feat])
+        except KeyError:
+            raise PayloadError(f"missing feature: {feat}") from None
+        except (TypeError, ValueError):
+            raise PayloadError(f"invalid value for feature: {feat}") from None
+    if not np.isfinite(row).all():
+        raise PayloadError("feature values must be finite numbers")
+    return row
+
+class _Pending:
+    """等待批处理的一个请求"""
+    __slots__ = ('X', 'future', 'enqueued')
+    
+    def __init__(self, X):
+        self.X = X
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+class MicroBatcher:
+    """
+    将并发请求合并为批次的单线程调度器。
+    
+    submit把特征矩阵放入队列并返回Future，结果为包含该请求的预测、概率、排队耗时、推理耗时
+    和所在批次行数的字典。active记录正在处理中的请求数（由HTTP处理线程维护），只有还有其他
+    请求尚未入队时批次线程才会等待，最长等待max_wait秒。
+    """
+    def __init__(self, use_dummy=False, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT_MS / 1000, fast_meta=False):
+        self.use_dummy = use_dummy
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.fast_meta = fast_meta
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.active = 0
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+        self.max_batch_rows = 0
+        self.errors = 0
+    
+    def models(self):
+        """当前模型集（模型文件更新后注册表自动重新加载）"""
+        return load_models(use_dummy=self.use_dummy)
+    
+    def score(self, X):
+        """对特征矩阵直接进行一次向量化预测"""
+        models = self.models()
+        return make_predictions_cached(X, models[:4], models[4], fast_meta=self.fast_meta)
+    
+    def start(self):
+        """启动批次线程"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+    
+    def stop(self, timeout=None):
+        """处理完已入队的请求后停止批次线程"""
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def begin_request(self):
+        """HTTP处理线程开始处理一个请求"""
+        with self._lock:
+            self.active += 1
+    
+    def end_request(self):
+        """HTTP处理线程完成一个请求"""
+        with self._lock:
+            self.active -= 1
+    
+    def submit(self, X):
+        """将特征矩阵放入批处理队列，返回Future"""
+        pending = _Pending(X)
+        self._queue.put(pending)
+        return pending.future
+    
+    def _collect(self, first):
+        """从队列中收集一个批次，返回 (批次, 是否收到停止信号)"""
+        batch = [first]
+        rows = len(first.X)
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                # 其他请求都已入队时不再等待
+                remaining = deadline - time.perf_counter()
+                if self.active <= len(batch) or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            rows += len(item.X)
+        return batch, False
+    
+    def _run(self):
+        """批次线程：收集请求，一次向量化预测后把结果分发给各请求"""
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, stopping = self._collect(first)
+            
+            start = time.perf_counter()
+            try:
+                X = batch[0].X if len(batch) == 1 else np.vstack([item.X for item in batch])
+                predictions, probabilities = self.score(X)
+            except Exception as exc:
+                self.errors += 1
+                logger.exception("Failed to score a batch of %d requests", len(batch))
+                for item in batch:
+                    item.future.set_exception(exc)
+                continue
+            elapsed = time.perf_counter() - start
+            
+            self.requests += len(batch)
+            self.batches += 1
+            self.rows += len(X)
+            self.max_batch_rows = max(self.max_batch_rows, len(X))
+            offset = 0
+            for item in batch:
+                stop = offset + len(item.X)
+                item.future.set_result({
+                    'predictions': predictions[offset:stop],
+                    'probabilities': probabilities[offset:stop],
+                    'queue_seconds': start - item.enqueued,
+                    'inference_seconds': elapsed,
+                    'batch_rows': len(X),
+                })
+                offset = stop
+    
+    def stats(self):
+        """返回批处理统计"""
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'rows': self.rows,
+            'avg_batch_rows': self.rows / self.batches if self.batches else 0.0,
+            'max_batch_rows': self.max_batch_rows,
+            'queue_depth': self._queue.qsize(),
+            'active_requests': self.active,
+            'errors': self.errors,
+        }
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    """评分服务的HTTP请求处理器，服务器对象上保存batcher和延迟记录"""
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FBTPScoring/1.0'
+    
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+    
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        batcher = self.server.batcher
+        if self.path == '/health':
+            models = batcher.models()
+            self._send_json(200, {
+                'status': 'ok',
+                'model': 'dummy' if batcher.use_dummy else 'real',
+                'model_fingerprint': model_fingerprint(models[:4], models[4]),
+                'features': ALL_FEATURES,
+            })
+        elif self.path == '/stats':
+            latencies = sorted(self.server.latencies)
+            stats = batcher.stats()
+            if latencies:
+                stats['latency_ms'] = {
+                    f'p{q}': latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))] * 1000
+                    for q in (50, 90, 99)
+                }
+            self._send_json(200, stats)
+        else:
+            self._send_json(404, {'error': f"unknown path: {self.path}"})
+    
+    def do_POST(self):
+        if self.path != '/predict':
+            # 请求体未读取，保持连接会把它当作下一个请求解析
+            self._send_json(404, {'error': f"unknown path: {self.path}"}, {'Connection': 'close'})
+            return
+        batcher = self.server.batcher
+        batcher.begin_request()
+        try:
+            self._predict(batcher)
+        finally:
+            batcher.end_request()
+    
+    def _read_payload(self):
+        """读取并解析JSON请求体；请求体无法读取时标记关闭连接，未读取的字节不会被当作下一个请求"""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self.close_connection = True
+            raise PayloadError("invalid Content-Length header") from None
+        if length < 0:
+            self.close_connection = True
+            raise PayloadError("invalid Content-Length header")
+        if length == 0:
+            raise PayloadError("request body is empty")
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            raise PayloadError(f"request body exceeds {MAX_BODY_BYTES} bytes")
+        try:
+            return json.loads(self.rfile.read(length))
+        except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+            raise PayloadError(f"invalid JSON: {exc}") from None
+    
+    def _predict(self, batcher):
+        start = time.perf_counter()
+        try:
+            payload = self._read_payload()
+            single = isinstance(payload, dict) and 'instances' not in payload
+            instances = [payload] if single else payload.get('instances') if isinstance(payload, dict) else payload
+            if not isinstance(instances, list):
+                raise PayloadError("'instances' must be a list")
+            if single:
+                rows, errors = [parse_instance(payload)], ['']
+            else:
+                rows, errors = [], []
+                for instance in instances:
+                    try:
+                        rows.append(parse_instance(instance))
+                        errors.append('')
+                    except PayloadError as exc:
+                        rows.append(None)
+                        errors.append(str(exc))
+        except PayloadError as exc:
+            self._send_json(400, {'error': str(exc)}, {'Connection': 'close'} if self.close_connection else None)
+            return
+        
+        valid = [row for row in rows if row is not None]
+        timing = {'predictions': np.empty(0, dtype=object), 'probabilities': np.empty(0),
+                  'queue_seconds': 0.0, 'inference_seconds': 0.0, 'batch_rows': 0}
+        if valid:
+            X = np.vstack(valid)
+            try:
+                if len(X) >= batcher.max_batch_size:
+                    # 大批量请求本身已经是向量化的，直接在处理线程中预测
+                    inference_start = time.perf_counter()
+                    predictions, probabilities = batcher.score(X)
+                    timing = {'predictions': predictions, 'probabilities': probabilities, 'queue_seconds': 0.0,
+                              'inference_seconds': time.perf_counter() - inference_start, 'batch_rows': len(X)}
+                else:
+                    timing = batcher.submit(X).result()
+            except Exception as exc:
+                self._send_json(500, {'error': f"scoring failed: {exc}"})
+                return
+        
+        results = []
+        scored = iter(zip(timing['predictions'], timing['probabilities']))
+        for instance, row, error in zip(instances, rows, errors):
+            result = {'prediction': None, 'probability': None, 'error': error}
+            if row is not None:
+                prediction, probability = next(scored)
+                result.update(prediction=str(prediction), probability=float(probability))
+            if isinstance(instance, dict) and ID_FIELD in instance:
+                result[ID_FIELD] = instance[ID_FIELD]
+            results.append(result)
+        
+        total = time.perf_counter() - start
+        self.server.latencies.append(total)
+        models = batcher.models()
+        queue_ms = timing['queue_seconds'] * 1000
+        inference_ms = timing['inference_seconds'] * 1000
+        headers = {
+            'X-Queue-Time-Ms': f"{queue_ms:.3f}",
+            'X-Inference-Time-Ms': f"{inference_ms:.3f}",
+            'X-Total-Time-Ms': f"{total * 1000:.3f}",
+            'X-Batch-Size': str(timing['batch_rows']),
+            'X-Model-Fingerprint': model_fingerprint(models[:4], models[4]),
+            'Server-Timing': f"queue;dur={queue_ms:.3f}, inference;dur={inference_ms:.3f}, total;dur={total * 1000:.3f}",
+        }
+        if single:
+            result = results[0]
+            self._send_json(200, {'prediction': result['prediction'], 'probability': result['probability']}, headers)
+        else:
+            self._send_json(200, {'predictions': results}, headers)
+
+class ScoringServer(ThreadingHTTPServer):
+    """每个连接一个线程的HTTP服务器，监听队列长度可配置"""
+    daemon_threads = True
+    request_queue_size = DEFAULT_BACKLOG
+    
+    def __init__(self, server_address, handler_class, backlog=DEFAULT_BACKLOG):
+        # listen()在父类构造函数中调用，必须先设置队列长度
+        self.request_queue_size = backlog
+        super().__init__(server_address, handler_class)
+
+def create_server(host=DEFAULT_HOST, port=DEFAULT_PORT, use_dummy=False, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                  max_wait_ms=DEFAULT_MAX_WAIT_MS, fast_meta=False, backlog=DEFAULT_BACKLOG):
+    """
+    创建评分服务（模型在返回前加载完毕），调用serve_forever()开始处理请求。
+    
+    返回:
+        ScoringServer: server.batcher为MicroBatcher实例
+    """
+    batcher = MicroBatcher(use_dummy=use_dummy, max_batch_size=max(int(max_batch_size), 1),
+                           max_wait=max(max_wait_ms, 0.0) / 1000, fast_meta=fast_meta)
+    batcher.models()
+    batcher.start()
+    server = ScoringServer((host, port), ScoringRequestHandler, backlog=max(int(backlog), 1))
+    server.batcher = batcher
+    server.latencies = deque(maxlen=LATENCY_WINDOW)
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the stacked NB+SVC model over HTTP/JSON with micro-batching.")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"Address to bind (default: {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--model', choices=['real', 'dummy'], default='real', help="Model set to serve (default: real)")
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                        help=f"Maximum rows coalesced into one batch (default: {DEFAULT_MAX_BATCH_SIZE})")
+    parser.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS,
+                        help=f"Longest time a batch waits for in-flight requests (default: {DEFAULT_MAX_WAIT_MS})")
+    parser.add_argument('--fast-meta', action='store_true',
+                        help="Serve the SVC meta-classifier from a precomputed lookup surface")
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG,
+                        help=f"Pending connections queued by the listening socket (default: {DEFAULT_BACKLOG})")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    server = create_server(args.host, args.port, use_dummy=(args.model == 'dummy'),
+                           max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                           fast_meta=args.fast_meta, backlog=args.backlog)
+    logger.info("Scoring service listening on http://%s:%d", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
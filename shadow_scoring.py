@@ -0,0 +1,233 @@
+"""
+影子评分：候选模型集在后台线程中对线上输入评分，与当前模型的结果逐条对照。
+
+make_prediction的主结果照常立即返回，展示给用户的预测不受影响。影子评分通过预测监听器
+只把输入和主结果放入有界队列（队列满时丢弃并计数），候选模型的评分和shadow_predictions表的
+写入都在后台线程中完成，因此不增加主路径的延迟。
+
+候选模型集来自环境变量SHADOW_MODELS（以os.pathsep分隔的模型目录或模型包文件），
+未设置时使用models/shadow/下的每个子目录和.npy模型包。管理员在历史记录页面查看
+结果一致率、概率差和各模型平均耗时的汇总（db_utils.get_shadow_summary）。
+
+用法示例:
+    from shadow_scoring import start_shadow_mode
+    start_shadow_mode()                        # 自动发现候选模型
+    start_shadow_mode(['models/candidate'])    # 指定候选模型
+"""
+import atexit
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+from db_utils import register_model_version, save_shadow_predictions
+from model_utils import (MODEL_DIR, MODEL_REGISTRY, add_prediction_listener,
+                         make_predictions_batch, model_fingerprint,
+                         remove_prediction_listener)
+
+logger = logging.getLogger(__name__)
+
+# 候选模型的配置方式
+SHADOW_MODELS_ENV = 'SHADOW_MODELS'
+SHADOW_MODEL_DIR = os.path.join(MODEL_DIR, 'shadow')
+
+# 队列容量和每次写入的最大记录数
+SHADOW_QUEUE_SIZE = 1000
+SHADOW_BATCH_SIZE = 64
+
+# 后台线程等待新输入的时间（秒），也是检查停止信号的间隔
+SHADOW_POLL_INTERVAL = 0.5
+
+def discover_candidates():
+    """返回候选模型集的路径列表（模型目录或模型包文件）"""
+    configured = os.environ.get(SHADOW_MODELS_ENV)
+    if configured:
+        return [path for path in configured.split(os.pathsep) if path]
+    if not os.path.isdir(SHADOW_MODEL_DIR):
+        return []
+    return [
+        os.path.join(SHADOW_MODEL_DIR, name)
+        for name in sorted(os.listdir(SHADOW_MODEL_DIR))
+        if name.endswith('.npy') or os.path.isdir(os.path.join(SHADOW_MODEL_DIR, name))
+    ]
+
+class ShadowScorer:
+    """
+    候选模型集的后台评分器。
+    
+    observe作为预测监听器在主路径中调用，只做一次非阻塞入队。后台线程首次评分前加载候选模型，
+    之后对每条输入逐条调用候选模型，每批结果在一个事务中写入数据库。候选模型与主模型的指纹相同时跳过。
+    
+    主路径的预测可能命中预测缓存，因此主模型的耗时也在后台线程中以相同方式（不经过缓存）重新测量，
+    与候选模型的耗时可直接比较。每条结果带有make_prediction收到的prediction_uid，用于关联预测记录。
+    """
+    def __init__(self, candidates, queue_size=SHADOW_QUEUE_SIZE, batch_size=SHADOW_BATCH_SIZE):
+        self.candidates = list(candidates)
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._models = None  # [(指纹, 模型元组, 标准化器)]，在后台线程中加载
+        self.submitted = 0
+        self.dropped = 0
+        self.scored = 0
+        self.errors = 0
+        self.latency = {}  # 候选模型指纹 -> [评分次数, 总耗时（秒）]
+    
+    def observe(self, X, models, scaler, prediction, probability, seconds, prediction_uid=None):
+        """预测监听器：将输入和主模型结果放入队列，队列满时丢弃"""
+        try:
+            self._queue.put_nowait(
+                (X, models, scaler, prediction, probability, prediction_uid, datetime.datetime.now())
+            )
+            self.submitted += 1
+        except queue.Full:
+            self.dropped += 1
+    
+    def start(self):
+        """启动后台线程并注册预测监听器"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+                self._thread.start()
+        add_prediction_listener(self.observe)
+    
+    def _load_candidates(self):
+        """加载候选模型集并登记到模型版本表，加载失败的候选模型记录错误后跳过"""
+        loaded = []
+        for path in self.candidates:
+            try:
+                fingerprint, models = MODEL_REGISTRY.load_version(path)
+                version = MODEL_REGISTRY.describe(fingerprint) or {}
+                register_model_version(fingerprint, "Shadow Model", path, version.get('artifacts'))
+            except Exception:
+                self.errors += 1
+                logger.exception("Failed to load shadow model set %s", path)
+                continue
+            loaded.append((fingerprint, tuple(models[:4]), models[4]))
+        return loaded
+    
+    def _score(self, batch):
+        """用每个候选模型对一批输入评分，返回shadow_predictions表的记录"""
+        if self._models is None:
+            self._models = self._load_candidates()
+        
+        primaries = [model_fingerprint(item[1], item[2]) for item in batch]
+        primary_latency = [self._timed(item[0], item[1], item[2])[1] for item in batch]
+        rows = []
+        for fingerprint, models, scaler in self._models:
+            counts = self.latency.setdefault(fingerprint, [0, 0.0])
+            for (X, _, _, prediction, probability, prediction_uid, scored_at), primary, primary_seconds in zip(
+                batch, primaries, primary_latency
+            ):
+                if primary == fingerprint:
+                    continue
+                (predictions, probabilities), elapsed = self._timed(X, models, scaler)
+                counts[0] += 1
+                counts[1] += elapsed
+                rows.append((
+                    scored_at, prediction_uid, primary, fingerprint, prediction, probability, primary_seconds * 1000,
+                    predictions[0], float(probabilities[0]), elapsed * 1000
+                ))
+        return rows
+    
+    @staticmethod
+    def _timed(X, models, scaler):
+        """不经过预测缓存预测一条输入，返回 (预测结果, 耗时（秒）)"""
+        start = time.perf_counter()
+        result = make_predictions_batch(X, models, scaler)
+        return result, time.perf_counter() - start
+    
+    def _run(self):
+        """后台线程：收集一批输入后评分并写入，直到收到停止信号且队列清空"""
+        while True:
+            try:
+                first = self._queue.get(timeout=SHADOW_POLL_INTERVAL)
+            except queue.Empty:
+                if self._stopping:
+                    return
+                continue
+            
+            batch = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                self.scored += save_shadow_predictions(self._score(batch))
+            except Exception:
+                self.errors += 1
+                logger.exception("Failed to score %d shadow predictions", len(batch))
+            
+            for _ in batch:
+                self._queue.task_done()
+    
+    def flush(self, timeout=None):
+        """等待队列中的输入全部评分并写入，返回是否在超时前完成"""
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(lambda: self._queue.unfinished_tasks == 0, timeout)
+    
+    def stop(self, timeout=None):
+        """移除预测监听器，评分剩余输入后停止后台线程"""
+        remove_prediction_listener(self.observe)
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def stats(self):
+        """返回队列深度、评分计数和各候选模型的平均耗时"""
+        return {
+            'candidates': len(self.candidates),
+            'queue_depth': self._queue.qsize(),
+            'submitted': self.submitted,
+            'dropped': self.dropped,
+            'scored': self.scored,
+            'errors': self.errors,
+            'avg_latency_ms': {
+                fingerprint: total / count * 1000
+                for fingerprint, (count, total) in self.latency.items() if count
+            }
+        }
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+def start_shadow_mode(candidates=None):
+    """
+    开启影子评分（每个进程只启动一个评分器）。
+    
+    参数:
+        candidates (list): 候选模型目录或模型包路径，为None时使用discover_candidates()。
+    
+    返回:
+        ShadowScorer: 正在运行的评分器，没有候选模型时返回None。
+    """
+    global _scorer
+    with _scorer_lock:
+        if _scorer is None:
+            candidates = discover_candidates() if candidates is None else list(candidates)
+            if not candidates:
+                return None
+            _scorer = ShadowScorer(candidates)
+            _scorer.start()
+            atexit.register(_scorer.stop)
+    return _scorer
+
+def get_shadow_scorer():
+    """返回正在运行的评分器，未开启影子评分时返回None"""
+    return _scorer
+
+def stop_shadow_mode(timeout=None):
+    """关闭影子评分，评分剩余输入后停止后台线程"""
+    global _scorer
+    with _scorer_lock:
+        scorer, _scorer = _scorer, None
+    if scorer is not None:
+        atexit.unregister(scorer.stop)
+        scorer.stop(timeout)
@@ -0,0 +1,184 @@
+"""
+启动耗时统计和延迟导入工具。
+
+重量级模块（pandas、plotly、scikit-learn等）通过lazy_import在首次使用时才导入，
+导入耗时和应用启动的各个阶段记录在STARTUP_TIMER中，可在开发者选项中查看。
+
+单独运行时导入应用的各个后端模块并打印耗时报告，数据库初始化和模型加载需要显式开启:
+    python -m startup_timing --with-db --with-models
+"""
+import argparse
+import importlib
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# 进程启动（本模块首次导入）的时间点
+PROCESS_START = time.perf_counter()
+
+class StartupTimer:
+    """
+    记录启动阶段和模块导入的耗时。
+    
+    Streamlit每次交互都会重新运行脚本，同名阶段只记录第一次（即冷启动）的耗时。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = {}  # 阶段名 -> (相对进程启动的开始时间, 耗时)，按开始顺序排列
+        self.imports = {}  # 模块名 -> 导入耗时
+        self._last_mark = PROCESS_START
+    
+    @contextmanager
+    def phase(self, name):
+        """统计一个启动阶段的耗时"""
+        if name in self.phases:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.setdefault(name, (start - PROCESS_START, time.perf_counter() - start))
+    
+    def mark(self, name):
+        """记录从上一个标记（或进程启动）到现在的阶段耗时"""
+        now = time.perf_counter()
+        with self._lock:
+            if name not in self.phases:
+                self.phases[name] = (self._last_mark - PROCESS_START, now - self._last_mark)
+                self._last_mark = now
+    
+    def record_import(self, name, seconds):
+        """记录一个模块的导入耗时"""
+        with self._lock:
+            self.imports.setdefault(name, seconds)
+    
+    def report(self):
+        """
+        返回启动耗时报告。
+        
+        返回:
+            dict: uptime（进程已运行的秒数）、phases（按开始顺序的 (阶段名, 开始时间, 耗时)）
+                  和imports（按耗时降序的 (模块名, 耗时)）
+        """
+        with self._lock:
+            phases = [(name, start, seconds) for name, (start, seconds) in self.phases.items()]
+            imports = sorted(self.imports.items(), key=lambda item: item[1], reverse=True)
+        return {
+            'uptime': time.perf_counter() - PROCESS_START,
+            'phases': phases,
+            'imports': imports,
+        }
+    
+    def format_report(self):
+        """将启动耗时报告格式化为多行文本"""
+        report = self.report()
+        lines = [f"Startup report (process up {report['uptime']:.2f}s)"]
+        for name, start, seconds in report['phases']:
+            lines.append(f"  phase  {name:<28} {seconds * 1000:9.1f} ms  (at +{start * 1000:.0f} ms)")
+        for name, seconds in report['imports']:
+            lines.append(f"  import {name:<28} {seconds * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+# 全局启动计时器
+STARTUP_TIMER = StartupTimer()
+
+def timed_import(name):
+    """导入模块并记录耗时，已导入的模块直接返回"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    STARTUP_TIMER.record_import(name, time.perf_counter() - start)
+    return module
+
+class LazyModule:
+    """模块代理，首次访问属性时才导入真正的模块"""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+    
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = timed_import(self._name)
+        return getattr(module, attr)
+    
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+def lazy_import(name):
+    """
+    返回一个延迟导入的模块代理。
+    
+    示例:
+        pd = lazy_import("pandas")  # 此时不导入
+        pd.DataFrame(...)           # 首次使用时导入并记录耗时
+    """
+    return LazyModule(name)
+
+def _time_database_init():
+    """
+    在临时数据库上统计数据库初始化（含结构迁移）的耗时。
+    
+    存在实际数据库时先以只读方式复制一份，实际数据库不会被修改。
+    """
+    import sqlite3
+    import tempfile
+    db_utils = sys.modules['db_utils']
+    live_path = db_utils.DB_PATH
+    with tempfile.TemporaryDirectory(prefix='startup-timing-') as db_dir:
+        db_path = os.path.join(db_dir, os.path.basename(live_path))
+        if os.path.exists(live_path):
+            source = sqlite3.connect(f"file:{live_path}?mode=ro", uri=True)
+            target = sqlite3.connect(db_path)
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+        db_utils.DB_PATH = db_path
+        try:
+            db_utils.ensure_db()
+        finally:
+            db_utils.DB_PATH = live_path
+            db_utils.close_pool()
+
+def _time_model_load():
+    """统计实际模型的加载耗时，模型文件不存在时跳过而不是创建新模型"""
+    model_utils = sys.modules['model_utils']
+    model_dir, paths = model_utils._artifact_paths(False)
+    if model_utils._artifact_signature(paths) is None:
+        print(f"Skipping model load: no model files in {model_dir}", file=sys.stderr)
+        return
+    model_utils.load_models(use_dummy=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print a startup timing report for the app's backend modules.")
+    parser.add_argument('--with-db', action='store_true',
+                        help="Also time database initialisation (runs against a temporary copy of the database)")
+    parser.add_argument('--with-models', action='store_true',
+                        help="Also time loading the real models (skipped when the model files are missing)")
+    args = parser.parse_args(argv)
+    
+    # 以 python -m 运行时本模块名为__main__，需要使用各后端模块共享的startup_timing实例
+    timing = importlib.import_module('startup_timing')
+    timer = timing.STARTUP_TIMER
+    for name in ('model_utils', 'db_utils', 'batch_scoring', 'translations', 'static_assets'):
+        with timer.phase(f"import {name}"):
+            timing.timed_import(name)
+    # 数据库初始化和模型加载的阶段耗时由db_utils和model_utils自行记录
+    if args.with_db:
+        _time_database_init()
+    if args.with_models:
+        _time_model_load()
+    print(timer.format_report())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import io
+import os
+import re
+import threading
+
+# 静态资源路径
+STYLESHEET_PATH = "assets/styles.css"
+BACKGROUND_PATH = "assets/background.jpg"
+
+# Streamlit静态文件服务目录及其URL前缀（需要在配置中启用 server.enableStaticServing）
+STATIC_DIR = "static"
+STATIC_URL = "app/static"
+
+# 背景图片缩放和压缩参数
+BACKGROUND_MAX_WIDTH = 1920
+BACKGROUND_QUALITY = 80
+
+# 进程级缓存：键中包含文件的修改时间，文件被替换后自动重新生成
+_cache = {}
+_cache_lock = threading.RLock()
+
+def _cached(key, paths, builder):
+    """按文件修改时间缓存builder的结果"""
+    full_key = (key, tuple((path, os.stat(path).st_mtime_ns) for path in paths))
+    value = _cache.get(full_key)
+    if value is None:
+        with _cache_lock:
+            value = _cache.get(full_key)
+            if value is None:
+                # 清除同一资源的旧版本
+                for old_key in [k for k in _cache if k[0] == key]:
+                    del _cache[old_key]
+                value = builder()
+                _cache[full_key] = value
+    return value
+
+def minify_css(css):
+    """去除CSS注释和多余空白"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = css.replace(': ', ':')
+    return css.replace(';}', '}').strip()
+
+def _encode_background(image_path, max_width, quality):
+    """
+    读取背景图片，缩小到max_width并重新压缩为JPEG。
+    
+    Pillow不可用或图片无法解码时返回原始文件内容。
+    
+    返回:
+        tuple: (图片字节, MIME类型)
+    """
+    with open(image_path, "rb") as f:
+        data = f.read()
+    mime = "image/png" if image_path.lower().endswith(".png") else "image/jpeg"
+    
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, mime
+    
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert("RGB")
+            if image.width > max_width:
+                height = round(image.height * max_width / image.width)
+                image = image.resize((max_width, height), Image.LANCZOS)
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True, progressive=True)
+    except OSError:
+        return data, mime
+    
+    # 重新压缩后反而更大时保留原图
+    if output.tell() >= len(data):
+        return data, mime
+    return output.getvalue(), "image/jpeg"
+
+def background_css(image_path=BACKGROUND_PATH, static_serving=False,
+                   max_width=BACKGROUND_MAX_WIDTH, quality=BACKGROUND_QUALITY):
+    """
+    生成背景图片的CSS规则。
+    
+    启用静态文件服务时，图片写入STATIC_DIR并通过URL引用，浏览器可以缓存；
+    否则将压缩后的图片以data URI的形式内嵌。
+    """
+    def build():
+        data, mime = _encode_background(image_path, max_width, quality)
+        if static_serving:
+            # 文件名包含内容哈希，图片变化时浏览器缓存自动失效
+            digest = hashlib.sha1(data).hexdigest()[:12]
+            extension = ".png" if mime == "image/png" else ".jpg"
+            filename = f"background-{digest}{extension}"
+            os.makedirs(STATIC_DIR, exist_ok=True)
+            target = os.path.join(STATIC_DIR, filename)
+            if not os.path.exists(target):
+                with open(target, "wb") as f:
+                    f.write(data)
+            url = f"{STATIC_URL}/{filename}"
+        else:
+            url = f"data:{mime};base64,{base64.b64encode(data).decode()}"
+        return (
+            f".stApp{{background-image:url({url});background-attachment:fixed;"
+            "background-size:cover;background-position:center;background-repeat:no-repeat}"
+        )
+    
+    return _cached(('background', static_serving, max_width, quality), [image_path], build)
+
+def get_stylesheet(static_serving=False):
+    """
+    返回合并、压缩后的完整样式表（包括背景图片），每个进程只生成一次。
+    
+    返回:
+        str: 可直接通过st.markdown注入的<style>标签
+    """
+    def build():
+        with open(STYLESHEET_PATH, encoding="utf-8") as f:
+            css = minify_css(f.read())
+        return f"<style>{css}{background_css(static_serving=static_serving)}</style>"
+    
+    return _cached(('stylesheet', static_serving), [STYLESHEET_PATH, BACKGROUND_PATH], build)
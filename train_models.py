@@ -0,0 +1,374 @@
+"""
+从带标签的患者队列训练堆叠模型（三个朴素贝叶斯基础模型 + SVC元分类器）。
+
+基础层使用分层K折交叉验证生成样本外（out-of-fold）FBTP概率，各折在进程池中并行训练；
+元分类器svc_meta在样本外概率上训练，标准化器和三个基础模型在全部数据上训练。
+折划分、样本外概率矩阵和全量基础模型按队列内容缓存在磁盘上，只修改SVC超参数重新训练时
+不会重新训练基础层。
+
+训练结果写入 models/versions/<时间>-<指纹>/（五个模型文件和manifest.json），
+加上 --activate 时同时复制到 models/ 作为当前模型。
+
+用法示例:
+    python -m train_models cohort.csv --label-column response --folds 5 --workers 4
+    python -m train_models cohort.csv --C 2.0 --gamma 0.5 --activate
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import sklearn
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.naive_bayes import BernoulliNB, GaussianNB, MultinomialNB
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from batch_scoring import detect_format
+from model_utils import (ALL_FEATURES, BINARY_SLICE, CONTINUOUS_SLICE, DISCRETE_SLICE,
+                         MODEL_BUNDLE_FILE, MODEL_DIR, REAL_MODEL_FILES,
+                         _content_fingerprint)
+from startup_timing import lazy_import
+
+pd = lazy_import("pandas")
+
+# 版本化模型和训练缓存的目录
+MODEL_VERSIONS_DIR = os.path.join(MODEL_DIR, 'versions')
+TRAINING_CACHE_DIR = os.path.join(MODEL_DIR, 'training_cache')
+MANIFEST_FILE = 'manifest.json'
+
+# 默认的标签列、折数和随机种子
+DEFAULT_LABEL_COLUMN = 'label'
+DEFAULT_FOLDS = 5
+DEFAULT_SEED = 42
+
+# 类别标签（与推理代码中的FBTP/NFBTP一致），数值标签1表示FBTP
+POSITIVE_LABEL = 'FBTP'
+NEGATIVE_LABEL = 'NFBTP'
+
+# 元分类器的默认超参数（与SVC的默认值相同）
+DEFAULT_SVC_PARAMS = {'kernel': 'rbf', 'C': 1.0, 'gamma': 'scale'}
+
+# 工作进程中的训练数据，每个进程只接收一次
+_worker_data = None
+
+def load_cohort(path, label_column=DEFAULT_LABEL_COLUMN):
+    """
+    读取带标签的队列文件（CSV或Parquet）。
+    
+    标签列可以是FBTP/NFBTP，也可以是1/0（1表示FBTP）。
+    
+    返回:
+        tuple: (X, y)，X为按ALL_FEATURES排列的特征矩阵 shape=[n, 14]，y为FBTP/NFBTP标签数组
+    """
+    file_format = detect_format(path)
+    frame = pd.read_parquet(path) if file_format == 'parquet' else pd.read_csv(path)
+    missing = [column for column in ALL_FEATURES + [label_column] if column not in frame.columns]
+    if missing:
+        raise ValueError(f"Cohort file is missing columns: {', '.join(missing)}")
+    
+    X = frame[ALL_FEATURES].to_numpy(dtype=np.float64)
+    if not np.isfinite(X).all():
+        raise ValueError("Cohort features contain missing or non-numeric values")
+    labels = frame[label_column].astype(str).str.strip().str.upper()
+    y = labels.replace({'1': POSITIVE_LABEL, '1.0': POSITIVE_LABEL, '0': NEGATIVE_LABEL, '0.0': NEGATIVE_LABEL}).to_numpy()
+    unknown = sorted(set(y) - {POSITIVE_LABEL, NEGATIVE_LABEL})
+    if unknown:
+        raise ValueError(f"Unknown labels in column '{label_column}': {', '.join(unknown[:5])}")
+    if len(set(y)) < 2:
+        raise ValueError("The cohort must contain both FBTP and NFBTP patients")
+    return X, y.astype(object)
+
+def cohort_key(X, y, folds, seed):
+    """按队列内容、折数、随机种子和scikit-learn版本计算缓存键"""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(X).tobytes())
+    digest.update('\n'.join(y).encode('utf-8'))
+    digest.update(f"{folds}:{seed}:{sklearn.__version__}".encode('utf-8'))
+    return digest.hexdigest()
+
+def fold_assignments(y, folds=DEFAULT_FOLDS, seed=DEFAULT_SEED):
+    """分层K折划分，返回每行所属的折编号 shape=[n]"""
+    assignment = np.empty(len(y), dtype=np.int64)
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    for fold, (_, val_idx) in enumerate(splitter.split(np.zeros(len(y)), y)):
+        assignment[val_idx] = fold
+    return assignment
+
+def fit_base_layer(X, y):
+    """
+    训练标准化器和三个基础模型。
+    
+    返回:
+        tuple: (gaussian_nb, multinomial_nb, bernoulli_nb, scaler)
+    """
+    scaler = StandardScaler().fit(X[:, CONTINUOUS_SLICE])
+    gaussian_nb = GaussianNB().fit(scaler.transform(X[:, CONTINUOUS_SLICE]), y)
+    multinomial_nb = MultinomialNB().fit(X[:, DISCRETE_SLICE], y)
+    bernoulli_nb = BernoulliNB().fit(X[:, BINARY_SLICE], y)
+    return gaussian_nb, multinomial_nb, bernoulli_nb, scaler
+
+def base_probabilities(X, base_models):
+    """三个基础模型的FBTP概率（元分类器的输入），shape=[n, 3]"""
+    gaussian_nb, multinomial_nb, bernoulli_nb, scaler = base_models
+    positive = lambda model: list(model.classes_).index(POSITIVE_LABEL)
+    return np.column_stack([
+        gaussian_nb.predict_proba(scaler.transform(X[:, CONTINUOUS_SLICE]))[:, positive(gaussian_nb)],
+        multinomial_nb.predict_proba(X[:, DISCRETE_SLICE])[:, positive(multinomial_nb)],
+        bernoulli_nb.predict_proba(X[:, BINARY_SLICE])[:, positive(bernoulli_nb)],
+    ])
+
+def _init_worker(X, y, assignment):
+    """工作进程初始化：接收一次训练数据和折划分"""
+    global _worker_data
+    _worker_data = (X, y, assignment)
+
+def _fit_fold(fold):
+    """在工作进程中训练一折（fold为None时在全部数据上训练），返回 (fold, 验证集行号, 样本外概率或全量模型)"""
+    X, y, assignment = _worker_data
+    if fold is None:
+        return fold, None, fit_base_layer(X, y)
+    train = assignment != fold
+    val_idx = np.flatnonzero(~train)
+    base_models = fit_base_layer(X[train], y[train])
+    return fold, val_idx, base_probabilities(X[val_idx], base_models)
+
+def _cache_paths(cache_dir, key):
+    directory = os.path.join(cache_dir, key)
+    return {
+        'dir': directory,
+        'folds': os.path.join(directory, 'folds.npy'),
+        'oof': os.path.join(directory, 'oof.npy'),
+        'base_models': os.path.join(directory, 'base_models.joblib'),
+    }
+
+def compute_base_layer(X, y, folds=DEFAULT_FOLDS, seed=DEFAULT_SEED, workers=None,
+                       cache_dir=TRAINING_CACHE_DIR, refresh=False):
+    """
+    生成基础层的样本外概率和全量基础模型，结果按队列内容缓存在cache_dir中。
+    
+    参数:
+        X (ndarray): 特征矩阵 shape=[n, 14]。
+        y (ndarray): FBTP/NFBTP标签。
+        folds (int): 交叉验证折数。
+        seed (int): 折划分的随机种子。
+        workers (int): 并行训练的进程数，默认为CPU核数。
+        cache_dir (str): 缓存目录，为None时不使用缓存。
+        refresh (bool): 忽略已有缓存并重新训练。
+    
+    返回:
+        dict: key（缓存键）、folds（每行的折编号）、oof（样本外概率 shape=[n, 3]）、
+              base_models（在全部数据上训练的 (gaussian_nb, multinomial_nb, bernoulli_nb, scaler)）
+              和cached（是否命中缓存）
+    """
+    key = cohort_key(X, y, folds, seed)
+    paths = _cache_paths(cache_dir, key) if cache_dir else None
+    if paths and not refresh and all(os.path.exists(paths[name]) for name in ('folds', 'oof', 'base_models')):
+        return {
+            'key': key,
+            'folds': np.load(paths['folds']),
+            'oof': np.load(paths['oof']),
+            'base_models': joblib.load(paths['base_models']),
+            'cached': True,
+        }
+    
+    assignment = fold_assignments(y, folds, seed)
+    oof = np.full((len(y), 3), np.nan)
+    base_models = None
+    tasks = list(range(folds)) + [None]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        _init_worker(X, y, assignment)
+        results = map(_fit_fold, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(X, y, assignment))
+        results = executor.map(_fit_fold, tasks)
+    try:
+        for fold, val_idx, result in results:
+            if fold is None:
+                base_models = result
+            else:
+                oof[val_idx] = result
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    
+    if paths:
+        os.makedirs(paths['dir'], exist_ok=True)
+        np.save(paths['folds'], assignment)
+        np.save(paths['oof'], oof)
+        joblib.dump(base_models, paths['base_models'])
+    return {'key': key, 'folds': assignment, 'oof': oof, 'base_models': base_models, 'cached': False}
+
+def make_meta_classifier(params, seed=DEFAULT_SEED):
+    """按超参数创建元分类器"""
+    return SVC(probability=True, random_state=seed, **params)
+
+def classification_metrics(y, probabilities):
+    """FBTP概率的AUC、准确率（阈值0.5）和对数损失"""
+    positive = (y == POSITIVE_LABEL).astype(int)
+    return {
+        'auc': float(roc_auc_score(positive, probabilities)),
+        'accuracy': float(accuracy_score(positive, probabilities >= 0.5)),
+        'log_loss': float(log_loss(positive, np.clip(probabilities, 1e-15, 1 - 1e-15))),
+    }
+
+def cross_validate_meta(oof, y, assignment, params, seed=DEFAULT_SEED):
+    """按相同的折划分对元分类器做交叉验证，返回样本外的FBTP概率"""
+    probabilities = np.empty(len(y))
+    for fold in np.unique(assignment):
+        train = assignment != fold
+        svc = make_meta_classifier(params, seed).fit(oof[train], y[train])
+        probabilities[~train] = svc.predict_proba(oof[~train])[:, list(svc.classes_).index(POSITIVE_LABEL)]
+    return probabilities
+
+def write_version(base_models, svc_meta, manifest, versions_dir=MODEL_VERSIONS_DIR):
+    """
+    将模型集写入新的版本目录，文件名与models/中的实际模型相同。
+    
+    返回:
+        tuple: (版本目录, 内容指纹)
+    """
+    gaussian_nb, multinomial_nb, bernoulli_nb, scaler = base_models
+    artifacts = {
+        'gaussian_nb': gaussian_nb,
+        'multinomial_nb': multinomial_nb,
+        'bernoulli_nb': bernoulli_nb,
+        'svc_meta': svc_meta,
+        'scaler': scaler,
+    }
+    staging = os.path.join(versions_dir, f".staging-{os.getpid()}-{time.time_ns()}")
+    os.makedirs(staging)
+    paths = []
+    for name, model in artifacts.items():
+        path = os.path.join(staging, REAL_MODEL_FILES[name])
+        joblib.dump(model, path)
+        paths.append(path)
+    
+    # 指纹与模型注册表按文件内容计算的指纹一致
+    fingerprint = _content_fingerprint(paths)
+    manifest = dict(manifest, fingerprint=fingerprint, files=[os.path.basename(path) for path in paths])
+    with open(os.path.join(staging, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    
+    version_dir = os.path.join(versions_dir, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{fingerprint[:12]}")
+    os.replace(staging, version_dir)
+    return version_dir, fingerprint
+
+def activate_version(version_dir, model_dir=MODEL_DIR):
+    """
+    将版本目录中的模型复制到当前模型目录（逐个文件原子替换，模型注册表在下次访问时重新加载）。
+    
+    当前模型目录中有模型包时重新导出模型包，否则模型包会继续覆盖新模型。
+    """
+    for filename in REAL_MODEL_FILES.values():
+        staging = os.path.join(model_dir, f".{filename}.tmp")
+        shutil.copyfile(os.path.join(version_dir, filename), staging)
+        os.replace(staging, os.path.join(model_dir, filename))
+    bundle_path = os.path.join(model_dir, MODEL_BUNDLE_FILE)
+    if os.path.exists(bundle_path):
+        from model_bundle import export_bundle
+        export_bundle(model_dir, bundle_path)
+
+def train(X, y, svc_params=None, folds=DEFAULT_FOLDS, seed=DEFAULT_SEED, workers=None,
+          cache_dir=TRAINING_CACHE_DIR, refresh=False, versions_dir=MODEL_VERSIONS_DIR, source=None):
+    """
+    训练完整的堆叠模型并写入新的版本目录。
+    
+    返回:
+        dict: 写入的清单（包括版本目录、指纹和交叉验证指标）
+    """
+    svc_params = dict(DEFAULT_SVC_PARAMS, **(svc_params or {}))
+    start = time.perf_counter()
+    base = compute_base_layer(X, y, folds, seed, workers, cache_dir, refresh)
+    base_seconds = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    svc_meta = make_meta_classifier(svc_params, seed).fit(base['oof'], y)
+    meta_probabilities = cross_validate_meta(base['oof'], y, base['folds'], svc_params, seed)
+    meta_seconds = time.perf_counter() - start
+    
+    manifest = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'source': source,
+        'cohort_key': base['key'],
+        'rows': int(len(y)),
+        'fbtp_rate': float(np.mean(y == POSITIVE_LABEL)),
+        'folds': folds,
+        'seed': seed,
+        'svc_params': svc_params,
+        'scikit-learn': sklearn.__version__,
+        'base_layer_cached': base['cached'],
+        'timings': {'base_layer_s': base_seconds, 'meta_s': meta_seconds},
+        'metrics': {
+            'gaussian_nb': classification_metrics(y, base['oof'][:, 0]),
+            'multinomial_nb': classification_metrics(y, base['oof'][:, 1]),
+            'bernoulli_nb': classification_metrics(y, base['oof'][:, 2]),
+            'stacked': classification_metrics(y, meta_probabilities),
+        },
+    }
+    version_dir, _ = write_version(base['base_models'], svc_meta, manifest, versions_dir)
+    with open(os.path.join(version_dir, MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['version_dir'] = version_dir
+    return manifest
+
+def _parse_gamma(value):
+    """gamma可以是数值或 'scale'/'auto'"""
+    return value if value in ('scale', 'auto') else float(value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the stacked NB+SVC model from a labelled cohort with cross-validated stacking.")
+    parser.add_argument('cohort', help="Labelled cohort file (CSV or Parquet) with the 14 feature columns")
+    parser.add_argument('--label-column', default=DEFAULT_LABEL_COLUMN,
+                        help=f"Column holding FBTP/NFBTP (or 1/0) labels (default: {DEFAULT_LABEL_COLUMN})")
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS, help=f"Cross-validation folds (default: {DEFAULT_FOLDS})")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help=f"Random seed for the fold split and SVC (default: {DEFAULT_SEED})")
+    parser.add_argument('--workers', type=int, help="Worker processes for the base-layer folds (default: CPU count)")
+    parser.add_argument('--kernel', default=DEFAULT_SVC_PARAMS['kernel'], help="SVC kernel (default: rbf)")
+    parser.add_argument('--C', type=float, default=DEFAULT_SVC_PARAMS['C'], help="SVC regularisation parameter (default: 1.0)")
+    parser.add_argument('--gamma', type=_parse_gamma, default=DEFAULT_SVC_PARAMS['gamma'], help="SVC kernel coefficient (default: scale)")
+    parser.add_argument('--cache-dir', default=TRAINING_CACHE_DIR, help=f"Cache for fold splits and OOF matrices (default: {TRAINING_CACHE_DIR})")
+    parser.add_argument('--no-cache', action='store_true', help="Neither read nor write the base-layer cache")
+    parser.add_argument('--refresh', action='store_true', help="Refit the base layer even if a cached result exists")
+    parser.add_argument('--output-dir', default=MODEL_VERSIONS_DIR, help=f"Directory for versioned artifact sets (default: {MODEL_VERSIONS_DIR})")
+    parser.add_argument('--activate', action='store_true', help=f"Also install the new version as the current models in {MODEL_DIR}/")
+    args = parser.parse_args(argv)
+    
+    if args.folds < 2:
+        parser.error("--folds must be at least 2")
+    X, y = load_cohort(args.cohort, args.label_column)
+    manifest = train(
+        X, y,
+        svc_params={'kernel': args.kernel, 'C': args.C, 'gamma': args.gamma},
+        folds=args.folds,
+        seed=args.seed,
+        workers=args.workers,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        refresh=args.refresh,
+        versions_dir=args.output_dir,
+        source=os.path.abspath(args.cohort),
+    )
+    if args.activate:
+        activate_version(manifest['version_dir'])
+    
+    print(f"Wrote {manifest['version_dir']} (fingerprint {manifest['fingerprint'][:12]})")
+    print(f"Base layer: {manifest['timings']['base_layer_s']:.2f} s{' (cached)' if manifest['base_layer_cached'] else ''}, "
+          f"meta: {manifest['timings']['meta_s']:.2f} s")
+    for name, metrics in manifest['metrics'].items():
+        print(f"  {name:<15} AUC {metrics['auc']:.3f}  accuracy {metrics['accuracy']:.3f}  log loss {metrics['log_loss']:.3f}")
+    if args.activate:
+        print(f"Activated as the current model set in {MODEL_DIR}/")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
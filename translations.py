@@ -1,6 +1,10 @@
 """
 存储应用程序的所有翻译文本
 """
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
 
 # 语言配置
 LANGUAGES = {
@@ -26,7 +30,8 @@ TRANSLATIONS = {
         'prediction_results': 'Prediction Results',
         'prediction_probability': 'Prediction Probability:',
         'feature_contribution': 'Feature Contribution Analysis',
-        'feature_importance_note': 'Note: The following is an example of feature contributions based on the current input data. The actual model will provide more accurate analysis.',
+        'feature_importance_note': 'Each bar shows how much the feature moved this patient\'s FBTP probability compared with an average training patient. Positive values favour FBTP, negative values favour NFBTP.',
+        'feature_contribution_unavailable': 'Feature contributions are only available for the trained (Real) model.',
         'result_interpretation': 'Result Interpretation:',
         'prediction_disclaimer': 'This prediction is based on machine learning model analysis, only as a clinical decision support tool, and should not replace the physician\'s professional judgment. Specific treatment plans should be formulated by clinicians based on the patient\'s overall condition.',
         'footer': '© 2025 mCRPC [177Lu]Lu-PSMA Therapy Response Prediction | Developed based on the paper <a href="https://www.mdpi.com/2075-4426/14/11/1068" target="_blank">\'Predicting Response to [177Lu]Lu-PSMA Therapy in mCRPC Using Machine Learning\'</a>',
@@ -64,9 +69,9 @@ TRANSLATIONS = {
         
         # 特征分析
         'feature': 'Feature',
-        'importance_score': 'Importance Score',
-        'relative_importance': 'Relative Importance',
-        'top_features': 'Top 10 Most Important Features',
+        'importance_score': 'Contribution',
+        'relative_importance': 'Change in FBTP Probability',
+        'top_features': 'Top 10 Contributing Features',
         
         # 登录相关
         'login_title': 'Login System',
@@ -89,6 +94,55 @@ TRANSLATIONS = {
         'value': 'Value',
         'no_prediction_history': 'No prediction history available.',
         
+        # 批量预测
+        'batch_tab': 'Batch Scoring',
+        'batch_scoring_title': 'Cohort Batch Scoring',
+        'batch_upload_label': 'Upload a CSV or Parquet file with a patient ID column and the 14 feature columns',
+        'batch_id_column': 'Patient ID column',
+        'batch_chunk_size': 'Rows per chunk',
+        'batch_start_button': 'Score Cohort',
+        'batch_missing_columns': 'The file is missing required columns:',
+        'batch_scoring_progress': 'Scored {done} of {total} patients',
+        'batch_scoring_done': 'Scored {scored} patients ({invalid} rows skipped because of invalid feature values).',
+        'batch_download_button': 'Download Results (CSV)',
+        
+        # 历史记录筛选和分页
+        'history_filters': 'Filters',
+        'history_all': 'All',
+        'history_date_range': 'Date range',
+        'history_probability_band': 'FBTP probability range',
+        'history_page_size': 'Rows per page',
+        'history_previous_page': '← Previous',
+        'history_next_page': 'Next →',
+        'history_page_info': 'Page {page} · {total} matching predictions',
+        
+        # 模型版本
+        'model_fingerprint': 'Model Version',
+        
+        # 影子评分
+        'shadow_summary_title': 'Shadow Model Comparison',
+        'shadow_summary_empty': 'No shadow predictions recorded yet.',
+        'shadow_scorer_status': 'Shadow scorer: {candidates} candidates, queue depth {queue_depth}, {scored} scored, {dropped} dropped, {errors} errors',
+        'shadow_disagreements_title': 'Disagreements with the Current Model',
+        
+        # 假设分析
+        'whatif_title': 'What-if Analysis',
+        'whatif_note': 'How the FBTP probability of patient {patient_id} would change if the selected features took other values (all other features unchanged).',
+        'whatif_feature': 'Feature to vary',
+        'whatif_second_feature': 'Second feature (heatmap)',
+        'whatif_none': 'None',
+        'whatif_points': 'Grid points',
+        'whatif_current': 'Current patient',
+        
+        # 不确定性分析
+        'uncertainty_title': 'Measurement Uncertainty',
+        'uncertainty_note': "Each measured feature is perturbed with Gaussian noise (relative: SD as a fraction of the value; absolute: SD in the feature's unit) and all draws are scored at once.",
+        'uncertainty_noise_type': 'Noise type',
+        'uncertainty_noise_sd': 'Noise SD',
+        'uncertainty_draws': 'Draws',
+        'uncertainty_interval': '{level:.0%} probability interval',
+        'uncertainty_flip_rate': 'Draws that flip the prediction',
+        
         # 其他
         'yes': 'Yes',
         'no': 'No',
@@ -120,7 +174,8 @@ TRANSLATIONS = {
         'prediction_results': 'Résultats de la Prédiction',
         'prediction_probability': 'Probabilité de Prédiction:',
         'feature_contribution': 'Analyse de la Contribution des Caractéristiques',
-        'feature_importance_note': 'Remarque: Ce qui suit est un exemple de contributions de caractéristiques basé sur les données d\'entrée actuelles. Le modèle réel fournira une analyse plus précise.',
+        'feature_importance_note': 'Chaque barre indique dans quelle mesure la caractéristique a modifié la probabilité FBTP de ce patient par rapport à un patient moyen des données d\'entraînement. Les valeurs positives favorisent FBTP, les valeurs négatives favorisent NFBTP.',
+        'feature_contribution_unavailable': 'Les contributions des caractéristiques ne sont disponibles que pour le modèle entraîné (Real).',
         'result_interpretation': 'Interprétation des Résultats:',
         'prediction_disclaimer': 'Cette prédiction est basée sur l\'analyse de modèles d\'apprentissage automatique, uniquement comme outil d\'aide à la décision clinique, et ne doit pas remplacer le jugement professionnel du médecin. Les plans de traitement spécifiques doivent être formulés par les cliniciens en fonction de l\'état général du patient.',
         'footer': '© 2025 mCRPC [177Lu]Lu-PSMA Therapy Response Prediction | Développé sur la base de l\'article <a href="https://www.mdpi.com/2075-4426/14/11/1068" target="_blank">\'Predicting Response to [177Lu]Lu-PSMA Therapy in mCRPC Using Machine Learning\'</a>',
@@ -158,9 +213,9 @@ TRANSLATIONS = {
         
         # 特征分析
         'feature': 'Caractéristique',
-        'importance_score': 'Score d\'Importance',
-        'relative_importance': 'Importance Relative',
-        'top_features': 'Top 10 des Caractéristiques les Plus Importantes',
+        'importance_score': 'Contribution',
+        'relative_importance': 'Variation de la Probabilité FBTP',
+        'top_features': 'Top 10 des Caractéristiques les Plus Contributives',
         
         # 登录相关
         'login_title': 'Système de Connexion',
@@ -183,6 +238,55 @@ TRANSLATIONS = {
         'value': 'Valeur',
         'no_prediction_history': 'Aucun historique de prédiction disponible.',
         
+        # 批量预测
+        'batch_tab': 'Prédiction par Lot',
+        'batch_scoring_title': 'Prédiction de Cohorte par Lot',
+        'batch_upload_label': "Téléchargez un fichier CSV ou Parquet contenant une colonne d'identifiant patient et les 14 colonnes de caractéristiques",
+        'batch_id_column': "Colonne d'identifiant patient",
+        'batch_chunk_size': 'Lignes par bloc',
+        'batch_start_button': 'Évaluer la Cohorte',
+        'batch_missing_columns': 'Colonnes requises manquantes dans le fichier :',
+        'batch_scoring_progress': '{done} patients évalués sur {total}',
+        'batch_scoring_done': '{scored} patients évalués ({invalid} lignes ignorées en raison de valeurs invalides).',
+        'batch_download_button': 'Télécharger les Résultats (CSV)',
+        
+        # 历史记录筛选和分页
+        'history_filters': 'Filtres',
+        'history_all': 'Tous',
+        'history_date_range': 'Période',
+        'history_probability_band': 'Plage de probabilité FBTP',
+        'history_page_size': 'Lignes par page',
+        'history_previous_page': '← Précédent',
+        'history_next_page': 'Suivant →',
+        'history_page_info': 'Page {page} · {total} prédictions correspondantes',
+        
+        # 模型版本
+        'model_fingerprint': 'Version du Modèle',
+        
+        # 影子评分
+        'shadow_summary_title': 'Comparaison des Modèles Fantômes',
+        'shadow_summary_empty': 'Aucune prédiction fantôme enregistrée pour le moment.',
+        'shadow_scorer_status': "Évaluateur fantôme : {candidates} modèles candidats, file d'attente {queue_depth}, {scored} évalués, {dropped} abandonnés, {errors} erreurs",
+        'shadow_disagreements_title': 'Désaccords avec le Modèle Actuel',
+        
+        # 假设分析
+        'whatif_title': 'Analyse de Scénarios',
+        'whatif_note': "Évolution de la probabilité FBTP du patient {patient_id} si les caractéristiques sélectionnées prenaient d'autres valeurs (toutes les autres caractéristiques restant inchangées).",
+        'whatif_feature': 'Caractéristique à faire varier',
+        'whatif_second_feature': 'Seconde caractéristique (carte de chaleur)',
+        'whatif_none': 'Aucune',
+        'whatif_points': 'Points de la grille',
+        'whatif_current': 'Patient actuel',
+        
+        # 不确定性分析
+        'uncertainty_title': 'Incertitude de Mesure',
+        'uncertainty_note': "Chaque caractéristique mesurée est perturbée par un bruit gaussien (relatif : écart-type en proportion de la valeur ; absolu : écart-type dans l'unité de la caractéristique) et tous les tirages sont évalués en une fois.",
+        'uncertainty_noise_type': 'Type de bruit',
+        'uncertainty_noise_sd': 'Écart-type du bruit',
+        'uncertainty_draws': 'Tirages',
+        'uncertainty_interval': 'Intervalle de probabilité à {level:.0%}',
+        'uncertainty_flip_rate': 'Tirages qui inversent la prédiction',
+        
         # 其他
         'yes': 'Oui',
         'no': 'Non',
@@ -214,7 +318,8 @@ TRANSLATIONS = {
         'prediction_results': '预测结果',
         'prediction_probability': '预测概率:',
         'feature_contribution': '特征贡献分析',
-        'feature_importance_note': '注意：以下是基于当前输入数据的特征贡献示例。实际模型将提供更准确的分析。',
+        'feature_importance_note': '每个条形表示该特征相对于训练数据中的平均患者，使该患者的FBTP概率改变了多少。正值倾向FBTP，负值倾向NFBTP。',
+        'feature_contribution_unavailable': '特征贡献仅适用于训练好的模型（Real Model）。',
         'result_interpretation': '结果解释:',
         'prediction_disclaimer': '该预测基于机器学习模型分析，仅作为临床决策辅助工具，不应替代医生的专业判断。具体治疗方案应由临床医生根据患者的整体情况制定。',
         'footer': '© 2025 mCRPC [177Lu]Lu-PSMA 治疗响应预测 | 基于论文<a href="https://www.mdpi.com/2075-4426/14/11/1068" target="_blank">《使用机器学习预测mCRPC对[177Lu]Lu-PSMA治疗的响应》</a>开发',
@@ -252,9 +357,9 @@ TRANSLATIONS = {
         
         # 特征分析
         'feature': '特征',
-        'importance_score': '重要性得分',
-        'relative_importance': '相对重要性',
-        'top_features': '前10个最重要特征',
+        'importance_score': '贡献值',
+        'relative_importance': 'FBTP概率变化',
+        'top_features': '贡献最大的前10个特征',
         
         # 登录相关
         'login_title': '登录系统',
@@ -277,6 +382,55 @@ TRANSLATIONS = {
         'value': '值',
         'no_prediction_history': '暂无预测历史记录。',
         
+        # 批量预测
+        'batch_tab': '批量预测',
+        'batch_scoring_title': '队列批量预测',
+        'batch_upload_label': '上传包含患者ID列和14个特征列的CSV或Parquet文件',
+        'batch_id_column': '患者ID列',
+        'batch_chunk_size': '每块行数',
+        'batch_start_button': '开始批量预测',
+        'batch_missing_columns': '文件缺少以下必需的列：',
+        'batch_scoring_progress': '已预测 {done} / {total} 名患者',
+        'batch_scoring_done': '已预测 {scored} 名患者（{invalid} 行因特征值无效被跳过）。',
+        'batch_download_button': '下载结果 (CSV)',
+        
+        # 历史记录筛选和分页
+        'history_filters': '筛选条件',
+        'history_all': '全部',
+        'history_date_range': '日期范围',
+        'history_probability_band': 'FBTP概率范围',
+        'history_page_size': '每页行数',
+        'history_previous_page': '← 上一页',
+        'history_next_page': '下一页 →',
+        'history_page_info': '第 {page} 页 · 共 {total} 条匹配记录',
+        
+        # 模型版本
+        'model_fingerprint': '模型版本',
+        
+        # 影子评分
+        'shadow_summary_title': '影子模型对照',
+        'shadow_summary_empty': '暂无影子评分记录。',
+        'shadow_scorer_status': '影子评分：{candidates}个候选模型，队列长度{queue_depth}，已评分{scored}条，丢弃{dropped}条，错误{errors}次',
+        'shadow_disagreements_title': '与当前模型不一致的结果',
+        
+        # 假设分析
+        'whatif_title': '假设分析',
+        'whatif_note': '如果所选特征取其他值（其他特征保持不变），患者 {patient_id} 的FBTP概率将如何变化。',
+        'whatif_feature': '变化的特征',
+        'whatif_second_feature': '第二个特征（热图）',
+        'whatif_none': '无',
+        'whatif_points': '网格点数',
+        'whatif_current': '当前患者',
+        
+        # 不确定性分析
+        'uncertainty_title': '测量不确定性',
+        'uncertainty_note': '对每个测量特征加入高斯噪声（相对：标准差为测量值的比例；绝对：标准差与特征单位相同），所有抽样一次完成预测。',
+        'uncertainty_noise_type': '噪声类型',
+        'uncertainty_noise_sd': '噪声标准差',
+        'uncertainty_draws': '抽样次数',
+        'uncertainty_interval': '{level:.0%} 概率区间',
+        'uncertainty_flip_rate': '预测类别改变的抽样比例',
+        
         # 其他
         'yes': '是',
         'no': '否',
@@ -295,15 +449,60 @@ TRANSLATIONS = {
     }
 }
 
+def _compile_translations():
+    """
+    为每种语言生成合并后的翻译表，缺失的键直接使用英语文本填充。
+    
+    返回:
+        tuple: (合并后的翻译表, 每种语言的校验报告)
+    """
+    english = TRANSLATIONS['en']
+    compiled = {}
+    report = {}
+    for lang, table in TRANSLATIONS.items():
+        compiled[lang] = {**english, **table}
+        report[lang] = {
+            'missing': sorted(set(english) - set(table)),  # 使用英语回退的键
+            'extra': sorted(set(table) - set(english))     # 英语中不存在的键
+        }
+    return compiled, report
+
+# 导入时一次性生成的翻译表和校验报告
+COMPILED_TRANSLATIONS, VALIDATION_REPORT = _compile_translations()
+
+for _lang, _issues in VALIDATION_REPORT.items():
+    if _issues['missing'] or _issues['extra']:
+        logger.warning(
+            "Translations for '%s': %d missing keys %s, %d extra keys %s",
+            _lang, len(_issues['missing']), _issues['missing'], len(_issues['extra']), _issues['extra']
+        )
+
 def get_text(key, lang="en"):
     """获取指定语言的文本"""
-    if lang not in TRANSLATIONS:
-        lang = "en"  # 默认使用英语
-    
-    if key not in TRANSLATIONS[lang]:
-        # 如果在指定语言中找不到该键，尝试从英语中获取
-        if key in TRANSLATIONS["en"]:
-            return TRANSLATIONS["en"][key]
+    # 不支持的语言默认使用英语
+    table = COMPILED_TRANSLATIONS.get(lang, COMPILED_TRANSLATIONS["en"])
+    try:
+        return table[key]
+    except KeyError:
         return f"Missing: {key}"  # 如果完全找不到，返回错误信息
+
+@functools.lru_cache(maxsize=None)
+def get_translator(lang="en"):
+    """
+    返回绑定到指定语言的翻译函数，查找时只做一次字典访问。
+    
+    参数:
+        lang (str): 语言代码，不支持的语言使用英语。
+    
+    返回:
+        function: translate(key) -> str
+    """
+    table = COMPILED_TRANSLATIONS.get(lang, COMPILED_TRANSLATIONS["en"])
+    
+    def translate(key):
+        try:
+            return table[key]
+        except KeyError:
+            return f"Missing: {key}"
     
-    return TRANSLATIONS[lang][key] 
+    return translate
@@ -0,0 +1,327 @@
+"""
+SVC元分类器的并行超参数搜索。
+
+基础层的样本外概率矩阵只计算一次（与train_models共用磁盘缓存），之后每个候选参数只需在
+三列的元特征上训练SVC。候选参数按 (核函数, gamma) 分组交给进程池，每组的核矩阵只计算一次，
+组内所有C值和所有折都复用它（SVC(kernel='precomputed')）。每个候选在逐折评估时，若前几折的
+平均得分已明显落后于所有进程共享的当前最佳得分，则提前停止。
+
+搜索期间按决策函数计算AUC/准确率（不需要Platt缩放的内部交叉验证），最终只对胜出的参数
+训练带概率输出的SVC，并与基础模型一起写入新的版本目录，附带完整的排名报告。
+
+用法示例:
+    python -m tune_meta cohort.csv --label-column label --workers 8
+    python -m tune_meta cohort.csv --search random --n-iter 200 --kernels rbf,sigmoid --activate
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import warnings
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.metrics import accuracy_score, roc_auc_score
+from sklearn.metrics.pairwise import pairwise_kernels
+from sklearn.svm import SVC
+
+from train_models import (DEFAULT_FOLDS, DEFAULT_LABEL_COLUMN, DEFAULT_SEED,
+                          MANIFEST_FILE, MODEL_VERSIONS_DIR, POSITIVE_LABEL,
+                          TRAINING_CACHE_DIR, activate_version, classification_metrics,
+                          compute_base_layer, cross_validate_meta, load_cohort,
+                          make_meta_classifier, write_version)
+
+# 默认的搜索空间
+DEFAULT_KERNELS = ['rbf', 'linear', 'poly', 'sigmoid']
+DEFAULT_C_VALUES = [0.01, 0.1, 1.0, 10.0, 100.0, 1000.0]
+DEFAULT_GAMMA_VALUES = ['scale', 0.01, 0.1, 1.0, 10.0, 100.0]
+
+# 随机搜索：C在对数区间内连续取值，gamma从对数网格中取值，以便同一gamma的候选共用核矩阵
+RANDOM_C_RANGE = (1e-2, 1e3)
+RANDOM_GAMMA_GRID = np.logspace(-3, 2, 16)
+DEFAULT_N_ITER = 60
+
+# 提前停止：至少评估EARLY_STOP_MIN_FOLDS折后，平均得分低于当前最佳得分减去EARLY_STOP_MARGIN时停止
+EARLY_STOP_MIN_FOLDS = 2
+EARLY_STOP_MARGIN = 0.05
+
+# 搜索期间libsvm的迭代上限：未在上限内收敛的候选（常见于大gamma、大C的多项式核）直接停止评估
+SEARCH_MAX_ITER = 20000
+
+# 排名指标
+METRICS = ('auc', 'accuracy')
+TUNING_REPORT_FILE = 'tuning_report.json'
+
+# 工作进程中的元特征、标签、折划分和共享的最佳得分
+_worker_state = None
+
+def resolve_gamma(gamma, X):
+    """将 'scale'/'auto' 换算为数值，与SVC的定义一致（预计算核矩阵时需要具体数值）"""
+    if gamma == 'scale':
+        variance = X.var()
+        return 1.0 / (X.shape[1] * variance) if variance > 0 else 1.0
+    if gamma == 'auto':
+        return 1.0 / X.shape[1]
+    return float(gamma)
+
+def svc_kernel_params(kernel, gamma):
+    """pairwise_kernels的参数，取SVC的默认值（pairwise_kernels的coef0默认为1，SVC为0）"""
+    if kernel == 'linear':
+        return {}
+    params = {'gamma': gamma}
+    if kernel in ('poly', 'sigmoid'):
+        params['coef0'] = 0.0
+    if kernel == 'poly':
+        params['degree'] = 3
+    return params
+
+def grid_candidates(kernels=DEFAULT_KERNELS, c_values=DEFAULT_C_VALUES, gamma_values=DEFAULT_GAMMA_VALUES):
+    """网格搜索的候选参数，线性核与gamma无关只保留一份"""
+    candidates = []
+    for kernel in kernels:
+        for gamma in ([None] if kernel == 'linear' else gamma_values):
+            for C in c_values:
+                params = {'kernel': kernel, 'C': float(C)}
+                if gamma is not None:
+                    params['gamma'] = gamma
+                candidates.append(params)
+    return candidates
+
+def random_candidates(n_iter=DEFAULT_N_ITER, kernels=DEFAULT_KERNELS, seed=DEFAULT_SEED):
+    """随机搜索的候选参数：C按对数均匀分布抽样，gamma从RANDOM_GAMMA_GRID中抽样"""
+    rng = np.random.default_rng(seed)
+    low, high = np.log10(RANDOM_C_RANGE[0]), np.log10(RANDOM_C_RANGE[1])
+    candidates = []
+    for _ in range(n_iter):
+        kernel = str(rng.choice(kernels))
+        params = {'kernel': kernel, 'C': float(10 ** rng.uniform(low, high))}
+        if kernel != 'linear':
+            params['gamma'] = float(rng.choice(RANDOM_GAMMA_GRID))
+        candidates.append(params)
+    return candidates
+
+def group_by_kernel(candidates, X):
+    """按 (核函数, 数值gamma) 分组，同组的候选共用一个核矩阵"""
+    groups = defaultdict(list)
+    for params in candidates:
+        gamma = resolve_gamma(params['gamma'], X) if 'gamma' in params else None
+        groups[(params['kernel'], gamma)].append(params)
+    return list(groups.items())
+
+def _init_worker(X, y, assignment, metric, best_score, min_folds, margin):
+    """工作进程初始化：接收一次元特征和共享的最佳得分"""
+    global _worker_state
+    _worker_state = {
+        'X': X,
+        'positive': (y == POSITIVE_LABEL).astype(int),
+        'assignment': assignment,
+        'folds': np.unique(assignment),
+        'metric': metric,
+        'best': best_score,
+        'min_folds': min_folds,
+        'margin': margin,
+    }
+
+def _score(metric, positive, decision):
+    """按决策函数计算一折的得分"""
+    if metric == 'auc':
+        return roc_auc_score(positive, decision)
+    return accuracy_score(positive, decision > 0)
+
+def _evaluate_group(kernel, gamma, candidates):
+    """
+    在工作进程中评估同一核矩阵下的所有候选参数。
+    
+    返回:
+        list: 每个候选一项 (参数, 每折得分列表, 状态, 耗时)，状态为 'completed'、'pruned' 或 'unconverged'
+    """
+    warnings.filterwarnings('ignore', category=ConvergenceWarning)
+    state = _worker_state
+    X, positive, assignment = state['X'], state['positive'], state['assignment']
+    start = time.perf_counter()
+    gram = pairwise_kernels(X, metric=kernel, **svc_kernel_params(kernel, gamma))
+    kernel_seconds = time.perf_counter() - start
+    
+    splits = [(np.flatnonzero(assignment != fold), np.flatnonzero(assignment == fold)) for fold in state['folds']]
+    results = []
+    for params in candidates:
+        start = time.perf_counter()
+        scores = []
+        status = 'completed'
+        for train, val in splits:
+            svc = SVC(kernel='precomputed', C=params['C'], max_iter=SEARCH_MAX_ITER)
+            svc.fit(gram[np.ix_(train, train)], positive[train])
+            if svc.n_iter_.max() >= SEARCH_MAX_ITER:
+                status = 'unconverged'
+                break
+            scores.append(_score(state['metric'], positive[val], svc.decision_function(gram[np.ix_(val, train)])))
+            # 已明显落后于当前最佳得分时停止评估剩余的折
+            if len(scores) >= state['min_folds'] and len(scores) < len(splits):
+                if np.mean(scores) < state['best'].value - state['margin']:
+                    status = 'pruned'
+                    break
+        if status == 'completed':
+            with state['best'].get_lock():
+                state['best'].value = max(state['best'].value, float(np.mean(scores)))
+        results.append((params, scores, status, time.perf_counter() - start + kernel_seconds / len(candidates)))
+    return results
+
+def search(oof, y, assignment, candidates, metric='auc', workers=None,
+           min_folds=EARLY_STOP_MIN_FOLDS, margin=EARLY_STOP_MARGIN):
+    """
+    并行评估候选参数。
+    
+    参数:
+        oof (ndarray): 基础层的样本外概率 shape=[n, 3]。
+        y (ndarray): FBTP/NFBTP标签。
+        assignment (ndarray): 每行的折编号。
+        candidates (list): 候选参数字典列表（kernel、C和可选的gamma）。
+        metric (str): 排名指标，'auc' 或 'accuracy'。
+        workers (int): 进程数，默认为CPU核数。
+        min_folds (int): 提前停止前至少评估的折数，大于等于折数时不提前停止。
+        margin (float): 提前停止的得分差距。
+    
+    返回:
+        list: 按平均得分降序排列的结果字典（提前停止或未收敛的候选排在完成的候选之后）
+    """
+    groups = group_by_kernel(candidates, oof)
+    best_score = multiprocessing.Value('d', -np.inf)
+    initargs = (oof, y, assignment, metric, best_score, min_folds, margin)
+    workers = min(workers or os.cpu_count() or 1, len(groups))
+    
+    # 候选较多的组先提交，减少最后只剩一个进程在运行的时间
+    groups.sort(key=lambda group: len(group[1]), reverse=True)
+    if workers <= 1:
+        _init_worker(*initargs)
+        outputs = [_evaluate_group(kernel, gamma, params) for (kernel, gamma), params in groups]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            futures = [executor.submit(_evaluate_group, kernel, gamma, params) for (kernel, gamma), params in groups]
+            outputs = [future.result() for future in futures]
+    
+    rows = []
+    for output in outputs:
+        for params, scores, status, seconds in output:
+            rows.append({
+                'params': params,
+                'mean': float(np.mean(scores)) if scores else None,
+                'std': float(np.std(scores)) if scores else None,
+                'folds_evaluated': len(scores),
+                'status': status,
+                'seconds': seconds,
+            })
+    rows.sort(key=lambda row: (row['status'] == 'completed', -np.inf if row['mean'] is None else row['mean']), reverse=True)
+    for rank, row in enumerate(rows, 1):
+        row['rank'] = rank
+    return rows
+
+def _parse_list(value, convert=str):
+    return [convert(item.strip()) for item in value.split(',') if item.strip()]
+
+def _parse_gamma(value):
+    return value if value in ('scale', 'auto') else float(value)
+
+def _format_params(params):
+    gamma = params.get('gamma')
+    gamma = '-' if gamma is None else gamma if isinstance(gamma, str) else f"{gamma:.4g}"
+    return f"{params['kernel']:<8} C={params['C']:<10.4g} gamma={gamma}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search SVC meta-classifier hyperparameters on cached out-of-fold base-layer outputs.")
+    parser.add_argument('cohort', help="Labelled cohort file (CSV or Parquet) with the 14 feature columns")
+    parser.add_argument('--label-column', default=DEFAULT_LABEL_COLUMN, help=f"Column holding FBTP/NFBTP (or 1/0) labels (default: {DEFAULT_LABEL_COLUMN})")
+    parser.add_argument('--folds', type=int, default=DEFAULT_FOLDS, help=f"Cross-validation folds (default: {DEFAULT_FOLDS})")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help=f"Random seed (default: {DEFAULT_SEED})")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument('--search', choices=['grid', 'random'], default='grid', help="Search strategy (default: grid)")
+    parser.add_argument('--n-iter', type=int, default=DEFAULT_N_ITER, help=f"Candidates for random search (default: {DEFAULT_N_ITER})")
+    parser.add_argument('--kernels', type=_parse_list, default=DEFAULT_KERNELS, help="Comma-separated kernels (default: rbf,linear,poly,sigmoid)")
+    parser.add_argument('--C', dest='c_values', type=lambda value: _parse_list(value, float), default=DEFAULT_C_VALUES,
+                        help="Comma-separated C values for grid search")
+    parser.add_argument('--gamma', dest='gamma_values', type=lambda value: _parse_list(value, _parse_gamma), default=DEFAULT_GAMMA_VALUES,
+                        help="Comma-separated gamma values for grid search ('scale', 'auto' or numbers)")
+    parser.add_argument('--metric', choices=METRICS, default='auc', help="Ranking metric (default: auc)")
+    parser.add_argument('--min-folds', type=int, default=EARLY_STOP_MIN_FOLDS,
+                        help=f"Folds evaluated before a candidate may be stopped early (default: {EARLY_STOP_MIN_FOLDS})")
+    parser.add_argument('--margin', type=float, default=EARLY_STOP_MARGIN,
+                        help=f"Stop a candidate whose running score trails the best by more than this (default: {EARLY_STOP_MARGIN})")
+    parser.add_argument('--no-early-stopping', action='store_true', help="Evaluate every candidate on all folds")
+    parser.add_argument('--cache-dir', default=TRAINING_CACHE_DIR, help=f"Base-layer cache shared with train_models (default: {TRAINING_CACHE_DIR})")
+    parser.add_argument('--output-dir', default=MODEL_VERSIONS_DIR, help=f"Directory for the winning artifact set (default: {MODEL_VERSIONS_DIR})")
+    parser.add_argument('--top', type=int, default=10, help="Candidates shown in the printed ranking (default: 10)")
+    parser.add_argument('--activate', action='store_true', help="Install the winning model set as the current models")
+    args = parser.parse_args(argv)
+    
+    X, y = load_cohort(args.cohort, args.label_column)
+    start = time.perf_counter()
+    base = compute_base_layer(X, y, args.folds, args.seed, args.workers, args.cache_dir)
+    base_seconds = time.perf_counter() - start
+    
+    if args.search == 'grid':
+        candidates = grid_candidates(args.kernels, args.c_values, args.gamma_values)
+    else:
+        candidates = random_candidates(args.n_iter, args.kernels, args.seed)
+    start = time.perf_counter()
+    ranking = search(
+        base['oof'], y, base['folds'], candidates, metric=args.metric, workers=args.workers,
+        min_folds=args.folds if args.no_early_stopping else args.min_folds, margin=args.margin
+    )
+    search_seconds = time.perf_counter() - start
+    
+    if ranking[0]['status'] != 'completed':
+        print("No candidate completed cross-validation; widen the search space or disable early stopping", file=sys.stderr)
+        return 1
+    
+    # 只为胜出的参数训练带概率输出的SVC
+    best = ranking[0]['params']
+    start = time.perf_counter()
+    svc_meta = make_meta_classifier(best, args.seed).fit(base['oof'], y)
+    meta_probabilities = cross_validate_meta(base['oof'], y, base['folds'], best, args.seed)
+    refit_seconds = time.perf_counter() - start
+    
+    report = {
+        'metric': args.metric,
+        'search': args.search,
+        'candidates': len(candidates),
+        'kernel_matrices': len(group_by_kernel(candidates, base['oof'])),
+        'pruned': sum(row['status'] == 'pruned' for row in ranking),
+        'unconverged': sum(row['status'] == 'unconverged' for row in ranking),
+        'timings': {'base_layer_s': base_seconds, 'search_s': search_seconds, 'refit_s': refit_seconds},
+        'ranking': ranking,
+    }
+    manifest = {
+        'source': os.path.abspath(args.cohort),
+        'cohort_key': base['key'],
+        'rows': int(len(y)),
+        'folds': args.folds,
+        'seed': args.seed,
+        'svc_params': best,
+        'base_layer_cached': base['cached'],
+        'tuning': {key: value for key, value in report.items() if key != 'ranking'},
+        'metrics': {'stacked': classification_metrics(y, meta_probabilities)},
+    }
+    version_dir, fingerprint = write_version(base['base_models'], svc_meta, manifest, args.output_dir)
+    with open(os.path.join(version_dir, TUNING_REPORT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    if args.activate:
+        activate_version(version_dir)
+    
+    print(f"Base layer: {base_seconds:.2f} s{' (cached)' if base['cached'] else ''}; "
+          f"searched {len(candidates)} candidates over {report['kernel_matrices']} kernel matrices "
+          f"in {search_seconds:.2f} s ({report['pruned']} stopped early, {report['unconverged']} did not converge)")
+    for row in ranking[:args.top]:
+        score = '-' if row['mean'] is None else f"{row['mean']:.4f} ± {row['std']:.4f}"
+        print(f"  {row['rank']:>3}. {_format_params(row['params'])}  {args.metric} {score}  [{row['status']}, {row['folds_evaluated']} folds]")
+    stacked = manifest['metrics']['stacked']
+    print(f"Winner refit in {refit_seconds:.2f} s: AUC {stacked['auc']:.3f}, accuracy {stacked['accuracy']:.3f}, log loss {stacked['log_loss']:.3f}")
+    print(f"Wrote {version_dir} (fingerprint {fingerprint[:12]}, report in {TUNING_REPORT_FILE}, manifest in {MANIFEST_FILE})")
+    if args.activate:
+        print("Activated as the current model set")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())